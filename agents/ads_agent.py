@@ -5,25 +5,28 @@ class AdsAgent:
     def __init__(self):
         print(" - AdsAgent (процессор) инициализирован.")
 
-    def analyze(self, nm_id: int, full_ads_report: List[Dict[str, Any]]) -> dict:
-        """Фильтрует общий список рекламных кампаний по nmId."""
+    def analyze(self, nm_id: int, ads_index: Dict[int, List[Dict[str, Any]]]) -> dict:
+        """Находит рекламные кампании nmId по готовому индексу (см. utils/ads_index.py)."""
         print(f"   [AdsAgent]: Поиск рекламы для nmId {nm_id}...")
         
-        if "error" in full_ads_report:
-            return full_ads_report
-        
-        relevant_ads = []
-        for campaign in full_ads_report:
-            # Проверяем, есть ли наш nm_id в списке 'nms' этой кампании
-            if isinstance(campaign.get("params"), list):
-                for param_set in campaign["params"]:
-                    if nm_id in param_set.get("nms", []):
-                        relevant_ads.append(campaign)
-                        break # Достаточно одного совпадения на кампанию
+        relevant_ads = ads_index.get(nm_id, [])
 
         return {
     "active_campaigns_count": len(relevant_ads),
     "campaign_ids": [ad.get("advertId") for ad in relevant_ads],
     "campaign_names": [ad.get("name") for ad in relevant_ads if ad.get("name")],
     # Можно добавить другие параметры, если нужны
-}
\ No newline at end of file
+}
+
+    def coverage(self, nm_ids: List[int], ads_index: Dict[int, List[Dict[str, Any]]]) -> dict:
+        """Покрытие каталога рекламой: какие nmId рекламируются и в скольких кампаниях."""
+        campaigns_by_nm_id = {nm_id: len(ads_index.get(nm_id, [])) for nm_id in nm_ids}
+        covered = [nm_id for nm_id, count in campaigns_by_nm_id.items() if count]
+        total = len(campaigns_by_nm_id)
+        return {
+            "total_nm_ids": total,
+            "covered_count": len(covered),
+            "coverage_percent": round(len(covered) / total * 100, 2) if total else 0,
+            "uncovered_nm_ids": [nm_id for nm_id, count in campaigns_by_nm_id.items() if not count],
+            "campaigns_by_nm_id": campaigns_by_nm_id,
+        }
@@ -7,7 +7,7 @@ class AudienceAgent:
 
     def analyze(self, analytics_data_by_period: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
         """
-        Анализирует данные по статистике для ДВУХ периодов.
+        Анализирует данные по статистике для всех запрошенных периодов (period_1..period_N).
         """
         print(f"   [AudienceAgent]: Сравнительный анализ статистики воронки...")
         
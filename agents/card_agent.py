@@ -1,12 +1,12 @@
 # Файл: agents/card_agent.py (ФИНАЛЬНАЯ ВЕРСИЯ)
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from utils.wb_charcs_cache import get_required_charcs
 
 class CardAgent:
     def __init__(self):
         print(" - CardAgent (процессор) инициализирован.")
 
-    def analyze(self, product_card: dict) -> dict:
+    def analyze(self, product_card: dict, required_charcs: Optional[set] = None) -> dict:
         if not product_card:
             return {"error": "Product card data not provided"}
 
@@ -40,7 +40,11 @@ class CardAgent:
         videos_ok = videos >= 1
         
         subject_id = product_card.get("subjectID") or product_card.get("subjectId")
-        required = get_required_charcs(subject_id) if subject_id else set()
+        # Из асинхронного анализа характеристики приходят уже загруженными (required_charcs)
+        if required_charcs is not None:
+            required = required_charcs
+        else:
+            required = get_required_charcs(subject_id) if subject_id else set()
         present = set(attr.get("name") for attr in product_card.get("characteristics", []))
         missing = required - present if required else set()
 
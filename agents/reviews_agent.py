@@ -1,25 +1,64 @@
 # Файл: agents/reviews_agent.py
-from utils.marketplace_api import get_wb_reviews
+import asyncio
+from typing import Dict, List
+from config import REVIEWS_CONCURRENCY
+from utils import metrics
+from utils.http_client import run_sync
+from utils.marketplace_api import get_wb_reviews_async
+from utils.review_store import ReviewStore, watermark_timestamp
 
 class ReviewsAgent:
     def __init__(self, api_key: str):
         self.api_key = api_key
+        self.store = ReviewStore(api_key)
         print(" - ReviewsAgent (сборщик) инициализирован.")
 
     def analyze(self, nm_id: int) -> dict:
         """Запрашивает и анализирует отзывы для конкретного nmId."""
+        return run_sync(self.analyze_async(nm_id))
+
+    async def analyze_async(self, nm_id: int) -> dict:
+        """
+        Докачивает в локальное хранилище отзывы новее watermark и строит сводку
+        по накопленным счетчикам. Если докачка не удалась, сводка строится по уже
+        сохраненным отзывам; ошибка возвращается, только если их нет совсем.
+        """
         print(f"   [ReviewsAgent]: Анализ отзывов для nmId {nm_id}...")
-        
-        reviews_data = get_wb_reviews(self.api_key, nm_id)
-        if "error" in reviews_data:
-            return reviews_data
-
-        total = len(reviews_data)
-        avg_rating = sum(r.get("productValuation", 0) for r in reviews_data) / total if total else 0
-        
-        return {
-    "reviews_total": total,
-    "average_rating": round(avg_rating, 2),
-    "five_star_count": sum(1 for r in reviews_data if r.get("productValuation") == 5),
-    "recent_negative": [r for r in reviews_data if r.get("productValuation", 0) <= 3][:3]
-}
+        with metrics.AGENT_SECONDS.labels("reviews").time():
+            watermark = self.store.watermark(nm_id)
+            new_reviews = await get_wb_reviews_async(self.api_key, nm_id, date_from=watermark_timestamp(watermark))
+
+            # Список — отзывы, словарь {"error": ...} — ошибка загрузки
+            if isinstance(new_reviews, dict):
+                if not watermark:
+                    return new_reviews
+                print(f"   [WARN] [ReviewsAgent]: {new_reviews['error']}; используются сохраненные отзывы.")
+            else:
+                added = self.store.add_reviews(nm_id, new_reviews)
+                print(f"   [ReviewsAgent]: nmId {nm_id}: новых отзывов {added}.")
+            return self.store.summary(nm_id)
+
+    def start_many(self, nm_ids: List[int], max_concurrency: int = REVIEWS_CONCURRENCY) -> Dict[int, "asyncio.Task[dict]"]:
+        """
+        Запускает сбор отзывов для списка nmId с ограничением параллельности и сразу
+        возвращает задачи {nmId -> Task}. Задачи стартуют в порядке списка, поэтому
+        результаты для первых nmId готовы раньше. Ошибка по одному nmId не затрагивает остальные.
+        """
+        print(f"   [ReviewsAgent]: Пакетный сбор отзывов для {len(nm_ids)} nmId (параллельно до {max_concurrency})...")
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def analyze_one(nm_id: int) -> dict:
+            async with semaphore:
+                try:
+                    return await self.analyze_async(nm_id)
+                except Exception as e:
+                    print(f"   [ERROR] [ReviewsAgent]: Не удалось собрать отзывы для nmId {nm_id}: {e}")
+                    return {"error": f"Не удалось получить отзывы: {e}"}
+
+        return {nm_id: asyncio.create_task(analyze_one(nm_id)) for nm_id in nm_ids}
+
+    async def analyze_many_async(self, nm_ids: List[int], max_concurrency: int = REVIEWS_CONCURRENCY) -> Dict[int, dict]:
+        """Собирает отзывы для списка nmId пачкой и ждет завершения всех запросов."""
+        tasks = self.start_many(nm_ids, max_concurrency)
+        results = await asyncio.gather(*tasks.values())
+        return dict(zip(tasks.keys(), results))
@@ -1,42 +1,36 @@
 # Файл: agents/sales_agent.py (ФИНАЛЬНАЯ ВЕРСИЯ ДЛЯ СРАВНЕНИЯ)
-from typing import Dict, Any, List
+from typing import Dict, Any, Optional
+from utils.sales_aggregator import normalize_sku, SALE_DOC_TYPE
 
 class SalesAgent:
     def __init__(self):
         print(" - SalesAgent (процессор) инициализирован.")
 
-    def analyze(self, sku: str, sales_reports: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Any]:
+    def analyze(self, sku: str, sales_indexes: Dict[str, Optional[Dict[str, Dict[str, Dict[str, Any]]]]]) -> Dict[str, Any]:
         """
-        Анализирует отчеты о реализации для ДВУХ периодов, сохраняя data_source.
+        Анализирует продажи для всех запрошенных периодов (period_1..period_N), сохраняя data_source.
+        Принимает заранее агрегированные индексы (см. utils/sales_aggregator.py),
+        поэтому поиск итогов по SKU выполняется за O(1).
         """
         print(f"   [SalesAgent]: Сравнительный анализ продаж для SKU '{sku}'...")
         
         results_by_period = {}
-        normalized_sku = sku.replace(" ", "").lower()
+        normalized_sku = normalize_sku(sku)
 
-        for period_name, report_data in sales_reports.items():
+        for period_name, period_index in sales_indexes.items():
             
-            if not report_data or (isinstance(report_data, dict) and "error" in report_data):
+            if period_index is None:
+                results_by_period[period_name] = {"error": f"Отчет о реализации для {period_name} загружен не полностью."}
+                continue
+
+            if not period_index:
                 results_by_period[period_name] = {"error": f"Отчет о реализации для {period_name} пуст."}
                 continue
 
-            total_gross_revenue = 0
-            total_net_revenue = 0
-            items_sold = 0
-            
-            for item in report_data:
-                report_sku = item.get('sa_name')
-                if not report_sku:
-                    continue
-                
-                if normalized_sku == report_sku.replace(" ", "").lower():
-                    if item.get("doc_type_name") == "Продажа":
-                        quantity = item.get('quantity', 0)
-                        if quantity == 0: continue
-                        
-                        total_gross_revenue += item.get('retail_price_withdisc_rub', 0)
-                        total_net_revenue += item.get('ppvz_for_pay', 0)
-                        items_sold += quantity
+            totals = period_index.get(normalized_sku, {}).get(SALE_DOC_TYPE, {})
+            total_gross_revenue = totals.get("gross_revenue_rub", 0)
+            total_net_revenue = totals.get("net_revenue_rub", 0)
+            items_sold = totals.get("units", 0)
 
             print(f"     - {period_name}: Найдено {items_sold} проданных товаров. Gross: {total_gross_revenue:.2f}, Net: {total_net_revenue:.2f}")
 
@@ -48,4 +42,4 @@ class SalesAgent:
                 "data_source": "wb_realization_report_api_v5" # Ваше поле на месте!
             }
 
-        return results_by_period
\ No newline at end of file
+        return results_by_period
@@ -0,0 +1,310 @@
+# Файл: bench/fake_wb.py
+"""
+Локальный стенд, имитирующий эндпоинты WB API из utils/marketplace_api.py.
+Данные синтетические и детерминированные: одинаковые параметры дают одинаковый
+каталог, отчеты, кампании и отзывы. Все хосты WB обслуживаются одним сервером,
+приложение направляется на него через WB_API_BASE_URL.
+
+Запуск: python -m bench.fake_wb --skus 1000 --latency-ms 20 --port 8900
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import zlib
+from typing import Dict, Any, Iterator, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Дата последнего изменения остатков у всех строк каталога
+STOCKS_CHANGE_DATE = "2024-01-01T00:00:00"
+# updatedAt всех карточек стенда
+CARDS_UPDATED_AT = "2024-01-01T00:00:00Z"
+REVIEWS_START = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+SUBJECTS_COUNT = 50
+# Карточек на странице nm-report/detail
+DETAIL_PAGE_SIZE = 1000
+
+
+class FakeDataset:
+    """Генератор синтетических данных продавца заданного размера."""
+
+    def __init__(
+        self,
+        skus: int,
+        warehouses: int = 3,
+        sales_rate: float = 0.3,
+        reviews_per_sku: int = 20,
+        skus_per_campaign: int = 20,
+        seed: int = 42,
+    ):
+        self.skus = skus
+        self.warehouses = warehouses
+        self.sales_rate = sales_rate
+        self.reviews_per_sku = reviews_per_sku
+        self.skus_per_campaign = skus_per_campaign
+        self.seed = seed
+
+    def _rng(self, *key: Any) -> random.Random:
+        return random.Random(zlib.crc32(repr((self.seed,) + key).encode()))
+
+    @staticmethod
+    def sku(index: int) -> str:
+        return f"SKU{index:06d}"
+
+    @staticmethod
+    def nm_id(index: int) -> int:
+        return 100000 + index
+
+    def index_of(self, nm_id: int) -> Optional[int]:
+        index = nm_id - 100000
+        return index if 0 <= index < self.skus else None
+
+    def stocks(self) -> List[Dict[str, Any]]:
+        rows = []
+        for index in range(self.skus):
+            rng = self._rng("stocks", index)
+            for warehouse in range(self.warehouses):
+                quantity = rng.randint(0, 200)
+                rows.append({
+                    "lastChangeDate": STOCKS_CHANGE_DATE,
+                    "warehouseName": f"Склад {warehouse + 1}",
+                    "supplierArticle": self.sku(index),
+                    "nmId": self.nm_id(index),
+                    "barcode": f"46{index:08d}{warehouse:02d}",
+                    "quantity": quantity,
+                    "quantityFull": quantity + rng.randint(0, 20),
+                    "subject": f"Предмет {index % SUBJECTS_COUNT + 1}",
+                    "brand": "Bench",
+                })
+        return rows
+
+    def card(self, index: int) -> Dict[str, Any]:
+        rng = self._rng("card", index)
+        price = rng.randint(300, 5000)
+        return {
+            "nmID": self.nm_id(index),
+            "vendorCode": self.sku(index),
+            "subjectID": index % SUBJECTS_COUNT + 1,
+            "title": f"Товар {index}",
+            "brand": "Bench",
+            "description": "Описание товара " * rng.randint(0, 60),
+            "photos": [{"big": f"https://example.invalid/{index}/{n}.jpg"} for n in range(rng.randint(0, 8))],
+            "videos": [],
+            "characteristics": [{"name": f"Характеристика {n}", "value": ["да"]} for n in range(rng.randint(2, 8))],
+            "sizes": [{"priceInfos": [{"price": price, "discountedPrice": int(price * 0.8), "discount": 20}]}],
+            "updatedAt": CARDS_UPDATED_AT,
+        }
+
+    def charcs(self, subject_id: int) -> List[Dict[str, Any]]:
+        rng = self._rng("charcs", subject_id)
+        return [{"name": f"Характеристика {n}", "required": rng.random() < 0.3} for n in range(10)]
+
+    def realization_rows(self, date_from: datetime.date, date_to: datetime.date, after_rrd_id: int) -> Iterator[Dict[str, Any]]:
+        """Строки отчета о реализации по дням периода; rrd_id растет вместе с (день, SKU)."""
+        days = (date_to - date_from).days + 1
+        start = max(after_rrd_id, 0)
+        for position in range(start, days * self.skus):
+            day_offset, index = divmod(position, self.skus)
+            day = date_from + datetime.timedelta(days=day_offset)
+            rng = self._rng("sale", day.toordinal(), index)
+            if rng.random() >= self.sales_rate:
+                continue
+            quantity = rng.randint(1, 3)
+            retail = rng.randint(300, 5000) * quantity
+            yield {
+                "rrd_id": position + 1,
+                "rr_dt": day.isoformat(),
+                "sa_name": self.sku(index),
+                "nm_id": self.nm_id(index),
+                "doc_type_name": "Возврат" if rng.random() < 0.05 else "Продажа",
+                "quantity": quantity,
+                "retail_price_withdisc_rub": retail,
+                "ppvz_for_pay": round(retail * 0.75, 2),
+            }
+
+    def funnel_history(self, nm_ids: List[int], date_from: datetime.date, date_to: datetime.date) -> List[Dict[str, Any]]:
+        """История воронки по дням, как nm-report/detail/history."""
+        cards = []
+        for nm_id in nm_ids:
+            index = self.index_of(nm_id)
+            if index is None:
+                continue
+            history = []
+            day = date_from
+            while day <= date_to:
+                rng = self._rng("analytics", index, day.toordinal())
+                opens = rng.randint(10, 1000)
+                carts = int(opens * rng.uniform(0.02, 0.2))
+                orders = int(carts * rng.uniform(0.2, 0.8))
+                buyouts = int(orders * 0.8)
+                history.append({
+                    "dt": day.isoformat(),
+                    "openCardCount": opens,
+                    "addToCartCount": carts,
+                    "ordersCount": orders,
+                    "ordersSumRub": orders * rng.randint(300, 5000),
+                    "buyoutsCount": buyouts,
+                    "buyoutsSumRub": buyouts * rng.randint(300, 5000),
+                    "buyoutPercent": 80,
+                })
+                day += datetime.timedelta(days=1)
+            cards.append({"nmID": nm_id, "vendorCode": self.sku(index), "history": history})
+        return cards
+
+    def funnel_detail(self, nm_ids: Optional[List[int]], date_from: datetime.date, date_to: datetime.date, page: int) -> Dict[str, Any]:
+        """Страница итогов воронки за период, как nm-report/detail: суммы той же дневной истории."""
+        if nm_ids is None:
+            nm_ids = [self.nm_id(index) for index in range(self.skus)]
+        else:
+            nm_ids = [nm_id for nm_id in nm_ids if self.index_of(nm_id) is not None]
+        page_nm_ids = nm_ids[(page - 1) * DETAIL_PAGE_SIZE:page * DETAIL_PAGE_SIZE]
+        cards = []
+        for card in self.funnel_history(page_nm_ids, date_from, date_to):
+            selected = {
+                field: sum(day[field] for day in card["history"])
+                for field in ("openCardCount", "addToCartCount", "ordersCount", "ordersSumRub", "buyoutsCount", "buyoutsSumRub")
+            }
+            cards.append({"nmID": card["nmID"], "vendorCode": card["vendorCode"], "statistics": {"selectedPeriod": selected}})
+        return {"page": page, "isNextPage": page * DETAIL_PAGE_SIZE < len(nm_ids), "cards": cards}
+
+    def campaigns(self) -> List[Dict[str, Any]]:
+        campaigns = []
+        for number, first in enumerate(range(0, self.skus, self.skus_per_campaign)):
+            nms = [self.nm_id(index) for index in range(first, min(first + self.skus_per_campaign, self.skus))]
+            campaigns.append({"advertId": number + 1, "name": f"Кампания {number + 1}", "status": 9, "params": [{"nms": nms}]})
+        return campaigns
+
+    def feedbacks(self, nm_id: int, archive: bool) -> List[Dict[str, Any]]:
+        """Отзывы nmId от новых к старым; архивная часть — каждый третий отзыв."""
+        index = self.index_of(nm_id)
+        if index is None:
+            return []
+        rng = self._rng("feedbacks", index)
+        reviews = []
+        for number in range(self.reviews_per_sku):
+            created = REVIEWS_START + datetime.timedelta(hours=rng.randint(0, 24 * 600))
+            valuation = rng.choices((1, 2, 3, 4, 5), weights=(5, 5, 10, 30, 50))[0]
+            if (number % 3 == 0) == archive:
+                reviews.append({
+                    "id": f"{nm_id}-{number}",
+                    "nmId": nm_id,
+                    "createdDate": created.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                    "productValuation": valuation,
+                    "text": "Отзыв покупателя",
+                })
+        reviews.sort(key=lambda review: review["createdDate"], reverse=True)
+        return reviews
+
+
+def create_app(dataset: FakeDataset, latency_ms: float = 0) -> FastAPI:
+    app = FastAPI(title="Fake WB API")
+    stocks = dataset.stocks()
+
+    @app.middleware("http")
+    async def add_latency(request: Request, call_next):
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        return await call_next(request)
+
+    @app.get("/health")
+    async def health():
+        return {"skus": dataset.skus}
+
+    @app.get("/api/v1/supplier/stocks")
+    async def get_stocks(dateFrom: str):
+        return [row for row in stocks if row["lastChangeDate"] >= dateFrom]
+
+    @app.post("/content/v2/get/cards/list")
+    async def get_cards(request: Request):
+        settings = (await request.json()).get("settings", {})
+        nm_ids = settings.get("filter", {}).get("nmIDs")
+        if nm_ids is None:
+            # Синхронизация по курсору: карточки стенда не меняются с CARDS_UPDATED_AT
+            cursor = settings.get("cursor", {})
+            if cursor.get("updatedAt", "") > CARDS_UPDATED_AT:
+                return {"cards": [], "cursor": {"total": 0}}
+            nm_ids = [dataset.nm_id(index) for index in range(dataset.skus)]
+            nm_ids = [nm_id for nm_id in nm_ids if nm_id > cursor.get("nmID", 0)][:cursor.get("limit", 100)]
+        cards = [dataset.card(index) for index in map(dataset.index_of, nm_ids) if index is not None]
+        last = cards[-1] if cards else {}
+        return {"cards": cards, "cursor": {"updatedAt": last.get("updatedAt"), "nmID": last.get("nmID"), "total": len(cards)}}
+
+    @app.get("/public/api/v1/object/charcs/{subject_id}")
+    async def get_charcs(subject_id: int):
+        return dataset.charcs(subject_id)
+
+    @app.get("/api/v5/supplier/reportDetailByPeriod")
+    async def get_realization(dateFrom: str, dateTo: str, limit: int = 100000, rrdid: int = 0):
+        date_from = datetime.date.fromisoformat(dateFrom[:10])
+        date_to = datetime.date.fromisoformat(dateTo[:10])
+
+        def body() -> Iterator[str]:
+            # Как и WB, отдаем большой JSON-массив потоком
+            yield "["
+            for number, row in enumerate(dataset.realization_rows(date_from, date_to, rrdid)):
+                if number == limit:
+                    break
+                yield ("," if number else "") + json.dumps(row, ensure_ascii=False)
+            yield "]"
+
+        return StreamingResponse(body(), media_type="application/json")
+
+    @app.post("/api/v2/nm-report/detail")
+    async def get_funnel_detail(request: Request):
+        payload = await request.json()
+        period = payload.get("period", {})
+        date_from = datetime.date.fromisoformat(period["begin"][:10])
+        date_to = datetime.date.fromisoformat(period["end"][:10])
+        return {"data": dataset.funnel_detail(payload.get("nmIDs"), date_from, date_to, payload.get("page", 1)), "error": False}
+
+    @app.post("/api/v2/nm-report/detail/history")
+    async def get_funnel_history(request: Request):
+        payload = await request.json()
+        period = payload.get("period", {})
+        date_from = datetime.date.fromisoformat(period["begin"][:10])
+        date_to = datetime.date.fromisoformat(period["end"][:10])
+        return {"data": dataset.funnel_history(payload.get("nmIDs", []), date_from, date_to), "error": False}
+
+    @app.get("/adv/v1/promotion/adverts")
+    async def get_adverts():
+        return dataset.campaigns()
+
+    def feedbacks_page(nmId: int, take: int, skip: int, dateFrom: Optional[int], archive: bool) -> JSONResponse:
+        reviews = dataset.feedbacks(nmId, archive)
+        if dateFrom:
+            since = datetime.datetime.fromtimestamp(dateFrom, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+            reviews = [review for review in reviews if review["createdDate"] >= since]
+        return JSONResponse({"data": {"feedbacks": reviews[skip:skip + take]}, "error": False})
+
+    @app.get("/api/v1/feedbacks")
+    async def get_feedbacks(nmId: int, take: int = 5000, skip: int = 0, dateFrom: int = None):
+        return feedbacks_page(nmId, take, skip, dateFrom, archive=False)
+
+    @app.get("/api/v1/feedbacks/archive")
+    async def get_feedbacks_archive(nmId: int, take: int = 5000, skip: int = 0, dateFrom: int = None):
+        return feedbacks_page(nmId, take, skip, dateFrom, archive=True)
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Локальный стенд WB API для бенчмарков")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--skus", type=int, default=1000)
+    parser.add_argument("--warehouses", type=int, default=3)
+    parser.add_argument("--sales-rate", type=float, default=0.3, help="доля пар (SKU, день) с продажей")
+    parser.add_argument("--reviews-per-sku", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=0, help="задержка каждого ответа")
+    args = parser.parse_args()
+
+    dataset = FakeDataset(args.skus, args.warehouses, args.sales_rate, args.reviews_per_sku)
+    uvicorn.run(create_app(dataset, args.latency_ms), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
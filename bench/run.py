@@ -0,0 +1,243 @@
+# Файл: bench/run.py
+"""
+Бенчмарк /analyze против локального стенда WB (bench/fake_wb.py) и заглушки GigaChat.
+
+Для каждого сценария поднимается свой стенд и отдельный процесс приложения с
+пустым DATA_DIR: первый прогон холодный (все отчеты качаются со стенда),
+следующие — теплые. Для каждого прогона печатается время /analyze целиком,
+время по этапам (из метрик utils/metrics.py) и пиковая память процесса.
+
+    python -m bench.run small medium
+    python -m bench.run medium --save bench/baseline.json
+    python -m bench.run medium --compare bench/baseline.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from typing import Dict, Any, List
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    "small": {"skus": 10},
+    "medium": {"skus": 1000},
+    "large": {"skus": 20000},
+}
+
+# Старые периоды: дни уже окончательные, поэтому теплый прогон не перекачивает отчет
+PERIOD_1 = {"date_from": "2024-02-01", "date_to": "2024-02-29"}
+PERIOD_2 = {"date_from": "2024-01-01", "date_to": "2024-01-31"}
+
+STAGES = ("catalog", "cards", "reports", "agents", "llm")
+
+
+class StubGigaChat:
+    """Заглушка клиента GigaChat: фиксированная задержка и короткий ответ."""
+
+    def __init__(self, latency_ms: float):
+        self.latency = latency_ms / 1000
+
+    @staticmethod
+    def _response(prompt: str):
+        message = types.SimpleNamespace(content=f"Отчет ({len(prompt)} символов промпта).")
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+    def chat(self, prompt: str):
+        time.sleep(self.latency)
+        return self._response(prompt)
+
+    async def achat(self, prompt: str):
+        await asyncio.sleep(self.latency)
+        return self._response(prompt)
+
+
+# ---------------------------------------------------------------------------
+# Процесс приложения: импортирует main уже с окружением стенда
+# ---------------------------------------------------------------------------
+
+def _stage_totals() -> Dict[str, float]:
+    from prometheus_client import REGISTRY
+    return {
+        stage: REGISTRY.get_sample_value("marketmind_analysis_stage_seconds_sum", {"stage": stage}) or 0.0
+        for stage in STAGES
+    }
+
+
+async def _no_cached_answer(key: str) -> None:
+    return None
+
+
+async def _measure(runs: int, llm_latency_ms: float, use_redis: bool) -> Dict[str, Any]:
+    import main
+    from llm import cache as llm_cache, generator
+    from utils import cache
+
+    if not use_redis:
+        # Кэш ответов LLM сделал бы повторные прогоны несравнимыми: без --redis
+        # выключаем и Redis, и сохранение ответов в памяти процесса
+        cache.disable_redis()
+        llm_cache.get = _no_cached_answer
+    await main.startup_event()
+    generator.giga_client = StubGigaChat(llm_latency_ms)
+
+    payload = {"marketplace": "wildberries", "period_1": PERIOD_1, "period_2": PERIOD_2, "sku_list": "all"}
+    results = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for run in range(runs):
+            before = _stage_totals()
+            started = time.perf_counter()
+            response = await client.post("/analyze", json=payload)
+            elapsed = time.perf_counter() - started
+            response.raise_for_status()
+            after = _stage_totals()
+            results.append({
+                "run": "cold" if run == 0 else f"warm{run}",
+                "seconds": round(elapsed, 3),
+                "stages": {stage: round(after[stage] - before[stage], 3) for stage in STAGES},
+                "skus": len(response.json()["raw_data"]),
+            })
+    await main.shutdown_event()
+
+    # ru_maxrss в Linux — килобайты
+    return {"runs": results, "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+
+def _worker(args: argparse.Namespace) -> None:
+    # Вывод приложения (print в агентах и клиентах API) в отчет бенчмарка не попадает
+    if not args.verbose:
+        sys.stdout = open(os.devnull, "w")
+        logging.disable(logging.INFO)
+    result = asyncio.run(_measure(args.runs, args.llm_latency_ms, args.redis))
+    with open(args.result_file, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+
+
+# ---------------------------------------------------------------------------
+# Управляющий процесс: стенд, приложение, сводка
+# ---------------------------------------------------------------------------
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(base_url: str, timeout: float = 120) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(base_url + "/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Стенд WB не запустился за {timeout} с: {base_url}")
+
+
+def run_scenario(name: str, args: argparse.Namespace) -> Dict[str, Any]:
+    skus = SCENARIOS[name]["skus"]
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    fake_wb = subprocess.Popen(
+        [sys.executable, "-m", "bench.fake_wb", "--port", str(port), "--skus", str(skus),
+         "--latency-ms", str(args.latency_ms), "--reviews-per-sku", str(args.reviews_per_sku)],
+        cwd=ROOT,
+    )
+    try:
+        _wait_ready(base_url)
+        with tempfile.TemporaryDirectory(prefix="marketmind-bench-") as data_dir:
+            result_file = os.path.join(data_dir, "result.json")
+            env = {
+                **os.environ,
+                "MARKETPLACE_API_KEY": "bench",
+                "GIGACHAT_CREDENTIALS": "bench",
+                "WB_API_BASE_URL": base_url,
+                "WB_RATE_LIMIT_SCALE": "1000000",
+                "DATA_DIR": os.path.join(data_dir, "data"),
+            }
+            command = [sys.executable, "-m", "bench.run", "--worker", "--result-file", result_file,
+                       "--runs", str(args.runs), "--llm-latency-ms", str(args.llm_latency_ms)]
+            if args.redis:
+                command.append("--redis")
+            if args.verbose:
+                command.append("--verbose")
+            subprocess.run(command, cwd=ROOT, env=env, check=True)
+            with open(result_file, encoding="utf-8") as f:
+                result = json.load(f)
+    finally:
+        fake_wb.terminate()
+        fake_wb.wait()
+    return {"scenario": name, "skus": skus, **result}
+
+
+def _print_report(results: List[Dict[str, Any]]) -> None:
+    header = f"{'scenario':<8} {'run':<6} {'skus':>6} {'total, s':>9} " + " ".join(f"{s:>8}" for s in STAGES) + f" {'rss, MB':>8}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        for run in result["runs"]:
+            stages = " ".join(f"{run['stages'][s]:>8.2f}" for s in STAGES)
+            print(f"{result['scenario']:<8} {run['run']:<6} {run['skus']:>6} {run['seconds']:>9.2f} {stages} {result['peak_rss_mb']:>8.1f}")
+
+
+def _compare(results: List[Dict[str, Any]], baseline_path: str, tolerance: float) -> bool:
+    """Сравнивает время прогонов с сохраненной базой. False — есть регрессия."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["scenario"], run["run"]): run["seconds"] for r in json.load(f) for run in r["runs"]}
+    ok = True
+    for result in results:
+        for run in result["runs"]:
+            reference = baseline.get((result["scenario"], run["run"]))
+            if reference and run["seconds"] > reference * (1 + tolerance):
+                print(f"РЕГРЕССИЯ: {result['scenario']}/{run['run']}: {run['seconds']:.2f} с против {reference:.2f} с в базе.")
+                ok = False
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк /analyze на локальном стенде WB")
+    parser.add_argument("scenarios", nargs="*", help=f"сценарии: {', '.join(SCENARIOS)} (по умолчанию small medium)")
+    parser.add_argument("--runs", type=int, default=2, help="прогонов на сценарий: первый холодный, остальные теплые")
+    parser.add_argument("--latency-ms", type=float, default=20, help="задержка ответа стенда WB")
+    parser.add_argument("--llm-latency-ms", type=float, default=20, help="задержка заглушки GigaChat")
+    parser.add_argument("--reviews-per-sku", type=int, default=20)
+    parser.add_argument("--redis", action="store_true", help="использовать Redis из окружения (по умолчанию выключен)")
+    parser.add_argument("--save", help="сохранить результаты в JSON как базу для сравнения")
+    parser.add_argument("--compare", help="сравнить с сохраненной базой и завершиться с кодом 1 при регрессии")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое замедление относительно базы")
+    parser.add_argument("--verbose", action="store_true", help="не скрывать вывод приложения")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        _worker(args)
+        return
+
+    scenarios = args.scenarios or ["small", "medium"]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(unknown)}")
+    results = [run_scenario(name, args) for name in scenarios]
+    _print_report(results)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.compare and not _compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
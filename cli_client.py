@@ -2,10 +2,14 @@
 import requests
 import argparse
 import json
+import time
 
 # Адрес, по которому запущен наш FastAPI сервер
 API_BASE_URL = "http://127.0.0.1:8000"
 
+# Как часто опрашивать статус фоновой задачи анализа (секунды)
+JOB_POLL_INTERVAL = 3
+
 def handle_list_products(args):
     """Обрабатывает команду 'list': запрашивает и выводит список товаров."""
     print("-> Запрашиваю список всех товаров с сервера...")
@@ -58,35 +62,54 @@ def handle_analyze(args):
                 print(f"❌ Ошибка: Не удалось преобразовать цену '{price_str}' в число для артикула '{sku}'. Убедитесь, что используете точку '.' в качестве десятичного разделителя.")
                 return
     
+    # --- Периоды: --period (сколько угодно) или пара --p1-*/--p2-* ---
+    if args.period:
+        periods = []
+        for item in args.period:
+            date_from, sep, date_to = item.partition(":")
+            if not sep or not date_from or not date_to:
+                print(f"❌ Ошибка: Период '{item}' должен быть в формате YYYY-MM-DD:YYYY-MM-DD.")
+                return
+            periods.append({"date_from": date_from, "date_to": date_to})
+    elif all([args.p1_from, args.p1_to, args.p2_from, args.p2_to]):
+        periods = [
+            {"date_from": args.p1_from, "date_to": args.p1_to},
+            {"date_from": args.p2_from, "date_to": args.p2_to},
+        ]
+    else:
+        print("❌ Ошибка: Укажите периоды через --period или все четыре даты --p1-from/--p1-to/--p2-from/--p2-to.")
+        return
+
     # --- Формируем итоговый payload ---
     payload = {
         "marketplace": args.marketplace,
-        "period_1": {
-            "date_from": args.p1_from,
-            "date_to": args.p1_to
-        },
-        "period_2": {
-            "date_from": args.p2_from,
-            "date_to": args.p2_to
-        },
+        "periods": periods,
         "sku_list": sku_list_payload,
         "cost_prices": cost_prices_payload
     }
     
     print(f"   - Маркетплейс: {payload['marketplace']}")
-    print(f"   - Период 1: с {payload['period_1']['date_from']} по {payload['period_1']['date_to']}")
-    print(f"   - Период 2: с {payload['period_2']['date_from']} по {payload['period_2']['date_to']}")
+    for number, period in enumerate(periods, start=1):
+        print(f"   - Период {number}: с {period['date_from']} по {period['date_to']}")
     print(f"   - Товары (SKU): {payload['sku_list']}")
     if payload['cost_prices']:
         print(f"   - Переданные себестоимости: {payload['cost_prices']}")
     
     print("\n-> Отправляю запрос на сервер... (Это может занять некоторое время)")
     
-    try:
-        response = requests.post(f"{API_BASE_URL}/analyze", json=payload)
-        response.raise_for_status()
+    if args.stream:
+        run_analysis_stream(payload)
+        return
 
-        data = response.json()
+    try:
+        if args.sync:
+            response = requests.post(f"{API_BASE_URL}/analyze", json=payload)
+            response.raise_for_status()
+            data = response.json()
+        else:
+            data = run_analysis_job(payload)
+            if data is None:
+                return
         
         print("\n" + "="*50)
         print("✅ АНАЛИТИЧЕСКИЙ ОТЧЕТ УСПЕШНО ПОЛУЧЕН")
@@ -96,6 +119,7 @@ def handle_analyze(args):
         
         print("\n" + "="*50)
         print("💡 Полные 'сырые' данные (raw_data) также получены.")
+        print(f"💡 ID анализа для уточняющих вопросов: {data.get('request_id')}")
 
     except requests.RequestException as e:
         print(f"❌ Ошибка: {e}")
@@ -106,6 +130,68 @@ def handle_analyze(args):
             pass
         print("\n💡 Убедитесь, что FastAPI сервер запущен и работает без ошибок.")
 
+def run_analysis_stream(payload):
+    """Получает результаты анализа потоком (NDJSON) и печатает их по мере поступления."""
+    try:
+        with requests.post(f"{API_BASE_URL}/analyze/stream", json=payload, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                event = json.loads(line)
+
+                if event["type"] == "started":
+                    print(f"   - Анализ запущен, ID: {event['request_id']}")
+                elif event["type"] == "sku_data":
+                    sales = event["raw_data"].get("sales", {}).get("period_1", {})
+                    print(f"\n✅ Данные по SKU {event['sku']} собраны "
+                          f"(заказано: {sales.get('units_ordered', 'N/A')}, выручка: {sales.get('gross_revenue_rub', 'N/A')} руб.)")
+                elif event["type"] == "sku_summary":
+                    print("\n" + "="*50)
+                    print(f"📄 ОТЧЕТ ПО SKU {event['sku']}")
+                    print("="*50 + "\n")
+                    print(event["llm_summary"])
+                elif event["type"] == "done":
+                    print("\n" + "="*50)
+                    print(f"💡 Анализ завершен. ID для уточняющих вопросов: {event['request_id']}")
+                elif event["type"] == "error":
+                    print(f"❌ Ошибка анализа: {event['detail']}")
+
+    except requests.RequestException as e:
+        print(f"❌ Ошибка: {e}")
+        print("\n💡 Убедитесь, что FastAPI сервер запущен и работает без ошибок.")
+
+def run_analysis_job(payload):
+    """Ставит анализ в фоновую задачу и опрашивает статус, печатая смену этапов."""
+    response = requests.post(f"{API_BASE_URL}/analyze/jobs", json=payload)
+    response.raise_for_status()
+    job = response.json()
+    print(f"   - Задача поставлена в очередь: {job['job_id']}")
+
+    last_line = None
+    while True:
+        time.sleep(JOB_POLL_INTERVAL)
+        response = requests.get(f"{API_BASE_URL}{job['status_url']}")
+        response.raise_for_status()
+        status = response.json()
+
+        stage = status.get("stage")
+        line = f"   - Статус: {status['status']}"
+        if stage:
+            info = status["stages"].get(stage, {})
+            line += f", этап: {stage}"
+            if "total" in info:
+                line += f" ({info.get('done', 0)}/{info['total']})"
+        if line != last_line:
+            print(line)
+            last_line = line
+
+        if status["status"] == "done":
+            return status["result"]
+        if status["status"] == "failed":
+            print(f"❌ Анализ завершился ошибкой: {status.get('error')}")
+            return None
+
 def main():
     """Основная функция, настраивающая и запускающая парсер команд."""
     parser = argparse.ArgumentParser(
@@ -128,12 +214,20 @@ def main():
         help='Список артикулов (SKU) для анализа, разделенных пробелом, или слово "all" для анализа всех товаров.'
     )
     # Аргументы для Периода 1
-    parser_analyze.add_argument("--p1-from", required=True, help="Дата начала Периода 1 (YYYY-MM-DD)")
-    parser_analyze.add_argument("--p1-to", required=True, help="Дата окончания Периода 1 (YYYY-MM-DD)")
+    parser_analyze.add_argument("--p1-from", help="Дата начала Периода 1 (YYYY-MM-DD)")
+    parser_analyze.add_argument("--p1-to", help="Дата окончания Периода 1 (YYYY-MM-DD)")
     
     # Аргументы для Периода 2 (для сравнения)
-    parser_analyze.add_argument("--p2-from", required=True, help="Дата начала Периода 2 (YYYY-MM-DD)")
-    parser_analyze.add_argument("--p2-to", required=True, help="Дата окончания Периода 2 (YYYY-MM-DD)")
+    parser_analyze.add_argument("--p2-from", help="Дата начала Периода 2 (YYYY-MM-DD)")
+    parser_analyze.add_argument("--p2-to", help="Дата окончания Периода 2 (YYYY-MM-DD)")
+
+    # Произвольное число периодов вместо --p1-*/--p2-*: первый — основной
+    parser_analyze.add_argument(
+        "--period",
+        action="append",
+        metavar="С:ПО",
+        help="Период в формате YYYY-MM-DD:YYYY-MM-DD; можно указать несколько раз (например, 12 недель для тренда)."
+    )
 
     parser_analyze.add_argument(
         "--marketplace",
@@ -145,6 +239,16 @@ def main():
         nargs='*',
         help="Указать себестоимость. Формат: 'АРТИКУЛ1:ЦЕНА1' 'АРТИКУЛ2:ЦЕНА2'"
     )
+    parser_analyze.add_argument(
+        "--stream",
+        action="store_true",
+        help="Получать результаты по каждому SKU по мере готовности (потоковый режим)."
+    )
+    parser_analyze.add_argument(
+        "--sync",
+        action="store_true",
+        help="Ждать ответа в одном HTTP-запросе вместо фоновой задачи с опросом статуса."
+    )
     parser_analyze.set_defaults(func=handle_analyze)
 
     # Разбираем аргументы, которые ввел пользователь
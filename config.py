@@ -9,6 +9,49 @@ load_dotenv()
 GIGACHAT_CREDENTIALS = os.getenv("GIGACHAT_CREDENTIALS")
 MARKETPLACE_API_KEY = os.getenv("MARKETPLACE_API_KEY")
 
+# Каталог для локальных хранилищ (кэш отчетов о реализации и т.п.)
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# Сколько SKU одновременно собирают отзывы (темп запросов ограничивает utils/rate_limiter.py)
+REVIEWS_CONCURRENCY = int(os.getenv("REVIEWS_CONCURRENCY", 6))
+
+# Как долго агрегированный каталог (остатки по SKU) считается актуальным, секунды
+CATALOG_TTL_SECONDS = float(os.getenv("CATALOG_TTL_SECONDS", 600))
+
+# Время жизни индекса рекламных кампаний по nmId, секунды
+ADS_TTL_SECONDS = float(os.getenv("ADS_TTL_SECONDS", 300))
+
+# Единый адрес вместо всех хостов WB API (например, локальный стенд bench/fake_wb.py)
+WB_API_BASE_URL = os.getenv("WB_API_BASE_URL")
+# Множитель темпа запросов к WB API; больше 1 имеет смысл только для локального стенда
+WB_RATE_LIMIT_SCALE = float(os.getenv("WB_RATE_LIMIT_SCALE", 1))
+
+# Redis — общий уровень кэша (utils/cache.py); пул соединений ограничен REDIS_MAX_CONNECTIONS
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_DB = int(os.getenv("REDIS_DB", 0))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 20))
+# После ошибки Redis кэш работает только в памяти столько секунд, затем пробует снова
+REDIS_RETRY_SECONDS = float(os.getenv("REDIS_RETRY_SECONDS", 30))
+
+# Single-flight загрузок WB между процессами: время жизни Redis-блокировки (продлевается,
+# пока загрузка идет) и сколько ведомый процесс ждет чужую загрузку, прежде чем загрузить сам
+SINGLE_FLIGHT_LOCK_SECONDS = float(os.getenv("SINGLE_FLIGHT_LOCK_SECONDS", 60))
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv("SINGLE_FLIGHT_WAIT_SECONDS", 600))
+
+# Распределенный анализ (decision_agent/sharding.py): SKU в шарде и сколько ждать
+# очередного шарда от воркеров, прежде чем досчитать оставшиеся локально, секунды
+ANALYSIS_SHARD_SIZE = int(os.getenv("ANALYSIS_SHARD_SIZE", 250))
+ANALYSIS_SHARD_TIMEOUT_SECONDS = float(os.getenv("ANALYSIS_SHARD_TIMEOUT_SECONDS", 300))
+
+# Локальный уровень кэша (LRU в памяти процесса): число записей и предельный TTL, секунды
+CACHE_LOCAL_MAX_ENTRIES = int(os.getenv("CACHE_LOCAL_MAX_ENTRIES", 10000))
+CACHE_LOCAL_TTL_SECONDS = float(os.getenv("CACHE_LOCAL_TTL_SECONDS", 300))
+
+# Параллельная генерация отчетов LLM: сколько вызовов одновременно и таймаут на вызов
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 5))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 120))
+
 # Проверка, что ключ успешно загружен
 if not GIGACHAT_CREDENTIALS:
     print("ПРЕДУПРЕЖДЕНИЕ: Ключ GIGACHAT_CREDENTIALS не найден...")
\ No newline at end of file
@@ -1,78 +1,113 @@
 # Файл: decision_agent/manager.py (ФИНАЛЬНАЯ ВЕРСИЯ С ТОЧНЫМИ ДАННЫМИ)
-from typing import List, Dict, Any
+import asyncio
+from typing import List, Dict, Any, AsyncIterator, Callable, Optional, Tuple
+from utils import metrics
+from utils.http_client import run_sync
 from utils.marketplace_api import (
-    get_all_wb_products,
-    get_wb_product_cards_details,
-    get_wb_realization_report, # ИМПОРТИРУЕМ НОВУЮ ФУНКЦИЮ
-    get_wb_ads_list,
-    get_wb_reviews,
-    get_wb_analytics_by_sku
+    get_wb_product_cards_details_async,
+    load_wb_realization_periods_async,
+    load_wb_funnel_async
 )
+from utils.sales_aggregator import aggregate_realization_days
+from utils.realization_store import parse_day
+from utils.funnel_table import FunnelTable
+from utils.catalog_cache import CatalogCache
+from utils.ads_index import AdsIndexCache
+from utils.wb_charcs_cache import prefetch_required_charcs_async
 
-from agents.sales_agent import SalesAgent
-from agents.card_agent import CardAgent
-from agents.reviews_agent import ReviewsAgent
-from agents.audience_agent import AudienceAgent
-from agents.ads_agent import AdsAgent
-from agents.profit_agent import ProfitAgent
+from decision_agent import sharding
+from decision_agent.sku_analyzer import SkuAnalyzer, build_sku_input
 
 class DecisionManager:
+    """
+    Управляющий агент. Создается один раз на процесс (см. startup_event в main.py)
+    и обслуживает конкурентные запросы: все данные конкретного анализа живут
+    только в локальных переменных методов, а агенты не хранят состояния запроса.
+    """
+
     def __init__(self, marketplace_api_key: str):
         self.api_key = marketplace_api_key
         print("-> DM: Инициализация всех агентов...")
-        self.sales_agent = SalesAgent()
-        self.card_agent = CardAgent()
-        self.ads_agent = AdsAgent()
-        self.reviews_agent = ReviewsAgent(api_key=self.api_key)
-        self.audience_agent = AudienceAgent()
-        self.profit_agent = ProfitAgent()
+        self.analyzer = SkuAnalyzer(api_key=self.api_key)
+        self.ads_agent = self.analyzer.ads_agent
+        self.reviews_agent = self.analyzer.reviews_agent
+        self.seller = sharding.seller_id(self.api_key)
+        # Кэш каталога живет вместе с менеджером и общий для всех запросов
+        self.catalog = CatalogCache(api_key=self.api_key)
+        self.ads_index = AdsIndexCache(api_key=self.api_key)
         print("Управляющий агент создан и готов к работе.")
 
-    def run_analysis(self, sku_list: List[str] | str, period_1: Dict, period_2: Dict, cost_prices: Dict[str, float] = None) -> Dict[str, Any]:
-        # Получаем даты из словарей
-        p1_from, p1_to = period_1['date_from'], period_1['date_to']
-        p2_from, p2_to = period_2['date_from'], period_2['date_to']
+    def run_analysis(self, sku_list: List[str] | str, periods: List[Dict], cost_prices: Dict[str, float] = None) -> Dict[str, Any]:
+        """Синхронная обертка над run_analysis_async для вызова вне event loop."""
+        return run_sync(self.run_analysis_async(sku_list, periods, cost_prices))
+
+    async def run_analysis_async(
+        self,
+        sku_list: List[str] | str,
+        periods: List[Dict],
+        cost_prices: Dict[str, float] = None,
+        on_stage: Optional[Callable[..., None]] = None,
+    ) -> Dict[str, Any]:
+        """
+        periods — список {'date_from', 'date_to'}; в отчете они называются
+        period_1..period_N, period_1 — основной.
+        on_stage(stage, done=None, total=None) вызывается при переходе к очередному
+        этапу (см. utils/jobs.STAGES) — так задача /analyze/jobs сообщает прогресс.
+        """
+        full_analysis_report = {}
+        async for sku, sku_report in self.iter_analysis_async(sku_list, periods, cost_prices, on_stage):
+            if sku is None:
+                return sku_report
+            full_analysis_report[sku] = sku_report
+        return full_analysis_report
+
+    async def iter_analysis_async(
+        self,
+        sku_list: List[str] | str,
+        periods: List[Dict],
+        cost_prices: Dict[str, float] = None,
+        on_stage: Optional[Callable[..., None]] = None,
+    ) -> AsyncIterator[Tuple[Optional[str], Dict[str, Any]]]:
+        """
+        Отдает пары (sku, отчет) по мере готовности, в порядке анализа SKU.
+        Если анализ невозможен, отдает единственную пару (None, {"error": ...}).
+        """
+        # Длительность этапов уходит в метрики, а вызовы прогресса — дальше в on_stage
+        report_stage = metrics.StageTimer(on_stage)
+        # Периоды называются period_1..period_N в порядке запроса
+        named_periods = {f"period_{number}": period for number, period in enumerate(periods, start=1)}
 
         if cost_prices is None:
             cost_prices = {}
-          # --- Шаг 1: Получение и ПРАВИЛЬНАЯ АГРЕГАЦИЯ данных со всех складов ---
-        print("-> DM: Шаг 1/3. Получаю и агрегирую данные по остаткам со всех складов...")
-        base_products_data = get_all_wb_products(self.api_key)
-        if "error" in base_products_data:
-            return base_products_data
-
-        product_map = {}
-        # Проходим по каждой записи из API
-        for item in base_products_data.get("products", []):
-            sku = item.get("supplierArticle")
-            if not sku: continue
-
-            # Если SKU встречается впервые, создаем для него запись
-            if sku not in product_map:
-                product_map[sku] = item.copy()  # Копируем всю базовую информацию
-                # Обнуляем остатки, чтобы начать суммировать с чистого листа
-                product_map[sku]["quantity"] = 0
-                product_map[sku]["quantityFull"] = 0
-            
-            # Суммируем остатки с каждого склада к уже существующим
-            product_map[sku]["quantity"] += item.get("quantity", 0)
-            product_map[sku]["quantityFull"] += item.get("quantityFull", 0)
-        
+        # --- Шаг 1: Каталог с остатками, уже агрегированными по всем складам (из кэша) ---
+        print("-> DM: Шаг 1/3. Получаю агрегированный каталог остатков со всех складов...")
+        report_stage("catalog")
+        catalog_data = await self.catalog.get_products()
+        if "error" in catalog_data:
+            yield None, catalog_data
+            return
+        catalog = catalog_data["products"]
+
         # --- Определяем, какие SKU анализировать ---
         if sku_list == "all":
-            analysis_skus = list(product_map.keys())
+            analysis_skus = list(catalog.keys())
         else:
-            analysis_skus = [sku for sku in sku_list if sku in product_map]
+            analysis_skus = [sku for sku in sku_list if sku in catalog]
 
         if not analysis_skus:
-            return {"error": f"Ни один из запрошенных SKU не найден в вашем каталоге: {sku_list}"}
+            yield None, {"error": f"Ни один из запрошенных SKU не найден в вашем каталоге: {sku_list}"}
+            return
+
+        # Каталог общий для всех запросов: обогащаем только собственные копии карточек
+        product_map = {sku: catalog[sku].copy() for sku in analysis_skus}
         
         # --- Шаг 2: Получение и слияние детальной информации ---
         # Собираем nmID ТОЛЬКО для тех SKU, которые мы будем анализировать.
         nm_ids_to_fetch_details = [product_map[sku].get("nmId") for sku in analysis_skus if product_map[sku].get("nmId")]
         
         print(f"-> DM: Шаг 2/3. Получаю детальную информацию для {len(nm_ids_to_fetch_details)} карточек по nmID...")
-        detailed_cards_list = get_wb_product_cards_details(self.api_key, nm_ids_to_fetch_details)
+        report_stage("cards")
+        detailed_cards_list = await get_wb_product_cards_details_async(self.api_key, nm_ids_to_fetch_details)
 
         # Создаем временную карту {nmID -> детальная карточка} для быстрого поиска
         detailed_cards_map = {card['nmID']: card for card in detailed_cards_list}
@@ -105,71 +140,72 @@ class DecisionManager:
             else:
                  base_info['warning'] = f"Для nmId {nm_id} не найдена детальная карточка в Content API."
 
+        # Обязательные характеристики всех предметов загружаем заранее и параллельно,
+        # чтобы CardAgent в цикле по SKU не ходил в сеть
+        await prefetch_required_charcs_async(card.get("subjectID") for card in product_map.values())
+
 
         # --- Шаг 3: Предварительная загрузка отчетов для анализа ---
-        print("-> DM: Шаг 3/4. Предварительная загрузка отчетов для ДВУХ периодов...")
+        print(f"-> DM: Шаг 3/4. Предварительная загрузка отчетов для {len(named_periods)} периодов...")
+        report_stage("reports")
         
         # Данные, не зависящие от периода, запрашиваем один раз
-        ads_report = get_wb_ads_list(self.api_key)
-        all_nm_ids = [card.get("nmId") for card in product_map.values() if card.get("nmId")]
-
-        print(f"   - Загружаю отчеты для Периода 1 ({p1_from} - {p1_to})")
-        sales_report_p1 = get_wb_realization_report(self.api_key, p1_from, p1_to)
-        analytics_data_list_p1 = get_wb_analytics_by_sku(self.api_key, all_nm_ids, p1_from, p1_to)
-        # ИСПРАВЛЕНИЕ: Проверяем, что analytics_data_list_p1 это список, а не словарь с ошибкой
-        analytics_map_p1 = {item['nmID']: item for item in analytics_data_list_p1} if isinstance(analytics_data_list_p1, list) else {}
-
-        print(f"   - Загружаю отчеты для Периода 2 ({p2_from} - {p2_to})")
-        sales_report_p2 = get_wb_realization_report(self.api_key, p2_from, p2_to)
-        analytics_data_list_p2 = get_wb_analytics_by_sku(self.api_key, all_nm_ids, p2_from, p2_to)
-        # ИСПРАВЛЕНИЕ: Такая же проверка для второго периода
-        analytics_map_p2 = {item['nmID']: item for item in analytics_data_list_p2} if isinstance(analytics_data_list_p2, list) else {}
+        ads_index = await self.ads_index.get_index()
+
+        # Отчет о реализации качаем ОДИН раз за объединение дней всех периодов,
+        # а по периодам режем локально по дням (rr_dt) — пересекающиеся периоды
+        # не порождают лишних запросов, а промежуток между далекими не качается вовсе
+        period_ranges = [(period['date_from'], period['date_to']) for period in periods]
+        print(f"   - Загружаю отчет о реализации за дни периодов: {', '.join(f'{start} - {end}' for start, end in period_ranges)}")
+
+        # Аналитика воронки только по анализируемым nmID: для небольших списков — дневная
+        # история (пересекающиеся периоды не запрашивают дни повторно), для больших и
+        # всего каталога — постраничный отчет за период (см. load_wb_funnel_async).
+        # Оба отчета идут в разные API со своими лимитами, поэтому грузятся параллельно.
+        (sales_store, sales_complete), funnel_totals = await asyncio.gather(
+            load_wb_realization_periods_async(self.api_key, period_ranges),
+            load_wb_funnel_async(self.api_key, nm_ids_to_fetch_details, period_ranges, whole_catalog=sku_list == "all"),
+        )
+        analytics_tables = {}
+        funnel_nm_ids = set(nm_ids_to_fetch_details)
+        for name, cards in zip(named_periods, funnel_totals):
+            if len(cards) < len(funnel_nm_ids):
+                # Для этих nmID AudienceAgent сообщит об отсутствии данных, а не о заниженных итогах
+                print(f"   [WARN] Аналитика {name}: нет полных данных по {len(funnel_nm_ids) - len(cards)} из {len(funnel_nm_ids)} nmID.")
+            analytics_tables[name] = FunnelTable.from_cards(cards)
+
+        # --- Агрегация отчетов о реализации: ОДИН проход по дням каждого периода ---
+        # Колонки дней отображаются из хранилища через mmap и сворачиваются векторно, в памяти остаются только итоги.
+        print("-> DM: Агрегирую отчеты о реализации по SKU и типу документа...")
+        # Период с незагруженными днями не агрегируется: None вместо заниженных итогов
+        sales_indexes = {}
+        for (name, period), complete in zip(named_periods.items(), sales_complete):
+            if not complete:
+                print(f"   [WARN] Отчет о реализации {name} загружен не полностью, продажи за период не считаются.")
+                sales_indexes[name] = None
+                continue
+            sales_indexes[name] = aggregate_realization_days(sales_store.iter_days(parse_day(period['date_from']), parse_day(period['date_to'])))
 
         print("-> DM: Предзагрузка завершена.")
 
         # --- Финальный цикл анализа ---
-        full_analysis_report = {}
+        # Агентам каждого SKU нужен только его срез данных периода
+        items = [
+            build_sku_input(sku, product_map[sku], sales_indexes, ads_index, analytics_tables, cost_prices)
+            for sku in analysis_skus
+        ]
         print(f"\n--- Начинаю итоговый анализ для {len(analysis_skus)} SKU... ---")
-        
-        for sku in analysis_skus:
-            product_card = product_map.get(sku)
-            if not product_card: continue
-
-            # Ваш диагностический жучок
-            print("\n" + "="*20 + f" [DEBUG] Данные для CardAgent (SKU: {sku}) " + "="*20)
-            import json
-            print(json.dumps(product_card, indent=2, ensure_ascii=False))
-            print("="*80 + "\n")
-
-            print(f"Анализ товара SKU: {sku}")
-            sku_report = {}
-            if not product_card.get("nmId"):
-                full_analysis_report[sku] = {"error": "Не удалось получить nmId для этого товара."}
-                continue
-            
-            nm_id = product_card.get("nmId")
-            
-            # Вызываем всех агентов
-            sku_report['card'] = self.card_agent.analyze(product_card=product_card)
-            sku_report['sales'] = self.sales_agent.analyze(
-                sku=sku, 
-                sales_reports={'period_1': sales_report_p1, 'period_2': sales_report_p2}
-            )
-            sku_report['ads'] = self.ads_agent.analyze(nm_id=nm_id, full_ads_report=ads_report)
-            sku_report['audience'] = self.audience_agent.analyze(
-                analytics_data_by_period={'period_1': analytics_map_p1.get(nm_id, {}), 'period_2': analytics_map_p2.get(nm_id, {})}
-            )
-            sku_report['reviews'] = self.reviews_agent.analyze(nm_id=nm_id)
-            
-            # --- ЕДИНСТВЕННЫЙ, ПРАВИЛЬНЫЙ ВЫЗОВ PROFIT AGENT ---
-            current_cost_price = cost_prices.get(sku, 150.0)
-            sku_report['profit'] = self.profit_agent.analyze(
-                sales_data=sku_report.get('sales', {}).get('period_1', {}), # ВАЖНО: берем данные за period_1,
-                cost_price=current_cost_price
-            )
-            
-            # Правильный отступ
-            full_analysis_report[sku] = sku_report
+        on_progress = lambda done: report_stage("agents", done=done, total=len(items))
+        # Большой каталог режется на шарды для воркеров, если они запущены
+        if await sharding.should_distribute(self.seller, len(items)):
+            reports = sharding.iter_distributed(self.seller, items, self.analyzer.iter_prepared, self.analyzer.iter_reports, on_progress)
+        else:
+            reports = self.analyzer.iter_reports(items, on_progress)
+        try:
+            async for sku, sku_report in reports:
+                yield sku, sku_report
+        finally:
+            await reports.aclose()
+            report_stage.finish()
 
         print("\n--- Полный анализ завершен. ---")
-        return full_analysis_report
\ No newline at end of file
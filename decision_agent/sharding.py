@@ -0,0 +1,273 @@
+# Файл: decision_agent/sharding.py
+"""
+Распределенный анализ SKU: менеджер режет входные данные (build_sku_input)
+на шарды, дополняет их результатами запросов к WB (отзывы, характеристики),
+кладет в Redis и ставит в очередь продавца; воркеры
+(python -m decision_agent.worker) забирают шарды, считают отчеты и
+возвращают их через Redis. Воркеры в сеть не ходят, поэтому квоты WB
+продавца расходует только менеджер. Шарды, которые никто не досчитал за
+ANALYSIS_SHARD_TIMEOUT_SECONDS, менеджер забирает себе через аренду
+(analysis:lease:*) и досчитывает сам; шарды в аренде у живых воркеров ждет.
+
+Ключи Redis:
+    analysis:workers:<seller>            ZSET воркеров -> время последнего heartbeat
+    analysis:queue:<seller>              LIST ссылок "<run_id>:<номер шарда>"
+    analysis:shard:<run_id>:<n>          входные данные шарда
+    analysis:shard:<run_id>:<n>:result   отчеты шарда [[sku, отчет], ...]
+    analysis:done:<run_id>               LIST номеров готовых шардов
+    analysis:lease:<run_id>:<n>          аренда шарда (redis lock): воркер, который его
+                                         считает, или менеджер, забравший шард себе
+    analysis:cancel:<run_id>             флаг отмены запуска для воркеров
+"""
+import asyncio
+import contextlib
+import hashlib
+import time
+import uuid
+from typing import List, Dict, Any, AsyncIterator, Callable, Optional, Set, Tuple
+
+from redis.exceptions import LockError, RedisError
+
+from config import ANALYSIS_SHARD_SIZE, ANALYSIS_SHARD_TIMEOUT_SECONDS
+from utils import cache
+
+KEY_PREFIX = "analysis:"
+SHARD_TTL_SECONDS = 3600
+# Воркер продлевает аренду шарда, пока считает его; аренду умершего воркера
+# менеджер перехватывает после ее истечения
+SHARD_LEASE_SECONDS = 30
+# Воркер считается живым, если присылал heartbeat не позже этого срока
+WORKER_HEARTBEAT_SECONDS = 5
+WORKER_TTL_SECONDS = 15
+# BLPOP должен укладываться в socket_timeout пула (utils/cache.py)
+BLOCK_SECONDS = 2
+
+
+def seller_id(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+def workers_key(seller: str) -> str:
+    return f"{KEY_PREFIX}workers:{seller}"
+
+
+def queue_key(seller: str) -> str:
+    return f"{KEY_PREFIX}queue:{seller}"
+
+
+def shard_key(ref: str) -> str:
+    return f"{KEY_PREFIX}shard:{ref}"
+
+
+def result_key(ref: str) -> str:
+    return f"{KEY_PREFIX}shard:{ref}:result"
+
+
+def done_key(run_id: str) -> str:
+    return f"{KEY_PREFIX}done:{run_id}"
+
+
+def lease_key(ref: str) -> str:
+    return f"{KEY_PREFIX}lease:{ref}"
+
+
+def cancel_key(run_id: str) -> str:
+    return f"{KEY_PREFIX}cancel:{run_id}"
+
+
+async def live_workers(seller: str) -> int:
+    """Число воркеров продавца, приславших heartbeat за последние WORKER_TTL_SECONDS (0 без Redis)."""
+    client = cache.get_redis()
+    if client is None:
+        return 0
+    try:
+        return await client.zcount(workers_key(seller), time.time() - WORKER_TTL_SECONDS, "+inf")
+    except (RedisError, OSError) as e:
+        cache.redis_failed(e)
+        return 0
+
+
+async def should_distribute(seller: str, items_count: int) -> bool:
+    return items_count > ANALYSIS_SHARD_SIZE and await live_workers(seller) > 0
+
+
+async def iter_distributed(
+    seller: str,
+    items: List[Dict[str, Any]],
+    prepare: Callable[[List[Dict[str, Any]], int], AsyncIterator[List[Dict[str, Any]]]],
+    run_locally: Callable[[List[Dict[str, Any]]], AsyncIterator[Tuple[str, Dict[str, Any]]]],
+    on_progress: Optional[Callable[[int], None]] = None,
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Отдает пары (sku, отчет) в порядке items, как SkuAnalyzer.iter_reports.
+    prepare(items, size) (SkuAnalyzer.iter_prepared) отдает шарды, уже дополненные
+    результатами запросов к WB: их делает только этот процесс, под своим лимитером,
+    а воркеры лишь считают. Шард уходит в очередь, как только подготовлен.
+    run_locally(items) считает шарды, не посчитанные воркерами.
+    """
+    client = cache.get_redis()
+    run_id = uuid.uuid4().hex
+    shards = [items[i:i + ANALYSIS_SHARD_SIZE] for i in range(0, len(items), ANALYSIS_SHARD_SIZE)]
+    refs = [f"{run_id}:{number}" for number in range(len(shards))]
+    if client is None:
+        # Redis стал недоступен после should_distribute: очереди нет, считаем все сами
+        print(f"   [WARN] Redis недоступен; анализирую {len(items)} SKU локально.")
+        done_skus = 0
+        if on_progress:
+            on_progress(0)
+        for shard in shards:
+            async with contextlib.aclosing(run_locally(shard)) as reports:
+                async for pair in reports:
+                    yield pair
+            done_skus += len(shard)
+            if on_progress:
+                on_progress(done_skus)
+        return
+    print(f"-> DM: Распределенный анализ: {len(items)} SKU в {len(shards)} шардах...")
+
+    # Шарды публикуются в фоне по мере подготовки; published — сколько уже в очереди
+    published = 0
+    deadline = time.monotonic() + ANALYSIS_SHARD_TIMEOUT_SECONDS
+
+    async def publish() -> None:
+        nonlocal published, deadline
+        async with contextlib.aclosing(prepare(items, ANALYSIS_SHARD_SIZE)) as prepared:
+            async for shard in prepared:
+                ref = refs[published]
+                pipe = client.pipeline(transaction=False)
+                pipe.set(shard_key(ref), cache.encode({"run_id": run_id, "items": shard}), ex=SHARD_TTL_SECONDS)
+                pipe.rpush(queue_key(seller), ref)
+                await pipe.execute()
+                published += 1
+                deadline = time.monotonic() + ANALYSIS_SHARD_TIMEOUT_SECONDS
+
+    publisher = asyncio.create_task(publish())
+
+    def publish_failed() -> bool:
+        return publisher.done() and not publisher.cancelled() and publisher.exception() is not None
+
+    # Готовые шарды копятся здесь, пока не придет очередь отдать их по порядку;
+    # local — шарды, которые менеджер забрал себе (аренда за ним)
+    results: Dict[int, List] = {}
+    local: Set[int] = set()
+    next_shard = 0
+    done_skus = 0
+    if on_progress:
+        on_progress(0)
+    try:
+        while next_shard < len(shards):
+            if next_shard in local:
+                async with contextlib.aclosing(run_locally(shards[next_shard])) as reports:
+                    async for pair in reports:
+                        yield pair
+            elif next_shard in results:
+                for pair in results.pop(next_shard):
+                    yield pair
+            else:
+                # Если публикация упала, ждать нечего: срок считается истекшим
+                number = await _wait_done(client, run_id, lambda: 0.0 if publish_failed() else deadline)
+                if number is None:
+                    # Воркеры не справились за отведенное время (или шарды не удалось
+                    # опубликовать): публикацию останавливаем и забираем себе шарды,
+                    # которые сейчас никто не считает. Шарды в аренде у живых воркеров ждем дальше.
+                    if publish_failed():
+                        cache.redis_failed(publisher.exception())
+                    publisher.cancel()
+                    await asyncio.gather(publisher, return_exceptions=True)
+                    claimed = [number for number in range(next_shard, len(shards))
+                               if number not in results and number not in local and await _claim(client, refs[number])]
+                    local.update(claimed)
+                    if claimed:
+                        await _cancel_shards(client, seller, [refs[number] for number in claimed])
+                        leased = sum(1 for number in range(next_shard, len(shards)) if number not in results and number not in local)
+                        print(f"   [WARN] Шарды не получены от воркеров вовремя; досчитываю локально {len(claimed)} шардов, "
+                              f"у воркеров в работе {leased}.")
+                    deadline = time.monotonic() + ANALYSIS_SHARD_TIMEOUT_SECONDS
+                elif number not in local:
+                    data = await _read_result(client, refs[number])
+                    if data is not None:
+                        results[number] = [tuple(pair) for pair in data]
+                        deadline = time.monotonic() + ANALYSIS_SHARD_TIMEOUT_SECONDS
+                continue
+            done_skus += len(shards[next_shard])
+            next_shard += 1
+            if on_progress:
+                on_progress(done_skus)
+    finally:
+        publisher.cancel()
+        await asyncio.gather(publisher, return_exceptions=True)
+        await _cleanup(client, run_id, refs)
+
+
+async def _claim(client, ref: str) -> bool:
+    """
+    Забирает шард себе, если его не арендует воркер. Аренду менеджера воркер не
+    перехватит, поэтому шард не посчитается дважды. Без Redis шард считается нашим.
+    """
+    try:
+        return await client.lock(lease_key(ref), timeout=SHARD_TTL_SECONDS).acquire(blocking=False)
+    except (RedisError, OSError) as e:
+        cache.redis_failed(e)
+        return True
+
+
+async def renew_lease(client, lease, run_id: str) -> bool:
+    """
+    Продлевает аренду шарда воркером. False — запуск отменен (менеджер завершился
+    или отключился клиент) или аренда истекла и шард забрал менеджер: считать дальше незачем.
+    """
+    try:
+        if await client.exists(cancel_key(run_id)):
+            return False
+        await lease.extend(SHARD_LEASE_SECONDS, replace_ttl=True)
+    except LockError:
+        return False
+    return True
+
+
+async def _wait_done(client, run_id: str, deadline: Callable[[], float]) -> Optional[int]:
+    """
+    Номер следующего готового шарда или None, если время вышло или Redis недоступен.
+    deadline() перечитывается: публикация очередного шарда продлевает ожидание.
+    """
+    try:
+        while time.monotonic() < deadline():
+            popped = await client.blpop([done_key(run_id)], timeout=BLOCK_SECONDS)
+            if popped is not None:
+                return int(popped[1])
+    except (RedisError, OSError) as e:
+        cache.redis_failed(e)
+    return None
+
+
+async def _read_result(client, ref: str) -> Optional[List]:
+    try:
+        data = await client.get(result_key(ref))
+    except (RedisError, OSError) as e:
+        cache.redis_failed(e)
+        return None
+    return cache.decode(data) if data is not None else None
+
+
+async def _cancel_shards(client, seller: str, refs: List[str]) -> None:
+    """Убирает шарды из очереди и удаляет их входные данные: воркер, уже взявший ссылку, ее пропустит."""
+    try:
+        pipe = client.pipeline(transaction=False)
+        for ref in refs:
+            pipe.lrem(queue_key(seller), 0, ref)
+        pipe.delete(*(shard_key(ref) for ref in refs))
+        await pipe.execute()
+    except (RedisError, OSError):
+        pass
+
+
+async def _cleanup(client, run_id: str, refs: List[str]) -> None:
+    """Отменяет запуск: воркеры, еще считающие его шарды, бросят их при продлении аренды."""
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.set(cancel_key(run_id), 1, ex=SHARD_TTL_SECONDS)
+        pipe.delete(done_key(run_id), *(shard_key(ref) for ref in refs), *(result_key(ref) for ref in refs),
+                    *(lease_key(ref) for ref in refs))
+        await pipe.execute()
+    except (RedisError, OSError):
+        pass
@@ -0,0 +1,152 @@
+# Файл: decision_agent/sku_analyzer.py
+import json
+import logging
+from typing import List, Dict, Any, AsyncIterator, Callable, Optional, Tuple
+
+from utils import metrics
+from utils.funnel_table import FunnelTable
+from utils.sales_aggregator import normalize_sku
+from utils.wb_charcs_cache import get_required_charcs_async
+
+from agents.sales_agent import SalesAgent
+from agents.card_agent import CardAgent
+from agents.reviews_agent import ReviewsAgent
+from agents.audience_agent import AudienceAgent
+from agents.ads_agent import AdsAgent
+from agents.profit_agent import ProfitAgent
+
+logger = logging.getLogger(__name__)
+
+# Себестоимость, если пользователь ее не передал
+DEFAULT_COST_PRICE = 150.0
+
+
+def build_sku_input(
+    sku: str,
+    product_card: Dict[str, Any],
+    sales_indexes: Dict[str, Optional[Dict[str, Any]]],
+    ads_index: Optional[Dict[int, List[Dict[str, Any]]]],
+    analytics_tables: Dict[str, FunnelTable],
+    cost_prices: Dict[str, float],
+) -> Dict[str, Any]:
+    """
+    Все, что нужно агентам для анализа одного SKU, вырезанное из данных уровня
+    периода. Результат сериализуется в JSON, поэтому SKU можно анализировать
+    и в другом процессе (см. decision_agent/sharding.py).
+    """
+    nm_id = product_card.get("nmId")
+    normalized_sku = normalize_sku(sku)
+    return {
+        "sku": sku,
+        "nm_id": nm_id,
+        "card": product_card,
+        # Пустой индекс периода означает пустой отчет, None — неполный; это различие SalesAgent должен видеть
+        "sales": {
+            name: {normalized_sku: index.get(normalized_sku, {})} if index else index
+            for name, index in sales_indexes.items()
+        },
+        # None — список кампаний недоступен, а не "рекламы нет"
+        "ads": ads_index.get(nm_id, []) if ads_index is not None else None,
+        "audience": {name: table.get(nm_id, {}) for name, table in analytics_tables.items()},
+        "cost_price": cost_prices.get(sku, DEFAULT_COST_PRICE),
+    }
+
+
+class SkuAnalyzer:
+    """
+    Агенты уровня SKU. Работа разделена на два шага: iter_prepared() дополняет
+    входные данные build_sku_input() результатами сетевых запросов (отзывы,
+    обязательные характеристики), а расчет отчета по готовым данным в сеть не ходит.
+    Так все запросы к WB идут из одного процесса под общим лимитером, а
+    воркеры распределенного анализа только считают.
+    """
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.sales_agent = SalesAgent()
+        self.card_agent = CardAgent()
+        self.ads_agent = AdsAgent()
+        # Без ключа (воркер) анализатор принимает только уже подготовленные данные
+        self.reviews_agent = ReviewsAgent(api_key=api_key) if api_key else None
+        self.audience_agent = AudienceAgent()
+        self.profit_agent = ProfitAgent()
+
+    async def iter_prepared(self, items: List[Dict[str, Any]], batch_size: int) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Дополняет items (на месте) полями "reviews" и "required_charcs" и отдает их
+        порциями по batch_size в порядке items. Уже подготовленные SKU не запрашиваются.
+        """
+        # --- Отзывы: пакетный сбор для всех SKU запускается сразу, в порядке анализа ---
+        # Первые SKU получают отзывы первыми, поэтому их отчеты готовы, не дожидаясь всей пачки.
+        nm_ids = list(dict.fromkeys(item["nm_id"] for item in items if item["nm_id"] and "reviews" not in item))
+        review_tasks = self.reviews_agent.start_many(nm_ids) if nm_ids and self.reviews_agent else {}
+        try:
+            for start in range(0, len(items), batch_size):
+                batch = items[start:start + batch_size]
+                for item in batch:
+                    await self._prepare_one(item, review_tasks)
+                yield batch
+        finally:
+            # Если потребитель прекратил чтение (например, клиент отключился), отменяем недокачанные отзывы
+            for task in review_tasks.values():
+                task.cancel()
+
+    async def _prepare_one(self, item: Dict[str, Any], review_tasks: Dict[int, Any]) -> None:
+        if not item["nm_id"]:
+            return
+        if "reviews" not in item:
+            task = review_tasks.get(item["nm_id"])
+            item["reviews"] = await task if task else {"error": "Отзывы не были загружены."}
+        if "required_charcs" not in item:
+            subject_id = item["card"].get("subjectID") or item["card"].get("subjectId")
+            item["required_charcs"] = sorted(await get_required_charcs_async(subject_id)) if subject_id else []
+
+    async def iter_reports(
+        self,
+        items: List[Dict[str, Any]],
+        on_progress: Optional[Callable[[int], None]] = None,
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Отдает пары (sku, отчет) в порядке items; on_progress(done) вызывается перед каждым SKU."""
+        done = 0
+        prepared = self.iter_prepared(items, 1)
+        try:
+            async for batch in prepared:
+                if on_progress:
+                    on_progress(done)
+                yield batch[0]["sku"], self._analyze_one(batch[0])
+                done += 1
+        finally:
+            await prepared.aclose()
+
+    def _analyze_one(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        sku, product_card, nm_id = item["sku"], item["card"], item["nm_id"]
+
+        # Ваш диагностический жучок: карточка целиком только на уровне DEBUG, на горячем пути не сериализуем
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Данные для CardAgent (SKU: %s):\n%s", sku, json.dumps(product_card, indent=2, ensure_ascii=False))
+
+        print(f"Анализ товара SKU: {sku}")
+        if not nm_id:
+            return {"error": "Не удалось получить nmId для этого товара."}
+
+        sku_report = {}
+        # Вызываем всех агентов
+        with metrics.AGENT_SECONDS.labels("card").time():
+            sku_report['card'] = self.card_agent.analyze(product_card=product_card, required_charcs=set(item["required_charcs"]))
+        with metrics.AGENT_SECONDS.labels("sales").time():
+            sku_report['sales'] = self.sales_agent.analyze(sku=sku, sales_indexes=item["sales"])
+        if item["ads"] is None:
+            sku_report['ads'] = {"error": "Не удалось получить список рекламных кампаний."}
+        else:
+            with metrics.AGENT_SECONDS.labels("ads").time():
+                sku_report['ads'] = self.ads_agent.analyze(nm_id=nm_id, ads_index={nm_id: item["ads"]})
+        with metrics.AGENT_SECONDS.labels("audience").time():
+            sku_report['audience'] = self.audience_agent.analyze(analytics_data_by_period=item["audience"])
+        sku_report['reviews'] = item["reviews"]
+
+        # Прибыль по каждому периоду; без продаж за период (ошибка отчета) считать ее не из чего
+        with metrics.AGENT_SECONDS.labels("profit").time():
+            sku_report['profit'] = {
+                period_name: sales if "error" in sales else self.profit_agent.analyze(sales_data=sales, cost_price=item["cost_price"])
+                for period_name, sales in sku_report['sales'].items()
+            }
+        return sku_report
@@ -0,0 +1,159 @@
+# Файл: decision_agent/worker.py
+"""
+Воркер распределенного анализа (см. decision_agent/sharding.py).
+
+Запуск: python -m decision_agent.worker [--concurrency N]
+Воркер обслуживает продавца из MARKETPLACE_API_KEY. Агенты считают шард
+синхронно, поэтому --concurrency N запускает N процессов (по одному на ядро);
+на других машинах с доступом к тому же Redis запускайте свои. Шарды приходят уже с
+отзывами и характеристиками, поэтому воркер не обращается к API WB и не
+открывает локальные хранилища продавца.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import uuid
+
+from redis.exceptions import LockError, RedisError
+
+from config import MARKETPLACE_API_KEY
+from decision_agent import sharding
+from decision_agent.sku_analyzer import SkuAnalyzer
+from utils import cache
+
+
+async def _heartbeat(worker_id: str, seller: str) -> None:
+    while True:
+        client = cache.get_redis()
+        if client is not None:
+            try:
+                await client.zadd(sharding.workers_key(seller), {worker_id: time.time()})
+                # Заодно забываем воркеры, которые давно не отзывались
+                await client.zremrangebyscore(sharding.workers_key(seller), 0, time.time() - sharding.WORKER_TTL_SECONDS * 10)
+            except (RedisError, OSError) as e:
+                cache.redis_failed(e)
+        await asyncio.sleep(sharding.WORKER_HEARTBEAT_SECONDS)
+
+
+async def _process(analyzer: SkuAnalyzer, ref: str) -> None:
+    client = cache.get_redis()
+    lease = client.lock(sharding.lease_key(ref), timeout=sharding.SHARD_LEASE_SECONDS)
+    if not await lease.acquire(blocking=False):
+        # Шард уже забрал себе менеджер
+        return
+    try:
+        data = await client.get(sharding.shard_key(ref))
+        if data is None:
+            # Шард отменен или уже досчитан менеджером
+            return
+        shard = cache.decode(data)
+        run_id = shard["run_id"]
+        print(f"-> Worker: шард {ref}, SKU: {len(shard['items'])}...")
+        reports = []
+        renewed_at = time.monotonic()
+        async for sku, report in analyzer.iter_reports(shard["items"]):
+            reports.append([sku, report])
+            if time.monotonic() - renewed_at > sharding.SHARD_LEASE_SECONDS / 3:
+                if not await sharding.renew_lease(client, lease, run_id):
+                    print(f"   [WARN] Worker: шард {ref} отменен, результат не нужен.")
+                    return
+                renewed_at = time.monotonic()
+        if not await sharding.renew_lease(client, lease, run_id):
+            print(f"   [WARN] Worker: шард {ref} отменен, результат не нужен.")
+            return
+
+        number = ref.rsplit(":", 1)[1]
+        pipe = client.pipeline(transaction=False)
+        pipe.set(sharding.result_key(ref), cache.encode(reports), ex=sharding.SHARD_TTL_SECONDS)
+        pipe.rpush(sharding.done_key(run_id), number)
+        pipe.expire(sharding.done_key(run_id), sharding.SHARD_TTL_SECONDS)
+        await pipe.execute()
+    except BaseException:
+        # Аренду упавшего шарда отпускаем сразу, чтобы менеджер не ждал ее истечения
+        try:
+            await lease.release()
+        except (LockError, RedisError, OSError):
+            pass
+        raise
+
+
+async def serve(api_key: str) -> None:
+    seller = sharding.seller_id(api_key)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    analyzer = SkuAnalyzer()
+    await cache.connect()
+    heartbeat = asyncio.create_task(_heartbeat(worker_id, seller))
+    print(f"-> Worker {worker_id}: жду шарды продавца {seller}...")
+
+    try:
+        while True:
+            client = cache.get_redis()
+            if client is None:
+                await asyncio.sleep(sharding.BLOCK_SECONDS)
+                continue
+            try:
+                popped = await client.blpop([sharding.queue_key(seller)], timeout=sharding.BLOCK_SECONDS)
+                if popped is not None:
+                    await _process(analyzer, popped[1].decode())
+            except (RedisError, OSError) as e:
+                cache.redis_failed(e)
+            except Exception as e:
+                # Шард, на котором упал воркер, менеджер досчитает сам по таймауту
+                print(f"   [ERROR] Worker: ошибка при обработке шарда: {e}")
+    finally:
+        heartbeat.cancel()
+        client = cache.get_redis()
+        if client is not None:
+            try:
+                await client.zrem(sharding.workers_key(seller), worker_id)
+            except (RedisError, OSError):
+                pass
+        await cache.close()
+
+
+def _run(api_key: str) -> None:
+    try:
+        asyncio.run(serve(api_key))
+    except KeyboardInterrupt:
+        pass
+
+
+def _run_child(api_key: str) -> None:
+    # Ctrl+C ловит родитель и останавливает детей через SIGTERM, который здесь
+    # превращается в KeyboardInterrupt, чтобы воркер успел сняться с учета
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    _run(api_key)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Воркер распределенного анализа SKU")
+    parser.add_argument("--concurrency", type=int, default=1, help="сколько процессов-воркеров запустить (по одному на ядро)")
+    args = parser.parse_args()
+    if not MARKETPLACE_API_KEY:
+        raise SystemExit("MARKETPLACE_API_KEY не задан.")
+    if args.concurrency <= 1:
+        _run(MARKETPLACE_API_KEY)
+        return
+
+    # Каждый процесс — отдельный воркер со своим heartbeat и подключением к Redis
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=_run_child, args=(MARKETPLACE_API_KEY,)) for _ in range(args.concurrency)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
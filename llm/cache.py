@@ -0,0 +1,87 @@
+# Файл: llm/cache.py
+import hashlib
+import json
+import re
+import time
+from typing import Dict, Optional
+
+from utils import cache, metrics
+
+# Ключи ответов LLM и служебные структуры в Redis
+KEY_PREFIX = "llm:response:"
+INDEX_KEY = "llm:index"          # ZSET: ключ ответа -> время записи (для вытеснения старых)
+STATS_KEY = "llm:stats"          # HASH: hits / misses по всем процессам
+
+# Ответ живет сутки; всего храним не больше MAX_ENTRIES ответов
+TTL_SECONDS = 24 * 3600
+MAX_ENTRIES = 5000
+
+# Счетчики текущего процесса
+_local_stats = {"hits": 0, "misses": 0}
+
+
+def _normalize_prompt(prompt: str) -> str:
+    """Убирает различия в отступах и пробелах, не влияющие на смысл промпта."""
+    return "\n".join(re.sub(r"\s+", " ", line).strip() for line in prompt.strip().splitlines())
+
+
+def make_key(prompt: str, model: str, temperature: float) -> str:
+    payload = json.dumps(
+        {"prompt": _normalize_prompt(prompt), "model": model, "temperature": temperature},
+        ensure_ascii=False, sort_keys=True,
+    )
+    return KEY_PREFIX + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def _count(result: str) -> None:
+    _local_stats[result] += 1
+    metrics.cache_result("llm", result == "hits")
+    client = cache.get_redis()
+    if client is None:
+        return
+    try:
+        await client.hincrby(STATS_KEY, result, 1)
+    except Exception:
+        pass
+
+
+async def get(key: str) -> Optional[str]:
+    """Ответ LLM из кэша (память процесса, затем Redis) или None."""
+    value = await cache.get(key)
+    await _count("hits" if value is not None else "misses")
+    return value
+
+
+async def set(key: str, value: str, ttl: int = TTL_SECONDS, max_entries: int = MAX_ENTRIES) -> None:
+    """Сохраняет ответ и вытесняет самые старые записи сверх max_entries."""
+    await cache.set(key, value, ex=ttl)
+    client = cache.get_redis()
+    if client is None:
+        return
+    try:
+        pipe = client.pipeline()
+        pipe.zadd(INDEX_KEY, {key: time.time()})
+        # Записи старше TTL уже удалены самим Redis — чистим их и из индекса
+        pipe.zremrangebyscore(INDEX_KEY, 0, time.time() - ttl)
+        pipe.zcard(INDEX_KEY)
+        size = (await pipe.execute())[-1]
+
+        if size > max_entries:
+            evicted = [k.decode() for k, _ in await client.zpopmin(INDEX_KEY, size - max_entries)]
+            if evicted:
+                await cache.delete(*evicted)
+    except Exception as e:
+        print(f"[WARN] Не удалось обновить индекс LLM-кэша: {e}")
+
+
+async def stats() -> Dict[str, Dict[str, int]]:
+    """Счетчики попаданий: текущего процесса и суммарные по Redis."""
+    shared = {}
+    client = cache.get_redis()
+    if client is not None:
+        try:
+            shared = {k.decode(): int(v) for k, v in (await client.hgetall(STATS_KEY)).items()}
+            shared["entries"] = await client.zcard(INDEX_KEY)
+        except Exception:
+            shared = {}
+    return {"process": dict(_local_stats), "shared": shared}
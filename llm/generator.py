@@ -1,20 +1,65 @@
 # Файл: llm/generator.py (ФИНАЛЬНАЯ ГИБРИДНАЯ ВЕРСИЯ)
+import asyncio
+import contextlib
 import json
+import time
 from gigachat import GigaChat
-from config import GIGACHAT_CREDENTIALS
-from typing import Dict, Any
+from config import GIGACHAT_CREDENTIALS, LLM_CONCURRENCY, LLM_TIMEOUT_SECONDS
+from typing import Dict, Any, Callable, List, Optional, Tuple
+from llm import cache as llm_cache
+from utils import metrics
+from utils.http_client import run_sync
 
 # --- ЧАСТЬ 1: ВСПОМОГАТЕЛЬНЫЕ ИНСТРУМЕНТЫ ---
 
+# Параметры модели входят в ключ кэша ответов
+LLM_MODEL = "GigaChat"
+LLM_TEMPERATURE = 0.01
+
 # Эта функция остается для создания клиента GigaChat
 if not GIGACHAT_CREDENTIALS:
     giga_client = None
 else:
     try:
-        giga_client = GigaChat(credentials=GIGACHAT_CREDENTIALS, verify_ssl_certs=False, temperature=0.01)
+        giga_client = GigaChat(credentials=GIGACHAT_CREDENTIALS, verify_ssl_certs=False, model=LLM_MODEL, temperature=LLM_TEMPERATURE)
     except Exception as e:
         giga_client = None
 
+@contextlib.contextmanager
+def _llm_call_timer(mode: str):
+    """Замер вызова GigaChat; таймауты и ошибки учитываются отдельным статусом."""
+    started = time.perf_counter()
+    status = "error"
+    try:
+        yield
+        status = "ok"
+    except asyncio.TimeoutError:
+        status = "timeout"
+        raise
+    finally:
+        metrics.LLM_CALL_SECONDS.labels(mode, status).observe(time.perf_counter() - started)
+
+def _chat_cached(prompt: str) -> str:
+    """Вызов LLM с кэшем ответов: одинаковый промпт не отправляется повторно."""
+    key = llm_cache.make_key(prompt, LLM_MODEL, LLM_TEMPERATURE)
+    if (cached := run_sync(llm_cache.get(key))) is not None:
+        return cached
+    with _llm_call_timer("sync"):
+        content = giga_client.chat(prompt).choices[0].message.content
+    run_sync(llm_cache.set(key, content))
+    return content
+
+async def _achat_cached(prompt: str, timeout: float) -> str:
+    """Асинхронный вызов LLM с кэшем ответов и таймаутом."""
+    key = llm_cache.make_key(prompt, LLM_MODEL, LLM_TEMPERATURE)
+    if (cached := await llm_cache.get(key)) is not None:
+        return cached
+    with _llm_call_timer("async"):
+        response = await asyncio.wait_for(giga_client.achat(prompt), timeout=timeout)
+    content = response.choices[0].message.content
+    await llm_cache.set(key, content)
+    return content
+
 def _calculate_dynamic(current, previous) -> Dict[str, Any]:
     """Маленький калькулятор для расчета динамики в цифрах и процентах."""
     if previous is None or current is None: return {"abs": "N/A", "perc": "N/A"}
@@ -27,45 +72,52 @@ def _calculate_dynamic(current, previous) -> Dict[str, Any]:
 
 # --- ЧАСТЬ 2: ГЛАВНАЯ ФУНКЦИЯ ---
 
-def generate_hybrid_report(raw_data: dict, period_1: dict, period_2: dict) -> str:
+def _build_hybrid_prompt(raw_data: dict, periods: List[dict]) -> Tuple[Optional[str], Optional[str]]:
     """
-    Основная функция, которая создает гибридный отчет:
-    1. Собирает детальные данные по Периоду 1.
-    2. Строит Markdown-таблицу для сравнения.
-    3. Отправляет всё в LLM за финальными выводами.
+    Готовит промпт гибридного отчета. Возвращает (промпт, None) или
+    (None, готовый ответ), если обращаться к LLM не нужно.
+    periods[0] — основной период; динамика считается к periods[1].
     """
-    if not giga_client: return "LLM генератор не активен."
+    if not giga_client: return None, "LLM генератор не активен."
 
     sku = list(raw_data.keys())[0]
     sku_data = raw_data.get(sku, {})
-    if "error" in sku_data: return f"### Анализ для {sku} не удался."
+    if "error" in sku_data: return None, f"### Анализ для {sku} не удался."
 
     # --- ШАГ 2.1: Собираем детальные метрики для ОСНОВНОГО периода (Period 1) ---
     p1_metrics = {}
     if sales := sku_data.get('sales', {}).get('period_1', {}): p1_metrics.update(sales)
-    if profit := sku_data.get('profit', {}): p1_metrics.update(profit)
+    if profit := sku_data.get('profit', {}).get('period_1', {}): p1_metrics.update(profit)
     if card := sku_data.get('card', {}): p1_metrics.update(card)
     if reviews := sku_data.get('reviews', {}): p1_metrics.update(reviews)
 
-    # --- ШАГ 2.2: Строим сравнительную таблицу ---
-    p1_sales = sku_data.get('sales', {}).get('period_1', {})
-    p2_sales = sku_data.get('sales', {}).get('period_2', {})
+    # --- ШАГ 2.2: Строим сравнительную таблицу: по колонке на каждый период ---
+    sales_by_period = sku_data.get('sales', {})
+    period_sales = [sales_by_period.get(f'period_{number}', {}) for number in range(1, len(periods) + 1)]
     
     table_data = {
-        "Заказано, шт": (p1_sales.get('units_ordered'), p2_sales.get('units_ordered')),
-        "Выручка (общая), руб": (p1_sales.get('gross_revenue_rub'), p2_sales.get('gross_revenue_rub')),
+        "Заказано, шт": [sales.get('units_ordered') for sales in period_sales],
+        "Выручка (общая), руб": [sales.get('gross_revenue_rub') for sales in period_sales],
     }
     
-    p1_info = f"Период 1 ({period_1['date_from']} - {period_1['date_to']})"
-    p2_info = f"Период 2 ({period_2['date_from']} - {period_2['date_to']})"
+    period_infos = [f"Период {number} ({period['date_from']} - {period['date_to']})" for number, period in enumerate(periods, start=1)]
+    p1_info = period_infos[0]
+    # Динамика по каждой паре соседних периодов (Период k к Периоду k+1), по колонке на пару;
+    # для одного и двух периодов — одна колонка, как раньше
+    if len(periods) <= 2:
+        dynamic_titles = ["Динамика (Δ)"]
+    else:
+        dynamic_titles = [f"Динамика (Δ, Период {number} к Периоду {number + 1})" for number in range(1, len(periods))]
     
-    header = f"| Показатель | {p1_info} | {p2_info} | Динамика (Δ) |\n"
-    separator = "|:---|---:|---:|:---|\n"
+    header = f"| Показатель | {' | '.join(period_infos)} | {' | '.join(dynamic_titles)} |\n"
+    separator = "|:---|" + "---:|" * len(periods) + ":---|" * len(dynamic_titles) + "\n"
     body = ""
-    for name, (p1_val, p2_val) in table_data.items():
-        dynamic = _calculate_dynamic(p1_val, p2_val)
-        dynamic_str = f"{dynamic['abs']:+} ({dynamic['perc']:+}%)" if dynamic['abs'] != "N/A" else "N/A"
-        body += f"| {name} | {p1_val or 'N/A'} | {p2_val or 'N/A'} | {dynamic_str} |\n"
+    for name, values in table_data.items():
+        dynamic_strs = []
+        for index in range(len(dynamic_titles)):
+            dynamic = _calculate_dynamic(values[index], values[index + 1] if index + 1 < len(values) else None)
+            dynamic_strs.append(f"{dynamic['abs']:+} ({dynamic['perc']:+}%)" if dynamic['abs'] != "N/A" else "N/A")
+        body += f"| {name} | {' | '.join(str(value or 'N/A') for value in values)} | {' | '.join(dynamic_strs)} |\n"
     comparison_table = header + separator + body
 
     # --- ШАГ 2.3: Формируем финальный промпт для LLM ---
@@ -102,13 +154,75 @@ def generate_hybrid_report(raw_data: dict, period_1: dict, period_2: dict) -> st
     {json.dumps(p1_metrics, indent=2, ensure_ascii=False)}
     ```
     """
+    return prompt, None
+
+def generate_hybrid_report(raw_data: dict, periods: List[dict]) -> str:
+    """
+    Основная функция, которая создает гибридный отчет:
+    1. Собирает детальные данные по Периоду 1.
+    2. Строит Markdown-таблицу для сравнения всех периодов.
+    3. Отправляет всё в LLM за финальными выводами.
+    """
+    prompt, ready_answer = _build_hybrid_prompt(raw_data, periods)
+    if prompt is None: return ready_answer
     
     try:
-        response = giga_client.chat(prompt)
-        return response.choices[0].message.content
+        return _chat_cached(prompt)
+    except Exception as e:
+        return f"Произошла ошибка при генерации отчета: {e}"
+
+async def generate_hybrid_report_async(raw_data: dict, periods: List[dict], timeout: float = LLM_TIMEOUT_SECONDS) -> str:
+    """Асинхронная версия generate_hybrid_report с ограничением времени на вызов LLM."""
+    prompt, ready_answer = _build_hybrid_prompt(raw_data, periods)
+    if prompt is None: return ready_answer
+
+    try:
+        return await _achat_cached(prompt, timeout)
+    except asyncio.TimeoutError:
+        return f"Произошла ошибка при генерации отчета: LLM не ответила за {timeout} с."
     except Exception as e:
         return f"Произошла ошибка при генерации отчета: {e}"
 
+async def generate_sku_report_async(
+    sku: str,
+    analysis_data: dict,
+    periods: List[dict],
+    semaphore: Optional[asyncio.Semaphore] = None,
+    timeout: float = LLM_TIMEOUT_SECONDS,
+) -> str:
+    """Отчет по одному SKU; semaphore ограничивает число одновременных вызовов LLM."""
+    if "error" in analysis_data:
+        return f"### Анализ для {sku} не удался: {analysis_data['error']}"
+    if semaphore is None:
+        return await generate_hybrid_report_async({sku: analysis_data}, periods, timeout=timeout)
+    async with semaphore:
+        return await generate_hybrid_report_async({sku: analysis_data}, periods, timeout=timeout)
+
+async def generate_hybrid_reports_async(
+    raw_results: Dict[str, Any],
+    periods: List[dict],
+    max_concurrency: int = LLM_CONCURRENCY,
+    timeout: float = LLM_TIMEOUT_SECONDS,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> List[str]:
+    """
+    Генерирует отчеты по всем SKU параллельно (не более max_concurrency вызовов LLM
+    одновременно). Порядок отчетов совпадает с порядком SKU в raw_results.
+    on_progress(готово, всего) вызывается после каждого отчета.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    total, done = len(raw_results), 0
+
+    async def generate_one(sku: str, analysis_data: dict) -> str:
+        nonlocal done
+        report = await generate_sku_report_async(sku, analysis_data, periods, semaphore, timeout)
+        done += 1
+        if on_progress:
+            on_progress(done, total)
+        return report
+
+    return await asyncio.gather(*(generate_one(sku, data) for sku, data in raw_results.items()))
+
 # --- ЧАСТЬ 3: СТАРАЯ ФУНКЦИЯ ДЛЯ УТОЧНЯЮЩИХ ВОПРОСОВ ---
 # Мы ее оставляем, она нам понадобится для следующего этапа - интерактивности
 
@@ -117,7 +231,17 @@ def answer_question(raw_data_for_aspect: dict, aspect_name: str, sku: str) -> st
     formatted_data = json.dumps(raw_data_for_aspect, indent=2, ensure_ascii=False)
     prompt = f"Ты — data-аналитик. Объясни кратко и по сути данные по аспекту '{aspect_name}' для товара '{sku}'.\nДанные:\n{formatted_data}"
     try:
-        response = giga_client.chat(prompt)
-        return response.choices[0].message.content
+        return _chat_cached(prompt)
+    except Exception as e:
+        return f"Ошибка: {e}"
+
+async def answer_question_async(raw_data_for_aspect: dict, aspect_name: str, sku: str, timeout: float = LLM_TIMEOUT_SECONDS) -> str:
+    if not giga_client: return "LLM генератор не активен."
+    formatted_data = json.dumps(raw_data_for_aspect, indent=2, ensure_ascii=False)
+    prompt = f"Ты — data-аналитик. Объясни кратко и по сути данные по аспекту '{aspect_name}' для товара '{sku}'.\nДанные:\n{formatted_data}"
+    try:
+        return await _achat_cached(prompt, timeout)
+    except asyncio.TimeoutError:
+        return f"Ошибка: LLM не ответила за {timeout} с."
     except Exception as e:
-        return f"Ошибка: {e}"
\ No newline at end of file
+        return f"Ошибка: {e}"
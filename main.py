@@ -1,17 +1,19 @@
 # Файл: main.py (ФИНАЛЬНАЯ ВЕРСИЯ ДЛЯ СВОДНОГО ОТЧЕТА)
-import sys
-import os
+import asyncio
+import json
 import logging
 import uuid
-import redis
+from typing import AsyncIterator
 
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import Response, StreamingResponse
 from schemas.models import AnalysisRequest, QuestionRequest
 from decision_agent.manager import DecisionManager
-from llm.generator import generate_hybrid_report, answer_question
-from config import MARKETPLACE_API_KEY, GIGACHAT_CREDENTIALS
-from utils import cache 
-from utils.marketplace_api import get_all_wb_products
+from llm.generator import generate_hybrid_reports_async, generate_sku_report_async, answer_question_async
+from llm import cache as llm_cache
+from config import MARKETPLACE_API_KEY, GIGACHAT_CREDENTIALS, LLM_CONCURRENCY
+from utils import analysis_results, cache, jobs, metrics
+from utils.http_client import close_clients
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,56 +23,70 @@ app = FastAPI(title="Мультиагентная аналитическая с
 @app.on_event("startup")
 async def startup_event():
     logger.info("Сервер запускается, пытаюсь подключиться к Redis...")
-    try:
-        cache.redis_client = redis.Redis(
-            host=os.environ.get("REDIS_HOST", "localhost"),
-            port=int(os.environ.get("REDIS_PORT", 6379)),
-            db=int(os.environ.get("REDIS_DB", 0)),
-            decode_responses=True
-        )
-        cache.redis_client.ping()
+    if await cache.connect():
         logger.info("Успешное подключение к Redis.")
-    except redis.exceptions.ConnectionError as e:
-        logger.error(f"Не удалось подключиться к Redis: {e}")
-        logger.warning("Кэширование будет отключено.")
-        cache.redis_client = None
+    else:
+        logger.warning("Redis недоступен: кэш работает только в памяти процесса.")
+
+    # Один управляющий агент на процесс: агенты, пулы соединений и кэши
+    # переиспользуются между запросами. Состояние конкретного анализа
+    # DecisionManager хранит только в локальных переменных, поэтому
+    # конкурентные запросы не мешают друг другу.
+    if MARKETPLACE_API_KEY:
+        app.state.manager = DecisionManager(marketplace_api_key=MARKETPLACE_API_KEY)
+        # Каталог прогревается и обновляется в фоне, запросы читают его из памяти
+        app.state.manager.catalog.start_background_refresh()
+
+def get_manager() -> DecisionManager:
+    """Долгоживущий DecisionManager, созданный при старте сервера."""
+    manager = getattr(app.state, "manager", None)
+    if manager is None:
+        manager = app.state.manager = DecisionManager(marketplace_api_key=MARKETPLACE_API_KEY)
+    return manager
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    if cache.redis_client:
-        logger.info("Закрываю соединение с Redis...")
-        cache.redis_client.close()
+    if getattr(app.state, "manager", None):
+        app.state.manager.catalog.stop_background_refresh()
+    logger.info("Закрываю пулы соединений к WB API...")
+    await close_clients()
+    logger.info("Закрываю пул соединений с Redis...")
+    await cache.close()
 
 @app.get("/products")
 async def get_product_list():
     logger.info("Получен запрос на список всех товаров...")
     if not MARKETPLACE_API_KEY:
         raise HTTPException(status_code=500, detail="API ключ маркетплейса не настроен.")
-    product_data = get_all_wb_products(api_key=MARKETPLACE_API_KEY)
+    # Каталог отдается из кэша: по одной записи на SKU с остатками, суммированными по складам
+    product_data = await get_manager().catalog.get_products()
     if "error" in product_data:
         raise HTTPException(status_code=502, detail=f"Ошибка API: {product_data['error']}")
-    return product_data
+    return {"products": list(product_data["products"].values())}
 
-@app.post("/analyze")
-async def analyze_products(request: AnalysisRequest):
+def _period_to_dict(period) -> dict:
+    """Преобразуем Pydantic-модель периода в простой словарь для передачи."""
+    return {'date_from': period.date_from.isoformat(), 'date_to': period.date_to.isoformat()}
+
+async def _run_analysis_pipeline(request: AnalysisRequest, request_id: str, on_stage=None) -> dict:
     """
-    ИЗМЕНЕНО: Генерирует и объединяет СРАВНИТЕЛЬНЫЕ отчеты.
+    Полный цикл анализа: сбор данных, отчеты LLM и сохранение результата под request_id.
+    Используется и синхронным /analyze, и фоновыми задачами /analyze/jobs.
     """
     if not MARKETPLACE_API_KEY or not GIGACHAT_CREDENTIALS:
         raise HTTPException(status_code=500, detail="API ключи не настроены.")
 
-    logger.info("Шаг 1: Запуск Управляющего Агента для сбора данных за 2 периода...")
-    manager = DecisionManager(marketplace_api_key=MARKETPLACE_API_KEY)
-    
-    # Преобразуем Pydantic-модели в простые словари для передачи
-    period_1_dict = {'date_from': request.period_1.date_from.isoformat(), 'date_to': request.period_1.date_to.isoformat()}
-    period_2_dict = {'date_from': request.period_2.date_from.isoformat(), 'date_to': request.period_2.date_to.isoformat()}
+    report_stage = on_stage or (lambda *args, **kwargs: None)
 
-    raw_results = manager.run_analysis(
+    periods = [_period_to_dict(period) for period in request.periods]
+    logger.info(f"Шаг 1: Запуск Управляющего Агента для сбора данных за {len(periods)} период(а/ов)...")
+    manager = get_manager()
+
+    raw_results = await manager.run_analysis_async(
         sku_list=request.sku_list,
-        period_1=period_1_dict,
-        period_2=period_2_dict,
-        cost_prices=request.cost_prices
+        periods=periods,
+        cost_prices=request.cost_prices,
+        on_stage=on_stage
     )
     
     if "error" in raw_results:
@@ -80,30 +96,21 @@ async def analyze_products(request: AnalysisRequest):
     logger.info("Сбор данных и анализ завершены.")
 
     logger.info("Шаг 2: Генерация сводного сравнительного отчета с помощью LLM...")
+    report_stage("llm", done=0, total=len(raw_results))
     
-    all_reports = []
-    for sku, analysis_data in raw_results.items():
-        if "error" in analysis_data:
-            all_reports.append(f"### Анализ для {sku} не удался: {analysis_data['error']}")
-            continue
-
-        single_sku_data = {sku: analysis_data}
-        
-        # ВЫЗЫВАЕМ НОВУЮ ФУНКЦИЮ
-        comparison_report = generate_hybrid_report(
-            single_sku_data, 
-            period_1=period_1_dict,
-            period_2=period_2_dict
+    # Отчеты по всем SKU генерируются параллельно, порядок сохраняется
+    with metrics.STAGE_SECONDS.labels("llm").time():
+        all_reports = await generate_hybrid_reports_async(
+            raw_results,
+            periods=periods,
+            on_progress=lambda done, total: report_stage("llm", done=done, total=total)
         )
-        all_reports.append(comparison_report)
     
     final_summary = "\n\n---\n\n".join(all_reports)
     logger.info("Сводный отчет успешно сгенерирован.")
     
-    request_id = str(uuid.uuid4())
-    if cache.redis_client:
-        cache.cache_set(request_id, raw_results, ex=3600)
-        logger.info(f"Результаты анализа для ID {request_id} сохранены в кэш.")
+    await analysis_results.save_results(request_id, raw_results)
+    logger.info(f"Результаты анализа для ID {request_id} сохранены в кэш.")
 
     return {
         "request_id": request_id,
@@ -111,22 +118,134 @@ async def analyze_products(request: AnalysisRequest):
         "raw_data": raw_results
     }
 
+@app.post("/analyze")
+async def analyze_products(request: AnalysisRequest):
+    """
+    ИЗМЕНЕНО: Генерирует и объединяет СРАВНИТЕЛЬНЫЕ отчеты.
+    Соединение держится до конца анализа; для больших каталогов используйте /analyze/jobs.
+    """
+    return await _run_analysis_pipeline(request, request_id=str(uuid.uuid4()))
+
+async def _stream_analysis(request: AnalysisRequest, request_id: str) -> AsyncIterator[str]:
+    """
+    Генерирует NDJSON-события анализа: sku_data (raw_data одного SKU, сразу после агентов),
+    sku_summary (отчет LLM по SKU), затем done или error.
+    """
+    manager = get_manager()
+    periods = [_period_to_dict(period) for period in request.periods]
+
+    events: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+    raw_results, summaries, llm_tasks = {}, {}, []
+
+    async def summarize(sku: str, analysis_data: dict) -> None:
+        summaries[sku] = await generate_sku_report_async(sku, analysis_data, periods, semaphore)
+        await events.put({"type": "sku_summary", "sku": sku, "llm_summary": summaries[sku]})
+
+    async def produce() -> None:
+        try:
+            async for sku, sku_report in manager.iter_analysis_async(
+                sku_list=request.sku_list,
+                periods=periods,
+                cost_prices=request.cost_prices
+            ):
+                if sku is None:
+                    await events.put({"type": "error", "detail": sku_report["error"]})
+                    return
+                raw_results[sku] = sku_report
+                await events.put({"type": "sku_data", "sku": sku, "raw_data": sku_report})
+                # Отчет LLM по SKU начинаем генерировать, не дожидаясь остальных SKU
+                llm_tasks.append(asyncio.create_task(summarize(sku, sku_report)))
+
+            await asyncio.gather(*llm_tasks)
+            await analysis_results.save_results(request_id, raw_results)
+            await events.put({
+                "type": "done",
+                "request_id": request_id,
+                "llm_summary": "\n\n---\n\n".join(summaries[sku] for sku in raw_results)
+            })
+        except Exception as e:
+            logger.error(f"Потоковый анализ {request_id} завершился ошибкой: {e}")
+            await events.put({"type": "error", "detail": str(e)})
+        finally:
+            for task in llm_tasks:
+                task.cancel()
+            await events.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        yield json.dumps({"type": "started", "request_id": request_id}) + "\n"
+        while (event := await events.get()) is not None:
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+    finally:
+        # Клиент отключился или поток завершен — останавливаем сбор данных
+        producer.cancel()
+
+@app.post("/analyze/stream")
+async def analyze_products_stream(request: AnalysisRequest):
+    """Потоковый вариант /analyze: результаты по каждому SKU приходят по мере готовности (NDJSON)."""
+    if not MARKETPLACE_API_KEY or not GIGACHAT_CREDENTIALS:
+        raise HTTPException(status_code=500, detail="API ключи не настроены.")
+    return StreamingResponse(_stream_analysis(request, str(uuid.uuid4())), media_type="application/x-ndjson")
+
+@app.post("/analyze/jobs", status_code=202)
+async def submit_analysis_job(request: AnalysisRequest):
+    """Ставит анализ в фоновую задачу и сразу возвращает ее ID (он же request_id для /question)."""
+    if not MARKETPLACE_API_KEY or not GIGACHAT_CREDENTIALS:
+        raise HTTPException(status_code=500, detail="API ключи не настроены.")
+
+    job_id = str(uuid.uuid4())
+    jobs.submit_job(job_id, lambda progress: _run_analysis_pipeline(request, request_id=job_id, on_stage=progress))
+    logger.info(f"Анализ поставлен в очередь как задача {job_id}.")
+    return {"job_id": job_id, "request_id": job_id, "status_url": f"/analyze/jobs/{job_id}"}
+
+@app.get("/analyze/jobs/{job_id}")
+async def get_analysis_job(job_id: str):
+    """Статус задачи по этапам; после завершения в поле result лежит итоговый отчет."""
+    job = await jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача с таким ID не найдена.")
+    return job
+
+@app.get("/ads/coverage")
+async def get_ads_coverage():
+    """Покрытие всего каталога рекламой по индексу кампаний."""
+    if not MARKETPLACE_API_KEY:
+        raise HTTPException(status_code=500, detail="API ключ маркетплейса не настроен.")
+    manager = get_manager()
+    product_data = await manager.catalog.get_products()
+    if "error" in product_data:
+        raise HTTPException(status_code=502, detail=f"Ошибка API: {product_data['error']}")
+    ads_index = await manager.ads_index.get_index()
+    if ads_index is None:
+        raise HTTPException(status_code=502, detail="Ошибка API: не удалось получить список рекламных кампаний.")
+    nm_ids = [card["nmId"] for card in product_data["products"].values() if card.get("nmId")]
+    return manager.ads_agent.coverage(nm_ids, ads_index)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Метрики процесса в формате Prometheus: время запросов к WB, этапов, агентов и LLM."""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/llm/cache/stats")
+async def get_llm_cache_stats():
+    """Счетчики попаданий в кэш ответов LLM."""
+    return await llm_cache.stats()
+
 @app.post("/question")
 async def ask_question(request: QuestionRequest):
     logger.info(f"Получен уточняющий вопрос по request_id: {request.request_id}")
-    full_report = cache.cache_get(request.request_id)
-    if not full_report:
+    # Из Redis читается только нужный аспект одного SKU (HGET), а не весь отчет
+    aspect_data, missing = await analysis_results.get_aspect(request.request_id, request.sku, request.aspect)
+    if missing == analysis_results.NOT_FOUND_REQUEST:
         raise HTTPException(status_code=404, detail="Анализ с таким ID не найден.")
-    
-    sku_data = full_report.get(request.sku)
-    if not sku_data:
+    if missing == analysis_results.NOT_FOUND_SKU:
         raise HTTPException(status_code=404, detail=f"Товар с SKU {request.sku} не найден.")
-        
-    aspect_data = sku_data.get(request.aspect)
     if not aspect_data:
         raise HTTPException(status_code=404, detail=f"Аспект '{request.aspect}' не найден.")
         
-    llm_answer = answer_question(
+    llm_answer = await answer_question_async(
         raw_data_for_aspect=aspect_data,
         aspect_name=request.aspect,
         sku=request.sku
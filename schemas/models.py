@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from typing import List, Union, Literal, Dict, Optional
 from enum import Enum
 from datetime import date, timedelta
@@ -14,15 +14,31 @@ class Period(BaseModel):
 
 class AnalysisRequest(BaseModel):
     marketplace: Marketplace
-    # Заменяем старые поля на два новых объекта Period
-    period_1: Period
-    period_2: Period # Период, с которым будем сравнивать
+    # Произвольное число периодов (например, 12 недель для тренда).
+    # periods[0] — основной период, остальные — для сравнения.
+    periods: Optional[List[Period]] = None
+    # Старый формат: два периода, period_2 — тот, с которым сравниваем
+    period_1: Optional[Period] = None
+    period_2: Optional[Period] = None
     sku_list: Union[List[str], Literal["all"]]
     cost_prices: Optional[Dict[str, float]] = None
 
     class Config:
         arbitrary_types_allowed = True
 
+    @model_validator(mode="after")
+    def _fill_periods(self) -> "AnalysisRequest":
+        if not self.periods:
+            self.periods = [p for p in (self.period_1, self.period_2) if p is not None]
+        if not self.periods:
+            raise ValueError("Укажите periods или period_1/period_2.")
+        for period in self.periods:
+            if period.date_from > period.date_to:
+                raise ValueError(f"Начало периода позже конца: {period.date_from} > {period.date_to}")
+        self.period_1 = self.periods[0]
+        self.period_2 = self.periods[1] if len(self.periods) > 1 else None
+        return self
+
 class QuestionRequest(BaseModel):
     request_id: str
     sku: str
@@ -0,0 +1,59 @@
+# Файл: utils/ads_index.py
+import time
+from typing import Dict, Any, List, Optional
+
+from config import ADS_TTL_SECONDS
+from utils import metrics
+from utils.marketplace_api import get_wb_ads_list_async
+
+
+def build_ads_index(campaigns: List[Dict[str, Any]]) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Инвертированный индекс {nmId -> кампании, в которых он рекламируется}.
+    Строится за один проход по всем кампаниям и их params[*].nms.
+    """
+    index: Dict[int, List[Dict[str, Any]]] = {}
+    for campaign in campaigns:
+        if not isinstance(campaign, dict) or not isinstance(campaign.get("params"), list):
+            continue
+        seen = set()
+        for param_set in campaign["params"]:
+            for nm_id in param_set.get("nms") or []:
+                # Кампания попадает в индекс nmId один раз, даже если он есть в нескольких params
+                if nm_id not in seen:
+                    seen.add(nm_id)
+                    index.setdefault(nm_id, []).append(campaign)
+    return index
+
+
+class AdsIndexCache:
+    """
+    Индекс рекламных кампаний по nmId, построенный по одному снимку списка кампаний и живущий TTL.
+    Кэшируются только успешные ответы: при ошибке API остается предыдущий индекс.
+    """
+
+    def __init__(self, api_key: str, ttl: float = ADS_TTL_SECONDS):
+        self.api_key = api_key
+        self.ttl = ttl
+        self._index: Optional[Dict[int, List[Dict[str, Any]]]] = None
+        self._campaigns_count = 0
+        self._updated_at = 0.0
+
+    @property
+    def is_fresh(self) -> bool:
+        return self._index is not None and time.monotonic() - self._updated_at < self.ttl
+
+    async def get_index(self) -> Optional[Dict[int, List[Dict[str, Any]]]]:
+        """Индекс {nmId -> кампании} или None, если список кампаний ни разу не загрузился."""
+        metrics.cache_result("ads_index", self.is_fresh)
+        if not self.is_fresh:
+            campaigns = await get_wb_ads_list_async(self.api_key)
+            if campaigns is None:
+                if self._index is not None:
+                    print("   [WARN] Реклама: список кампаний не получен, используется предыдущий индекс.")
+                return self._index
+            self._index = build_ads_index(campaigns)
+            self._campaigns_count = len(campaigns)
+            self._updated_at = time.monotonic()
+            print(f"-> Реклама: индекс построен по {self._campaigns_count} кампаниям, nmId в рекламе: {len(self._index)}.")
+        return self._index
@@ -0,0 +1,96 @@
+# Файл: utils/analysis_results.py
+from typing import Dict, Any, Optional, Tuple
+
+from redis.exceptions import RedisError
+
+from utils import cache, metrics
+
+# Результаты анализа: один Redis-хэш на request_id, поле — пара (SKU, аспект).
+# Значение поля — orjson (большие сжаты, см. cache.encode), поэтому /question
+# читает и разбирает только нужный аспект одного SKU, а не весь отчет. Процесс, выполнивший анализ,
+# дополнительно держит его в локальном LRU (utils/cache.py) — это же и
+# запасной вариант, когда Redis недоступен.
+KEY_PREFIX = "analysis:"
+RESULTS_TTL_SECONDS = 3600
+
+# Разделитель SKU и аспекта в имени поля; поле "<SKU><SEP>" без аспекта
+# отмечает, что SKU есть в анализе (нужно, чтобы отличить неизвестный SKU от неизвестного аспекта)
+FIELD_SEPARATOR = "\t"
+
+# Значения get_aspect, когда данных нет
+NOT_FOUND_REQUEST = "request"
+NOT_FOUND_SKU = "sku"
+NOT_FOUND_ASPECT = "aspect"
+
+
+def _key(request_id: str) -> str:
+    return KEY_PREFIX + request_id
+
+
+def _field(sku: str, aspect: str = "") -> str:
+    return f"{sku}{FIELD_SEPARATOR}{aspect}"
+
+
+async def save_results(request_id: str, raw_results: Dict[str, Dict[str, Any]], ex: int = RESULTS_TTL_SECONDS) -> None:
+    """
+    Сохраняет результаты анализа: целиком в память процесса и одним pipeline
+    в Redis — поля по (SKU, аспект) и TTL на весь хэш.
+    """
+    key = _key(request_id)
+    cache.local.set(key, raw_results, ex)
+    client = cache.get_redis()
+    if client is None:
+        return
+
+    mapping = {}
+    for sku, sku_report in raw_results.items():
+        mapping[_field(sku)] = b""
+        for aspect, data in sku_report.items():
+            mapping[_field(sku, aspect)] = cache.encode(data)
+
+    try:
+        pipe = client.pipeline(transaction=True)
+        pipe.delete(key)
+        if mapping:
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, ex)
+        await pipe.execute()
+    except (RedisError, OSError) as e:
+        cache.redis_failed(e)
+
+
+async def get_aspect(request_id: str, sku: str, aspect: str) -> Tuple[Optional[Any], Optional[str]]:
+    """
+    Данные одного аспекта одного SKU: (данные, None) или (None, что не найдено:
+    NOT_FOUND_REQUEST / NOT_FOUND_SKU / NOT_FOUND_ASPECT).
+    """
+    key = _key(request_id)
+    # Анализ, выполненный этим процессом, еще лежит в памяти целиком
+    raw_results = cache.local.get(key, None)
+    metrics.cache_result("lru", raw_results is not None)
+    if raw_results is not None:
+        if sku not in raw_results:
+            return None, NOT_FOUND_SKU
+        if aspect not in raw_results[sku]:
+            return None, NOT_FOUND_ASPECT
+        return raw_results[sku][aspect], None
+
+    client = cache.get_redis()
+    if client is None:
+        return None, NOT_FOUND_REQUEST
+    try:
+        data = await client.hget(key, _field(sku, aspect))
+        if data is not None:
+            return cache.decode(data), None
+
+        # Промах: выясняем, чего именно нет — анализа целиком или SKU в нем
+        pipe = client.pipeline(transaction=False)
+        pipe.exists(key)
+        pipe.hexists(key, _field(sku))
+        request_exists, sku_exists = await pipe.execute()
+    except (RedisError, OSError) as e:
+        cache.redis_failed(e)
+        return None, NOT_FOUND_REQUEST
+    if not request_exists:
+        return None, NOT_FOUND_REQUEST
+    return None, NOT_FOUND_ASPECT if sku_exists else NOT_FOUND_SKU
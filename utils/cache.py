@@ -1,26 +1,296 @@
 # Файл: utils/cache.py
-import os
-import redis
-import json
-
-# --- ИЗМЕНЕНИЕ: Мы больше не создаем клиент здесь! ---
-# Мы просто объявляем переменную, которую main.py заполнит позже.
-redis_client: redis.Redis = None
-
-# Функции остаются прежними, они будут использовать клиент,
-# когда он будет создан.
-def cache_set(key, value, ex=None):
-    if not redis_client:
-        print("[WARN] Redis client не инициализирован. Кэширование пропускается.")
-        return
-    redis_client.set(key, json.dumps(value), ex=ex)
+"""
+Двухуровневый кэш: LRU в памяти процесса (ограничен по числу записей и TTL)
+перед общим Redis с асинхронным пулом соединений.
 
-def cache_get(key):
-    if not redis_client:
-        print("[WARN] Redis client не инициализирован. Кэширование пропускается.")
-        return None
-    val = redis_client.get(key)
-    if val is None:
+Значения — любые объекты, которые сериализует orjson; в Redis они хранятся
+в orjson, большие — дополнительно сжатые zlib. Объекты из LRU общие для всех
+вызывающих — изменять их нельзя, только копировать.
+
+Если Redis недоступен, кэш работает только в памяти процесса: после ошибки
+Redis не опрашивается REDIS_RETRY_SECONDS, предупреждение пишется один раз.
+"""
+import asyncio
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+import orjson
+import redis.asyncio as aioredis
+
+from config import (
+    REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_MAX_CONNECTIONS, REDIS_RETRY_SECONDS,
+    CACHE_LOCAL_MAX_ENTRIES, CACHE_LOCAL_TTL_SECONDS,
+)
+from utils import metrics
+
+# Значения длиннее порога сжимаются; zlib-поток начинается с 0x78 ('x'),
+# с которого не может начинаться JSON, — по нему сжатые значения и отличаются
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 6
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Потокобезопасный LRU с TTL на каждую запись."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = _MISSING) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+local = LRUCache(CACHE_LOCAL_MAX_ENTRIES, CACHE_LOCAL_TTL_SECONDS)
+
+# Клиенты redis.asyncio привязаны к event loop, как и пулы httpx: {loop -> Redis}
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aioredis.Redis]" = weakref.WeakKeyDictionary()
+_down_until = 0.0
+# Отложенные записи set_nowait: {ключ -> (значение, ex)}; ключи, которые сейчас пишутся,
+# и ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+_pending_writes: Dict[str, Tuple[Any, Optional[int]]] = {}
+_writing: set = set()
+_tasks: set = set()
+
+
+def encode(value: Any) -> bytes:
+    data = orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    if len(data) >= COMPRESS_MIN_BYTES:
+        return zlib.compress(data, COMPRESS_LEVEL)
+    return data
+
+
+def decode(data: bytes) -> Any:
+    if data[:1] == b"x":
+        data = zlib.decompress(data)
+    return orjson.loads(data)
+
+
+def _decode_or_missing(data: Optional[bytes]) -> Any:
+    """Значение из Redis или _MISSING, если ключа нет или он записан в другом формате."""
+    if data is None:
+        return _MISSING
+    try:
+        return decode(data)
+    except (orjson.JSONDecodeError, zlib.error):
+        return _MISSING
+
+
+def get_redis() -> Optional[aioredis.Redis]:
+    """Пул соединений Redis для текущего event loop или None, если Redis сейчас недоступен."""
+    if time.monotonic() < _down_until:
         return None
-    # decode_responses=True в клиенте уже делает .decode('utf-8')
-    return json.loads(val)
\ No newline at end of file
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = aioredis.Redis(
+            host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            socket_connect_timeout=2, socket_timeout=5,
+        )
+    return client
+
+
+def redis_failed(error: Exception) -> None:
+    """Переводит кэш в режим «только память» на REDIS_RETRY_SECONDS."""
+    global _down_until
+    if time.monotonic() >= _down_until:
+        print(f"[WARN] Redis недоступен ({error}); кэш работает только в памяти {REDIS_RETRY_SECONDS:.0f} с.")
+    _down_until = time.monotonic() + REDIS_RETRY_SECONDS
+
+
+def disable_redis() -> None:
+    """Отключает уровень Redis до конца процесса (например, для бенчмарка)."""
+    global _down_until
+    _down_until = float("inf")
+
+
+async def connect() -> bool:
+    """Проверяет соединение с Redis (вызывается при старте сервера)."""
+    client = get_redis()
+    if client is None:
+        return False
+    try:
+        await client.ping()
+        return True
+    except (aioredis.RedisError, OSError) as e:
+        redis_failed(e)
+        return False
+
+
+async def close() -> None:
+    """Закрывает пул соединений текущего event loop."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def peek(key: str, default: Any = None) -> Any:
+    """Только локальный уровень, без обращения к Redis (для синхронного кода)."""
+    value = local.get(key)
+    metrics.cache_result("lru", value is not _MISSING)
+    return default if value is _MISSING else value
+
+
+async def get(key: str, default: Any = None, use_local: bool = True) -> Any:
+    if use_local:
+        value = local.get(key)
+        metrics.cache_result("lru", value is not _MISSING)
+        if value is not _MISSING:
+            return value
+
+    client = get_redis()
+    if client is None:
+        return default
+    try:
+        # Значение и TTL за один round-trip: локальная копия не должна жить дольше, чем запись в Redis
+        pipe = client.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.ttl(key)
+        data, ttl = await pipe.execute()
+    except (aioredis.RedisError, OSError) as e:
+        redis_failed(e)
+        return default
+    value = _decode_or_missing(data)
+    metrics.cache_result("redis", value is not _MISSING)
+    if value is _MISSING:
+        return default
+
+    if use_local:
+        local.set(key, value, ttl if ttl > 0 else None)
+    return value
+
+
+async def get_many(keys: Iterable[str]) -> Dict[str, Any]:
+    """Найденные значения {ключ -> значение}; промахи LRU дочитываются из Redis одним MGET."""
+    found: Dict[str, Any] = {}
+    missing: List[str] = []
+    for key in dict.fromkeys(keys):
+        value = local.get(key)
+        if value is _MISSING:
+            missing.append(key)
+        else:
+            found[key] = value
+    metrics.CACHE_REQUESTS.labels("lru", "hit").inc(len(found))
+    metrics.CACHE_REQUESTS.labels("lru", "miss").inc(len(missing))
+
+    client = get_redis()
+    if not missing or client is None:
+        return found
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.mget(missing)
+        for key in missing:
+            pipe.ttl(key)
+        values, *ttls = await pipe.execute()
+    except (aioredis.RedisError, OSError) as e:
+        redis_failed(e)
+        return found
+
+    for key, data, ttl in zip(missing, values, ttls):
+        value = _decode_or_missing(data)
+        metrics.cache_result("redis", value is not _MISSING)
+        if value is not _MISSING:
+            found[key] = value
+            local.set(key, value, ttl if ttl > 0 else None)
+    return found
+
+
+async def set(key: str, value: Any, ex: Optional[int] = None, use_local: bool = True) -> None:
+    if use_local:
+        local.set(key, value, ex)
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        await client.set(key, encode(value), ex=ex)
+    except (aioredis.RedisError, OSError) as e:
+        redis_failed(e)
+
+
+async def set_many(mapping: Dict[str, Any], ex: Optional[int] = None) -> None:
+    """Записывает несколько значений одним pipeline."""
+    for key, value in mapping.items():
+        local.set(key, value, ex)
+    client = get_redis()
+    if not mapping or client is None:
+        return
+    try:
+        pipe = client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.set(key, encode(value), ex=ex)
+        await pipe.execute()
+    except (aioredis.RedisError, OSError) as e:
+        redis_failed(e)
+
+
+def set_nowait(key: str, value: Any, ex: Optional[int] = None, use_local: bool = True) -> None:
+    """
+    Синхронная запись: в LRU сразу, в Redis — фоновой задачей текущего event loop.
+    Частые записи одного ключа схлопываются: в Redis уходит последнее значение.
+    """
+    if use_local:
+        local.set(key, value, ex)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    _pending_writes[key] = (value, ex)
+    if key in _writing:
+        return
+    _writing.add(key)
+    task = loop.create_task(_write_pending(key))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _write_pending(key: str) -> None:
+    try:
+        while (entry := _pending_writes.pop(key, None)) is not None:
+            value, ex = entry
+            await set(key, value, ex=ex, use_local=False)
+    finally:
+        _writing.discard(key)
+
+
+async def delete(*keys: str) -> None:
+    for key in keys:
+        local.delete(key)
+    client = get_redis()
+    if not keys or client is None:
+        return
+    try:
+        await client.delete(*keys)
+    except (aioredis.RedisError, OSError) as e:
+        redis_failed(e)
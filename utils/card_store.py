@@ -0,0 +1,94 @@
+# Файл: utils/card_store.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+from config import DATA_DIR
+from utils import metrics
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cards (
+    nm_id INTEGER PRIMARY KEY,
+    updated_at TEXT,
+    payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cards_sync (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    updated_at TEXT NOT NULL,
+    nm_id INTEGER NOT NULL
+);
+"""
+
+
+class CardStore:
+    """
+    Локальное хранилище карточек Content API (SQLite), одно на продавца.
+    Карточка хранится по nmID вместе с updatedAt. Курсор синхронизации
+    (updatedAt, nmID) — позиция в списке карточек продавца, отсортированном
+    по updatedAt: все изменения до нее уже сохранены, поэтому при следующем
+    анализе из API запрашиваются только карточки, измененные после курсора.
+    """
+
+    def __init__(self, api_key: str, root: str = None):
+        seller = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+        root = root or os.path.join(DATA_DIR, "cards")
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.join(root, f"{seller}.sqlite")
+        # Хранилище используют и event loop сервера, и поток синхронных оберток
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def cursor(self) -> Optional[Tuple[str, int]]:
+        """(updatedAt, nmID), с которых продолжать синхронизацию, или None до первой."""
+        with self._lock:
+            row = self._conn.execute("SELECT updated_at, nm_id FROM cards_sync WHERE id = 1").fetchone()
+        return tuple(row) if row else None
+
+    def set_cursor(self, updated_at: str, nm_id: int) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO cards_sync (id, updated_at, nm_id) VALUES (1, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET updated_at = excluded.updated_at, nm_id = excluded.nm_id",
+                (updated_at, nm_id),
+            )
+
+    def get_many(self, nm_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        nm_ids = list(nm_ids)
+        cards = {}
+        with self._lock:
+            # Не больше 500 параметров в запросе: лимит SQLite на число переменных
+            for i in range(0, len(nm_ids), 500):
+                chunk = nm_ids[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT nm_id, payload FROM cards WHERE nm_id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                cards.update((nm_id, json.loads(payload)) for nm_id, payload in rows)
+        return cards
+
+    def put_many(self, cards: Iterable[Dict[str, Any]]) -> int:
+        """Сохраняет карточки (новые или более свежие по updatedAt) одной транзакцией."""
+        saved = 0
+        with self._lock, self._conn:
+            for card in cards:
+                if card.get("nmID") is None:
+                    continue
+                cursor = self._conn.execute(
+                    """
+                    INSERT INTO cards (nm_id, updated_at, payload) VALUES (?, ?, ?)
+                    ON CONFLICT(nm_id) DO UPDATE SET updated_at = excluded.updated_at, payload = excluded.payload
+                    WHERE COALESCE(excluded.updated_at, '') >= COALESCE(updated_at, '')
+                    """,
+                    (card["nmID"], card.get("updatedAt"), json.dumps(card, ensure_ascii=False)),
+                )
+                saved += cursor.rowcount
+        metrics.ROWS_INGESTED.labels("cards").inc(saved)
+        return saved
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,165 @@
+# Файл: utils/catalog_cache.py
+import asyncio
+import hashlib
+import time
+import weakref
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+from config import CATALOG_TTL_SECONDS
+from utils import cache, metrics
+from utils.marketplace_api import get_all_wb_products_async
+
+
+# Снимок строк каталога в Redis: новый процесс начинает с инкрементального обновления, а не с полной загрузки
+SNAPSHOT_KEY_PREFIX = "catalog:"
+SNAPSHOT_TTL_SECONDS = 24 * 3600
+
+# Пауза перед повтором после неудачного обновления: отчет об остатках — 1 запрос в минуту
+REFRESH_RETRY_SECONDS = 60.0
+
+
+def _row_key(item: Dict[str, Any]) -> Tuple[Any, Any, Any]:
+    """Строка отчета об остатках уникальна по артикулу, баркоду и складу."""
+    return item.get("supplierArticle"), item.get("barcode"), item.get("warehouseName")
+
+
+def aggregate_stocks(rows: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """ПРАВИЛЬНАЯ АГРЕГАЦИЯ данных со всех складов: {SKU -> карточка с суммарными остатками}."""
+    product_map = {}
+    # Проходим по каждой записи из API
+    for item in rows:
+        sku = item.get("supplierArticle")
+        if not sku: continue
+
+        # Если SKU встречается впервые, создаем для него запись
+        if sku not in product_map:
+            product_map[sku] = item.copy()  # Копируем всю базовую информацию
+            # Обнуляем остатки, чтобы начать суммировать с чистого листа
+            product_map[sku]["quantity"] = 0
+            product_map[sku]["quantityFull"] = 0
+
+        # Суммируем остатки с каждого склада к уже существующим
+        product_map[sku]["quantity"] += item.get("quantity", 0)
+        product_map[sku]["quantityFull"] += item.get("quantityFull", 0)
+    return product_map
+
+
+class CatalogCache:
+    """
+    Кэш каталога продавца: уже агрегированная карта SKU -> остатки/nmId.
+    Обновляется в фоне раз в TTL; после первой полной загрузки из API
+    запрашиваются только строки с lastChangeDate не раньше последнего изменения.
+    Возвращаемая карта общая для всех запросов — изменять ее нельзя, только копировать.
+    """
+
+    def __init__(self, api_key: str, ttl: float = CATALOG_TTL_SECONDS):
+        self.api_key = api_key
+        self.ttl = ttl
+        self._rows: Dict[Tuple[Any, Any, Any], Dict[str, Any]] = {}
+        self._products: Dict[str, Dict[str, Any]] = {}
+        self._watermark: Optional[str] = None  # максимальный lastChangeDate среди загруженных строк
+        self._updated_at = 0.0
+        # После ошибки обновления до этого момента отдаем то, что есть, не дергая API
+        self._retry_at = 0.0
+        self._last_error: Optional[str] = None
+        self._locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = weakref.WeakKeyDictionary()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._snapshot_key = SNAPSHOT_KEY_PREFIX + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+        self._snapshot_checked = False
+
+    def _lock(self) -> asyncio.Lock:
+        # asyncio.Lock привязан к циклу, а кэш используют и сервер, и синхронные обертки
+        return self._locks.setdefault(asyncio.get_running_loop(), asyncio.Lock())
+
+    @property
+    def is_fresh(self) -> bool:
+        return bool(self._updated_at) and time.monotonic() - self._updated_at < self.ttl
+
+    async def get_products(self) -> Dict[str, Any]:
+        """
+        {"products": {SKU -> карточка}} или {"error": ...}, если каталог ни разу не загрузился.
+        Если обновление не удалось, до _retry_at отдается устаревшая карта (или та же ошибка).
+        """
+        metrics.cache_result("catalog", self.is_fresh)
+        if not self.is_fresh and time.monotonic() >= self._retry_at:
+            async with self._lock():
+                if not self.is_fresh and time.monotonic() >= self._retry_at:
+                    await self.refresh()
+        if not self._updated_at:
+            return {"error": self._last_error or "Каталог еще не загружен."}
+        return {"products": self._products}
+
+    async def _restore_snapshot(self) -> None:
+        """Поднимает строки каталога, сохраненные другим процессом (один раз за жизнь кэша)."""
+        self._snapshot_checked = True
+        snapshot = await cache.get(self._snapshot_key, use_local=False)
+        if not snapshot:
+            return
+        self._rows = {_row_key(row): row for row in snapshot["rows"]}
+        self._watermark = snapshot["watermark"]
+        self._products = aggregate_stocks(self._rows.values())
+        print(f"-> Каталог: восстановлен снимок из кэша, SKU {len(self._products)}.")
+
+    async def refresh(self) -> Optional[str]:
+        """Докачивает изменения каталога. Возвращает текст ошибки или None."""
+        if not self._snapshot_checked and self._watermark is None:
+            await self._restore_snapshot()
+        incremental = self._watermark is not None
+        date_from = self._watermark if incremental else None
+        print(f"-> Каталог: {'инкрементальное' if incremental else 'полное'} обновление остатков...")
+
+        data = await get_all_wb_products_async(self.api_key, date_from=date_from)
+        if "error" in data:
+            self._last_error = data["error"]
+            self._retry_at = time.monotonic() + min(REFRESH_RETRY_SECONDS, self.ttl)
+            print(f"   [WARN] Каталог не обновлен: {data['error']}; повтор не раньше чем через {min(REFRESH_RETRY_SECONDS, self.ttl):.0f} с.")
+            return data["error"]
+
+        metrics.ROWS_INGESTED.labels("stocks").inc(len(data.get("products", [])))
+        changed_skus = set()
+        for item in data.get("products", []):
+            self._rows[_row_key(item)] = item
+            changed_skus.add(item.get("supplierArticle"))
+            last_change = item.get("lastChangeDate")
+            if last_change and (self._watermark is None or last_change > self._watermark):
+                self._watermark = last_change
+
+        if incremental:
+            # Переагрегируем только затронутые SKU; карту подменяем целиком,
+            # чтобы уже выданные запросам версии не менялись у них на глазах
+            products = dict(self._products)
+            affected = aggregate_stocks(row for row in self._rows.values() if row.get("supplierArticle") in changed_skus)
+            products.update(affected)
+        else:
+            products = aggregate_stocks(self._rows.values())
+
+        self._products = products
+        self._updated_at = time.monotonic()
+        if data.get("products") or not incremental:
+            await cache.set(
+                self._snapshot_key,
+                {"rows": list(self._rows.values()), "watermark": self._watermark},
+                ex=SNAPSHOT_TTL_SECONDS, use_local=False,
+            )
+        print(f"-> Каталог: изменено строк {len(data.get('products', []))}, всего SKU {len(products)}.")
+        return None
+
+    def start_background_refresh(self) -> asyncio.Task:
+        """Запускает фоновое обновление каталога чуть раньше истечения TTL."""
+        async def loop() -> None:
+            while True:
+                try:
+                    async with self._lock():
+                        await self.refresh()
+                except Exception as e:
+                    print(f"   [ERROR] Фоновое обновление каталога: {e}")
+                await asyncio.sleep(self.ttl * 0.8)
+
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(loop())
+        return self._refresh_task
+
+    def stop_background_refresh(self) -> None:
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
@@ -0,0 +1,212 @@
+# Файл: utils/funnel_store.py
+import datetime
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, Any, Iterable, List, Set, Tuple
+
+from config import DATA_DIR
+from utils import metrics
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS funnel_days (
+    nm_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    open_card INTEGER NOT NULL,
+    add_to_cart INTEGER NOT NULL,
+    orders INTEGER NOT NULL,
+    orders_sum REAL NOT NULL,
+    buyouts INTEGER NOT NULL,
+    buyouts_sum REAL NOT NULL,
+    fetched_at TEXT NOT NULL,
+    PRIMARY KEY (nm_id, day)
+);
+CREATE TABLE IF NOT EXISTS funnel_periods (
+    nm_id INTEGER NOT NULL,
+    date_from TEXT NOT NULL,
+    date_to TEXT NOT NULL,
+    open_card INTEGER NOT NULL,
+    add_to_cart INTEGER NOT NULL,
+    orders INTEGER NOT NULL,
+    orders_sum REAL NOT NULL,
+    buyouts INTEGER NOT NULL,
+    buyouts_sum REAL NOT NULL,
+    fetched_at TEXT NOT NULL,
+    PRIMARY KEY (date_from, date_to, nm_id)
+);
+"""
+
+# Поля дня из истории воронки WB (nm-report/detail/history) и итогов периода
+# (nm-report/detail, statistics.selectedPeriod) -> колонки таблиц
+HISTORY_FIELDS = (
+    ("openCardCount", "open_card"),
+    ("addToCartCount", "add_to_cart"),
+    ("ordersCount", "orders"),
+    ("ordersSumRub", "orders_sum"),
+    ("buyoutsCount", "buyouts"),
+    ("buyoutsSumRub", "buyouts_sum"),
+)
+
+# Выкупы и отмены за день WB досчитывает еще пару дней; до этого день перезапрашивается
+MUTABLE_DAYS = 2
+
+# Не больше 500 параметров в запросе: лимит SQLite на число переменных
+_SQL_CHUNK = 500
+
+
+class FunnelStore:
+    """
+    Локальное хранилище дневной статистики воронки (SQLite), одно на продавца:
+    строка на пару (nmID, день). Итоги за любой период считаются из дней,
+    поэтому пересекающиеся периоды не запрашивают одни и те же дни повторно.
+    Для больших каталогов хранятся и готовые итоги периодов из постраничного
+    отчета (funnel_periods): строка на (период, nmID).
+    """
+
+    def __init__(self, api_key: str, root: str = None):
+        seller = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+        root = root or os.path.join(DATA_DIR, "funnel")
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.join(root, f"{seller}.sqlite")
+        # Хранилище используют и event loop сервера, и поток синхронных оберток
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def missing_days(self, nm_ids: List[int], days: Iterable[datetime.date]) -> Dict[datetime.date, Set[int]]:
+        """{день -> nmID}, для которых дня нет в хранилище или он еще может измениться."""
+        days = sorted(set(days))
+        if not days or not nm_ids:
+            return {}
+        fresh: Set[Tuple[int, str]] = set()
+        with self._lock:
+            for i in range(0, len(nm_ids), _SQL_CHUNK):
+                chunk = nm_ids[i:i + _SQL_CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT nm_id, day, fetched_at FROM funnel_days WHERE day BETWEEN ? AND ? AND nm_id IN ({','.join('?' * len(chunk))})",
+                    (days[0].isoformat(), days[-1].isoformat(), *chunk),
+                ).fetchall()
+                fresh.update(
+                    (nm_id, day) for nm_id, day, fetched_at in rows
+                    if datetime.date.fromisoformat(fetched_at) >= datetime.date.fromisoformat(day) + datetime.timedelta(days=MUTABLE_DAYS)
+                )
+
+        missing = {}
+        for day in days:
+            nm_missing = {nm_id for nm_id in nm_ids if (nm_id, day.isoformat()) not in fresh}
+            if nm_missing:
+                missing[day] = nm_missing
+        return missing
+
+    def add_history(self, nm_ids: Iterable[int], date_from: datetime.date, date_to: datetime.date, cards: Iterable[Dict[str, Any]]) -> int:
+        """
+        Сохраняет историю по дням для запрошенных nmID за период одной транзакцией.
+        Дни, которых нет в ответе (не было просмотров), сохраняются нулями.
+        """
+        days = {}
+        for card in cards:
+            for entry in card.get("history") or []:
+                if entry.get("dt"):
+                    days[(card.get("nmID"), entry["dt"][:10])] = tuple(entry.get(field) or 0 for field, _ in HISTORY_FIELDS)
+
+        today = datetime.date.today().isoformat()
+        rows = []
+        for nm_id in nm_ids:
+            day = date_from
+            while day <= date_to:
+                values = days.get((nm_id, day.isoformat()), (0,) * len(HISTORY_FIELDS))
+                rows.append((nm_id, day.isoformat(), *values, today))
+                day += datetime.timedelta(days=1)
+
+        columns = ", ".join(column for _, column in HISTORY_FIELDS)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO funnel_days (nm_id, day, {columns}, fetched_at) VALUES (?, ?, {', '.join('?' * len(HISTORY_FIELDS))}, ?)",
+                rows,
+            )
+        metrics.ROWS_INGESTED.labels("funnel").inc(len(rows))
+        return len(rows)
+
+    def totals(self, nm_ids: List[int], date_from: datetime.date, date_to: datetime.date) -> List[Dict[str, Any]]:
+        """
+        Итоги воронки за период по nmID в формате карточек API (поля utils/funnel_table.FUNNEL_DTYPE).
+        nmID, у которых в хранилище есть не все дни периода (загрузка не удалась), не
+        возвращаются: частичная сумма выглядела бы как полные итоги.
+        """
+        columns = ", ".join(f"SUM({column})" for _, column in HISTORY_FIELDS)
+        period_days = (date_to - date_from).days + 1
+        cards = []
+        with self._lock:
+            for i in range(0, len(nm_ids), _SQL_CHUNK):
+                chunk = nm_ids[i:i + _SQL_CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT nm_id, {columns} FROM funnel_days WHERE day BETWEEN ? AND ? "
+                    f"AND nm_id IN ({','.join('?' * len(chunk))}) GROUP BY nm_id HAVING COUNT(*) = ?",
+                    (date_from.isoformat(), date_to.isoformat(), *chunk, period_days),
+                ).fetchall()
+                cards.extend(_card(nm_id, values) for nm_id, *values in rows)
+        return cards
+
+    def period_fresh(self, nm_ids: List[int], date_from: datetime.date, date_to: datetime.date) -> bool:
+        """Есть ли итоги периода по всем nm_ids, которые уже не изменятся."""
+        final_since = (date_to + datetime.timedelta(days=MUTABLE_DAYS)).isoformat()
+        found = 0
+        with self._lock:
+            for i in range(0, len(nm_ids), _SQL_CHUNK):
+                chunk = nm_ids[i:i + _SQL_CHUNK]
+                found += self._conn.execute(
+                    f"SELECT COUNT(*) FROM funnel_periods WHERE date_from = ? AND date_to = ? AND fetched_at >= ? "
+                    f"AND nm_id IN ({','.join('?' * len(chunk))})",
+                    (date_from.isoformat(), date_to.isoformat(), final_since, *chunk),
+                ).fetchone()[0]
+        return found == len(nm_ids)
+
+    def add_period(self, nm_ids: Iterable[int], date_from: datetime.date, date_to: datetime.date, cards: Iterable[Dict[str, Any]]) -> int:
+        """
+        Сохраняет итоги периода ({"nmID", поля HISTORY_FIELDS}) одной транзакцией.
+        Запрошенные nmID, которых нет в ответе (не было просмотров), сохраняются нулями.
+        """
+        totals = {nm_id: (0,) * len(HISTORY_FIELDS) for nm_id in nm_ids}
+        for card in cards:
+            if card.get("nmID") is not None:
+                totals[card["nmID"]] = tuple(card.get(field) or 0 for field, _ in HISTORY_FIELDS)
+
+        today = datetime.date.today().isoformat()
+        columns = ", ".join(column for _, column in HISTORY_FIELDS)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO funnel_periods (nm_id, date_from, date_to, {columns}, fetched_at) "
+                f"VALUES (?, ?, ?, {', '.join('?' * len(HISTORY_FIELDS))}, ?)",
+                [(nm_id, date_from.isoformat(), date_to.isoformat(), *values, today) for nm_id, values in totals.items()],
+            )
+        metrics.ROWS_INGESTED.labels("funnel").inc(len(totals))
+        return len(totals)
+
+    def period_totals(self, nm_ids: List[int], date_from: datetime.date, date_to: datetime.date) -> List[Dict[str, Any]]:
+        """Сохраненные итоги периода по nmID в том же формате, что totals()."""
+        columns = ", ".join(column for _, column in HISTORY_FIELDS)
+        cards = []
+        with self._lock:
+            for i in range(0, len(nm_ids), _SQL_CHUNK):
+                chunk = nm_ids[i:i + _SQL_CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT nm_id, {columns} FROM funnel_periods WHERE date_from = ? AND date_to = ? "
+                    f"AND nm_id IN ({','.join('?' * len(chunk))})",
+                    (date_from.isoformat(), date_to.isoformat(), *chunk),
+                ).fetchall()
+                cards.extend(_card(nm_id, values) for nm_id, *values in rows)
+        return cards
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _card(nm_id: int, values: Iterable[Any]) -> Dict[str, Any]:
+    """Итоги nmID в формате карточки API; конверсии считаются из сумм, а не усредняются."""
+    card = {"nmID": nm_id, **{field: value for (field, _), value in zip(HISTORY_FIELDS, values)}}
+    card["conversionToCart"] = round(card["addToCartCount"] / card["openCardCount"] * 100, 2) if card["openCardCount"] else 0
+    card["buyoutPercent"] = round(card["buyoutsCount"] / card["ordersCount"] * 100, 2) if card["ordersCount"] else 0
+    return card
@@ -0,0 +1,52 @@
+# Файл: utils/funnel_table.py
+from typing import Dict, Any, Iterable, Optional
+
+import numpy as np
+
+# Поля воронки из аналитики WB, которые использует AudienceAgent
+FUNNEL_DTYPE = np.dtype([
+    ("nmID", "<i8"),
+    ("openCardCount", "<i8"),
+    ("addToCartCount", "<i8"),
+    ("ordersCount", "<i8"),
+    ("ordersSumRub", "<f8"),
+    ("buyoutsCount", "<i8"),
+    ("buyoutsSumRub", "<f8"),
+    ("conversionToCart", "<f8"),
+    ("buyoutPercent", "<f8"),
+])
+
+
+class FunnelTable:
+    """
+    Аналитика воронки за период в колоночном виде: одна строка на nmID,
+    отсортировано по nmID. Поиск строки — бинарный, словарь создается только
+    для запрошенного nmID, поэтому таблица на весь каталог занимает десятки байт на товар.
+    """
+
+    def __init__(self, rows: np.ndarray):
+        self.rows = rows
+
+    @classmethod
+    def from_cards(cls, cards: Iterable[Dict[str, Any]]) -> "FunnelTable":
+        values = [
+            tuple(card.get(name) or 0 for name in FUNNEL_DTYPE.names)
+            for card in cards if card.get("nmID") is not None
+        ]
+        rows = np.array(values, dtype=FUNNEL_DTYPE)
+        rows.sort(order="nmID")
+        return cls(rows)
+
+    @classmethod
+    def empty(cls) -> "FunnelTable":
+        return cls(np.zeros(0, dtype=FUNNEL_DTYPE))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def get(self, nm_id: int, default: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Строка nmID как словарь (как в ответе API) или default."""
+        position = np.searchsorted(self.rows["nmID"], nm_id)
+        if position == len(self.rows) or self.rows["nmID"][position] != nm_id:
+            return default
+        return dict(zip(FUNNEL_DTYPE.names, self.rows[position].tolist()))
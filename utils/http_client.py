@@ -0,0 +1,129 @@
+# Файл: utils/http_client.py
+import asyncio
+import contextlib
+import threading
+import time
+import weakref
+from typing import Dict, Any, Coroutine, AsyncIterator
+
+import httpx
+
+from config import WB_API_BASE_URL
+from utils import metrics, rate_limiter
+
+# Базовые адреса хостов WB API. Для каждого хоста держим свой пул keep-alive соединений.
+WB_HOSTS = {
+    "statistics": "https://statistics-api.wildberries.ru",
+    "content": "https://content-api.wildberries.ru",
+    "advert": "https://advert-api.wildberries.ru",
+    "feedbacks": "https://feedbacks-api.wildberries.ru",
+    "suppliers": "https://suppliers-api.wildberries.ru",
+    "analytics": "https://seller-analytics-api.wildberries.ru",
+}
+if WB_API_BASE_URL:
+    WB_HOSTS = {host_key: WB_API_BASE_URL for host_key in WB_HOSTS}
+
+_POOL_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60)
+_DEFAULT_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+# Клиенты httpx привязаны к event loop, в котором созданы, поэтому пулы храним
+# отдельно для каждого цикла: {loop -> {host_key -> AsyncClient}}.
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]]" = weakref.WeakKeyDictionary()
+
+# Фоновый event loop для синхронных оберток
+_sync_loop: asyncio.AbstractEventLoop = None
+_sync_loop_lock = threading.Lock()
+
+
+def get_client(host_key: str) -> httpx.AsyncClient:
+    """Возвращает общий AsyncClient с пулом соединений для хоста WB в текущем event loop."""
+    loop = asyncio.get_running_loop()
+    loop_clients = _clients.setdefault(loop, {})
+    client = loop_clients.get(host_key)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            base_url=WB_HOSTS[host_key],
+            limits=_POOL_LIMITS,
+            timeout=_DEFAULT_TIMEOUT,
+        )
+        loop_clients[host_key] = client
+    return client
+
+
+def _observe_response(host_key: str, family: str, response: httpx.Response, started: float) -> None:
+    metrics.WB_REQUEST_SECONDS.labels(host_key, family, str(response.status_code)).observe(time.perf_counter() - started)
+    metrics.WB_BYTES_DOWNLOADED.labels(host_key, family).inc(response.num_bytes_downloaded)
+
+
+async def wb_request(host_key: str, family: str, method: str, url: str, max_retries: int = 3, **kwargs) -> httpx.Response:
+    """
+    Запрос к WB API через общий пул с учетом лимитов (хост, семейство эндпоинтов).
+    На 429 ждет столько, сколько просит сервер, и повторяет запрос.
+    """
+    client = get_client(host_key)
+    for attempt in range(max_retries + 1):
+        await rate_limiter.acquire(host_key, family)
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        _observe_response(host_key, family, response, started)
+        retry_after = rate_limiter.observe(host_key, family, response.status_code, response.headers)
+        if response.status_code != 429 or attempt == max_retries:
+            return response
+        metrics.WB_RETRIES.labels(host_key, family).inc()
+        print(f"   [WARN] {host_key}/{family}: 429 Too Many Requests, повтор через {retry_after:.1f} с.")
+    return response
+
+
+@contextlib.asynccontextmanager
+async def wb_stream(host_key: str, family: str, method: str, url: str, max_retries: int = 3, **kwargs) -> AsyncIterator[httpx.Response]:
+    """
+    Потоковый вариант wb_request: тело ответа не загружается в память целиком,
+    его читают через response.aiter_text()/aiter_bytes().
+    """
+    client = get_client(host_key)
+    for attempt in range(max_retries + 1):
+        await rate_limiter.acquire(host_key, family)
+        started = time.perf_counter()
+        response = await client.send(client.build_request(method, url, **kwargs), stream=True)
+        retry_after = rate_limiter.observe(host_key, family, response.status_code, response.headers)
+        if response.status_code == 429 and attempt < max_retries:
+            await response.aclose()
+            _observe_response(host_key, family, response, started)
+            metrics.WB_RETRIES.labels(host_key, family).inc()
+            print(f"   [WARN] {host_key}/{family}: 429 Too Many Requests, повтор через {retry_after:.1f} с.")
+            continue
+        try:
+            yield response
+        finally:
+            await response.aclose()
+            # Для потокового ответа время включает чтение тела потребителем
+            _observe_response(host_key, family, response, started)
+        return
+
+
+async def close_clients() -> None:
+    """Закрывает все пулы соединений текущего event loop (вызывается при остановке сервера)."""
+    loop_clients = _clients.pop(asyncio.get_running_loop(), {})
+    for client in loop_clients.values():
+        await client.aclose()
+
+
+def _get_sync_loop() -> asyncio.AbstractEventLoop:
+    global _sync_loop
+    with _sync_loop_lock:
+        if _sync_loop is None:
+            _sync_loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_sync_loop.run_forever, name="wb-http-sync-loop", daemon=True)
+            thread.start()
+        return _sync_loop
+
+
+def run_sync(coro: Coroutine) -> Any:
+    """
+    Выполняет корутину из синхронного кода.
+    Используется отдельный фоновый event loop, поэтому пулы соединений
+    переиспользуются между вызовами, а обертку можно вызвать даже из потока,
+    где уже работает свой цикл.
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, _get_sync_loop())
+    return future.result()
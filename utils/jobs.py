@@ -0,0 +1,108 @@
+# Файл: utils/jobs.py
+import asyncio
+import time
+from typing import Dict, Any, Optional, Coroutine, Callable
+
+from utils import cache
+
+# Этапы анализа в порядке выполнения (для отображения прогресса)
+STAGES = ("catalog", "cards", "reports", "agents", "llm")
+
+# Сколько хранить состояние задачи после завершения
+JOB_TTL_SECONDS = 3600
+
+# Состояния задач текущего процесса; в Redis дублируются для других воркеров
+_jobs: Dict[str, Dict[str, Any]] = {}
+# Ссылки на запущенные задачи, чтобы их не собрал сборщик мусора
+_tasks: set = set()
+
+
+def _job_key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+def _prune() -> None:
+    """Забывает завершенные задачи старше JOB_TTL_SECONDS."""
+    deadline = time.time() - JOB_TTL_SECONDS
+    for job_id in [j for j, job in _jobs.items() if job["finished_at"] and job["finished_at"] < deadline]:
+        del _jobs[job_id]
+
+
+def _save(job: Dict[str, Any]) -> None:
+    _prune()
+    _jobs[job["job_id"]] = job
+    # Состояние меняется на каждом этапе; в Redis уходит последнее (см. cache.set_nowait)
+    cache.set_nowait(_job_key(job["job_id"]), job, ex=JOB_TTL_SECONDS, use_local=False)
+
+
+async def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    job = _jobs.get(job_id)
+    if job is None:
+        job = await cache.get(_job_key(job_id), use_local=False)
+    return job
+
+
+class JobProgress:
+    """Отслеживает этапы задачи; передается в DecisionManager как колбэк on_stage."""
+
+    def __init__(self, job_id: str):
+        self.job = {
+            "job_id": job_id,
+            "status": "queued",
+            "stage": None,
+            "stages": {name: {"status": "pending"} for name in STAGES},
+            "created_at": time.time(),
+            "finished_at": None,
+            "error": None,
+            "result": None,
+        }
+        _save(self.job)
+
+    def __call__(self, stage: str, done: int = None, total: int = None) -> None:
+        now = time.time()
+        current = self.job["stage"]
+        if current and current != stage:
+            self.job["stages"][current].update(status="done", finished_at=now)
+
+        info = self.job["stages"].setdefault(stage, {"status": "pending"})
+        if info["status"] != "running":
+            info.update(status="running", started_at=now)
+        if total is not None:
+            info.update(done=done or 0, total=total)
+
+        self.job.update(status="running", stage=stage)
+        _save(self.job)
+
+    def finish(self, result: Dict[str, Any]) -> None:
+        now = time.time()
+        if self.job["stage"]:
+            self.job["stages"][self.job["stage"]].update(status="done", finished_at=now)
+        self.job.update(status="done", stage=None, finished_at=now, result=result)
+        _save(self.job)
+
+    def fail(self, error: str) -> None:
+        if self.job["stage"]:
+            self.job["stages"][self.job["stage"]]["status"] = "failed"
+        self.job.update(status="failed", finished_at=time.time(), error=error)
+        _save(self.job)
+
+
+def submit_job(job_id: str, run: Callable[[JobProgress], Coroutine]) -> Dict[str, Any]:
+    """
+    Создает задачу и запускает run(progress) в фоне текущего event loop.
+    run должен вернуть итоговый результат; исключение помечает задачу как failed.
+    """
+    progress = JobProgress(job_id)
+
+    async def worker() -> None:
+        try:
+            progress.finish(await run(progress))
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e)
+            print(f"[ERROR] Задача {job_id} завершилась ошибкой: {detail}")
+            progress.fail(detail)
+
+    task = asyncio.create_task(worker())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return progress.job
@@ -1,24 +1,182 @@
-# Файл: utils/marketplace_api.py (добавляем финальный отчет)
-import requests
+# Файл: utils/marketplace_api.py (асинхронный клиент с пулами соединений)
+import asyncio
 import datetime
 import json
-import time
-from typing import Dict, Any, List
+import httpx
+from typing import Dict, Any, List, AsyncIterator, Optional, Tuple, Union
 
-# ... (URL-ы остаются без изменений) ...
-WB_CONTENT_API_URL = "https://content-api.wildberries.ru"
-WB_API_V1_URL = "https://statistics-api.wildberries.ru/api/v1"
-WB_API_V5_URL = "https://statistics-api.wildberries.ru/api/v5"
-WB_ADS_API_URL = "https://advert-api.wildberries.ru"
-WB_FEEDBACKS_API_URL = "https://feedbacks-api.wildberries.ru/api/v1"
+from utils import metrics, single_flight
+from utils.card_store import CardStore
+from utils.funnel_store import FunnelStore, HISTORY_FIELDS
+from utils.http_client import wb_request, wb_stream, run_sync
+from utils.realization_store import RealizationStore, RangeWriter, parse_day
 
+# Пути эндпоинтов относительно хостов из utils/http_client.WB_HOSTS
+WB_API_V1_PATH = "/api/v1"
+WB_API_V5_PATH = "/api/v5"
+WB_ANALYTICS_DETAIL_PATH = "/api/v2/nm-report/detail"
+WB_ANALYTICS_HISTORY_PATH = "/api/v2/nm-report/detail/history"
+WB_FEEDBACKS_API_PATH = "/api/v1"
 
-def get_wb_realization_report(api_key: str, date_from: str, date_to: str) -> List[Dict[str, Any]]:
+# Content API: не больше 100 карточек за запрос; порции по nmID запрашиваются
+# параллельно (темп ограничивает rate_limiter), неудачная порция повторяется
+WB_CARDS_CHUNK_SIZE = 100
+WB_CARDS_CONCURRENCY = 4
+WB_CARDS_ATTEMPTS = 3
+WB_CARDS_CLOCK_MARGIN_SECONDS = 3600
+
+# История воронки (seller-analytics): не больше 20 nmID и 7 дней за запрос
+WB_ANALYTICS_CHUNK_SIZE = 20
+WB_ANALYTICS_MAX_DAYS = 7
+# Постраничный отчет воронки за период: карточек на странице (для оценки числа запросов
+# и размера фильтра nmIDs; сама пагинация идет по isNextPage)
+WB_ANALYTICS_DETAIL_PAGE_SIZE = 1000
+
+# Feedbacks API: не больше 5000 отзывов за запрос и take + skip <= 199990
+WB_FEEDBACKS_PAGE_SIZE = 5000
+WB_FEEDBACKS_MAX_OFFSET = 199990
+
+
+# Хранилища карточек и воронки по API-ключу: одно соединение SQLite на продавца
+_card_stores: Dict[str, CardStore] = {}
+_funnel_stores: Dict[str, FunnelStore] = {}
+
+
+def _auth_headers(api_key: str) -> Dict[str, str]:
+    return {'Authorization': f'Bearer {api_key}'}
+
+
+# ---------------------------------------------------------------------------
+# Асинхронные функции: используются из FastAPI и DecisionManager
+# ---------------------------------------------------------------------------
+
+async def load_wb_realization_report_async(api_key: str, date_from: str, date_to: str) -> RealizationStore:
+    """
+    Докачивает в локальное хранилище по дням отсутствующие или еще изменяемые дни
+    периода и возвращает хранилище. Дни читаются через store.iter_days() как
+    memory-mapped колонки, поэтому память не зависит от размера отчета.
+    """
+    store, _ = await load_wb_realization_periods_async(api_key, [(date_from, date_to)])
+    return store
+
+
+async def load_wb_realization_periods_async(api_key: str, periods: List[Tuple[str, str]]) -> Tuple[RealizationStore, List[bool]]:
+    """
+    То же для нескольких периодов: качаются только дни самих периодов (их объединение),
+    промежуток между непересекающимися периодами не запрашивается.
+    Возвращает хранилище и признак полноты данных для каждого периода (в порядке periods):
+    False — часть дней периода не удалось загрузить, итоги по нему были бы занижены.
+    """
+    store = RealizationStore(api_key)
+    spans = _merge_day_ranges((parse_day(date_from), parse_day(date_to)) for date_from, date_to in periods)
+    ranges = [missing for day_from, day_to in spans for missing in store.missing_ranges(day_from, day_to)]
+    print(f"-> API (v5, Реализация): Дней к загрузке из API: {sum((end - start).days + 1 for start, end in ranges)} "
+          f"из {sum((day_to - day_from).days + 1 for day_from, day_to in spans)}.")
+
+    failed_ranges = []
+    for start, end in ranges:
+        # Одинаковые диапазоны, запрошенные одновременно (в том числе другими
+        # воркерами), качаются один раз: остальные читают дни из хранилища
+        key = single_flight.make_key("realization", api_key, start.isoformat(), end.isoformat())
+        if not await single_flight.run(key, lambda start=start, end=end: _load_realization_range_async(api_key, store, start, end)):
+            failed_ranges.append((start, end))
+
+    complete = []
+    for date_from, date_to in periods:
+        day_from, day_to = parse_day(date_from), parse_day(date_to)
+        complete.append(not any(start <= day_to and day_from <= end for start, end in failed_ranges))
+    return store, complete
+
+
+def _merge_day_ranges(ranges) -> List[Tuple[datetime.date, datetime.date]]:
+    """Объединяет пересекающиеся и соседние диапазоны дней."""
+    merged: List[Tuple[datetime.date, datetime.date]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + datetime.timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+async def _load_realization_range_async(api_key: str, store: RealizationStore, start: datetime.date, end: datetime.date) -> bool:
+    """Загружает диапазон дней в хранилище. Возвращает True, если выгрузка полная и сохранена."""
+    with store.range_writer(start, end) as writer:
+        complete = await _stream_wb_realization_report_async(api_key, start.isoformat(), end.isoformat(), writer)
+        if complete:
+            writer.commit()
+        else:
+            # Неполную выгрузку не сохраняем, чтобы ошибка не выглядела как «нет продаж»;
+            # эти дни будут запрошены снова при следующем анализе.
+            print(f"   [WARN] Отчет за {start} - {end} загружен не полностью и не будет использован.")
+    return complete
+
+
+async def get_wb_realization_report_async(api_key: str, date_from: str, date_to: str) -> List[Dict[str, Any]]:
+    """
+    Возвращает отчет о реализации за период списком строк (только колонки REALIZATION_FIELDS).
+    Для больших периодов используйте load_wb_realization_report_async + store.iter_days().
+    """
+    store = await load_wb_realization_report_async(api_key, date_from, date_to)
+    return list(store.iter_rows(parse_day(date_from), parse_day(date_to)))
+
+
+class _WBErrorPayload(Exception):
+    """Вместо JSON-массива API вернуло объект (обычно с описанием ошибки)."""
+
+
+async def _iter_json_array(chunks: AsyncIterator[str]) -> AsyncIterator[Any]:
+    """
+    Инкрементально разбирает JSON-массив верхнего уровня из потока текста
+    и отдает элементы по одному, не держа весь ответ в памяти.
+    Ответ 'null' считается пустым массивом.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos = "", 0
+    started = False
+
+    async for chunk in chunks:
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] == "[":
+                    started = True
+                    pos += 1
+                    continue
+                if buffer[pos] == "n":
+                    if len(buffer) - pos < 4:
+                        break
+                    return
+                # Не массив: дочитываем объект целиком и отдаем как ошибку
+                rest = buffer[pos:] + "".join([c async for c in chunks])
+                raise _WBErrorPayload(json.loads(rest))
+            if buffer[pos] == "]":
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # элемент пришел не полностью — ждем следующий кусок
+            yield item
+
+    # До закрывающей ']' (на ней разбор выходит из функции) поток дойти не успел:
+    # массив открыт, но не закрыт, или в буфере остался недочитанный элемент
+    if started or buffer[pos:].strip():
+        raise ValueError("Поток JSON оборвался посреди массива.")
+
+
+async def _stream_wb_realization_report_async(api_key: str, date_from: str, date_to: str, writer: RangeWriter) -> bool:
     """
     ФИНАЛЬНАЯ ВЕРСИЯ: Получает отчет о реализации с УМНОЙ пагинацией.
+    Страницы разбираются потоково, строки сразу уходят в writer.
+    Возвращает признак полной выгрузки.
     """
-    url = WB_API_V5_URL + "/supplier/reportDetailByPeriod"
-    headers = {'Authorization': f'Bearer {api_key}'}
+    url = WB_API_V5_PATH + "/supplier/reportDetailByPeriod"
+    headers = _auth_headers(api_key)
             
     limit = 100000 # Максимальный лимит на одну порцию
     params = {
@@ -28,204 +186,512 @@ def get_wb_realization_report(api_key: str, date_from: str, date_to: str) -> Lis
     }
     
     print(f"-> API (v5, Реализация): Запрос финального отчета о продажах с {params['dateFrom']}...")
-    all_records = []
     
     while True:
         try:
             print(f"   - Запрос порции данных, начиная с rrdid: {params['rrdid']}...")
-            response = requests.get(url, headers=headers, params=params, timeout=60)
-            response.raise_for_status()
-            
-            records = response.json()
-            
-            if records is None:
-                print("   - Получен 'null' ответ, все данные загружены.")
-                break
-            
-            if isinstance(records, dict) and "errors" in records and records["errors"]:
-                 print(f"   [WARN] API Wildberries вернуло ошибку: {records['errors']}")
-                 break
+            page_rows = 0
+            last_rrd_id = None
+            async with wb_stream("statistics", "realization", "GET", url, headers=headers, params=params, timeout=60) as response:
+                response.raise_for_status()
+                async for record in _iter_json_array(response.aiter_text()):
+                    writer.add(record)
+                    page_rows += 1
+                    last_rrd_id = record.get("rrd_id")
 
-            if not records:
-                print("   - Получен пустой список, все данные загружены.")
+            if not page_rows:
+                print("   - Получен пустой ответ, все данные загружены.")
                 break
-                
-            all_records.extend(records)
-            print(f"   - Успешно получено {len(records)} записей. Всего загружено: {len(all_records)}.")
+
+            print(f"   - Успешно получено {page_rows} записей. Всего загружено: {writer.rows_written}.")
             
             # --- УМНЫЙ ВЫХОД ИЗ ЦИКЛА ---
             # 1. Если записей меньше лимита, это точно последняя страница.
-            # 2. Проверяем наличие 'rrdid' в последней записи.
-            if len(records) < limit or 'rrdid' not in records[-1]:
+            # 2. Проверяем наличие 'rrd_id' в последней записи.
+            if page_rows < limit or last_rrd_id is None:
                 print("   - Обнаружена последняя страница данных.")
                 break
             
-            params['rrdid'] = records[-1]['rrdid']
-            time.sleep(1.2)
+            params['rrdid'] = last_rrd_id
 
-        except requests.RequestException as e:
+        except _WBErrorPayload as e:
+            print(f"   [WARN] API Wildberries вернуло ошибку: {e.args[0]}")
+            return False
+        except (httpx.HTTPError, ValueError) as e:
             print(f"[ERROR] Критическая ошибка при запросе отчета: {e}")
-            break
-        except (KeyError, IndexError) as e:
-             print(f"   - Завершение: не удалось получить rrdid для пагинации. Ошибка: {e}")
-             break
+            return False
              
-    print(f"-> API (v5, Реализация): Финальный отчет, содержащий {len(all_records)} записей, успешно собран.")
-    return all_records
+    if writer.rows_skipped:
+        print(f"   - Пропущено {writer.rows_skipped} записей с датой вне диапазона {date_from}..{date_to}.")
+    print(f"-> API (v5, Реализация): Финальный отчет, содержащий {writer.rows_written} записей, успешно собран.")
+    return True
 
 
-def get_all_wb_products(api_key: str) -> Dict[str, Any]:
-    url = WB_API_V1_URL + "/supplier/stocks"
-    headers = {'Authorization': f'Bearer {api_key}'}
+async def get_all_wb_products_async(api_key: str, date_from: str = None) -> Dict[str, Any]:
+    """
+    Остатки по складам. date_from (lastChangeDate) позволяет получить только
+    строки, изменившиеся с этого момента; по умолчанию — весь список с 2020 года.
+    """
+    key = single_flight.make_key("stocks", api_key, date_from)
+    return await single_flight.run(key, lambda: _fetch_wb_products_async(api_key, date_from))
+
+
+async def _fetch_wb_products_async(api_key: str, date_from: str = None) -> Dict[str, Any]:
+    url = WB_API_V1_PATH + "/supplier/stocks"
     print(f"-> API (v1): Запрос базового списка товаров (остатки)...")
     try:
-        params = {'dateFrom': datetime.datetime(2020, 1, 1).isoformat()}
-        response = requests.get(url, headers=headers, params=params, timeout=30)
+        params = {'dateFrom': date_from or datetime.datetime(2020, 1, 1).isoformat()}
+        response = await wb_request("statistics", "stocks", "GET", url, headers=_auth_headers(api_key), params=params, timeout=30)
         response.raise_for_status()
         data = response.json()
         if not isinstance(data, list):
             return {"products": []}
         print(f"-> API (v1): Базовый список из {len(data)} товаров получен.")
         return {"products": data}
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         error_message = f"Ошибка API при получении списка товаров: {e}"
-        if e.response is not None:
+        if isinstance(e, httpx.HTTPStatusError):
             error_message += f" | Ответ сервера: {e.response.text}"
         return {"error": error_message}
 
-def get_wb_product_cards_details(api_key: str, nm_ids: List[int]) -> List[Dict[str, Any]]:
+async def get_wb_product_cards_details_async(api_key: str, nm_ids: List[int]) -> List[Dict[str, Any]]:
     """
-    ФИНАЛЬНАЯ ВЕРСИЯ: Получает детальную информацию по списку nmID.
+    Детальные карточки по списку nmID. Карточки хранятся локально (utils/card_store.py):
+    сначала из API докачиваются карточки продавца, измененные после курсора
+    синхронизации, затем — порциями параллельно — только те nmID, которых еще нет в хранилище.
     """
-    url = WB_CONTENT_API_URL + "/content/v2/get/cards/list"
-    headers = {'Authorization': f'Bearer {api_key}'}
-    all_cards = []
-    chunk_size = 100
-    
-    print(f"-> API (Content v2): Запрос полной информации для {len(nm_ids)} карточек по nmID...")
-    
-    for i in range(0, len(nm_ids), chunk_size):
-        chunk = nm_ids[i:i + chunk_size]
+    store = _card_store(api_key)
+    await single_flight.run(single_flight.make_key("cards_sync", api_key), lambda: _sync_changed_cards_async(api_key, store))
+
+    nm_ids = list(dict.fromkeys(nm_ids))
+    cards = store.get_many(nm_ids)
+    missing = [nm_id for nm_id in nm_ids if nm_id not in cards]
+    metrics.CACHE_REQUESTS.labels("cards", "hit").inc(len(cards))
+    metrics.CACHE_REQUESTS.labels("cards", "miss").inc(len(missing))
+    print(f"-> API (Content v2): Карточек в локальном хранилище {len(cards)} из {len(nm_ids)}, запрашиваю {len(missing)}...")
+
+    if missing:
+        semaphore = asyncio.Semaphore(WB_CARDS_CONCURRENCY)
+
+        async def fetch_chunk(chunk: List[int]) -> List[Dict[str, Any]]:
+            async with semaphore:
+                return await _fetch_cards_chunk_async(api_key, chunk)
+
+        chunks = [missing[i:i + WB_CARDS_CHUNK_SIZE] for i in range(0, len(missing), WB_CARDS_CHUNK_SIZE)]
+        for chunk_cards in await asyncio.gather(*(fetch_chunk(chunk) for chunk in chunks)):
+            store.put_many(chunk_cards)
+            cards.update((card["nmID"], card) for card in chunk_cards if card.get("nmID") is not None)
+
+    print(f"-> API (Content v2): Итоговая информация по {len(cards)} карточкам успешно собрана.")
+    return [cards[nm_id] for nm_id in nm_ids if nm_id in cards]
+
+
+def _card_store(api_key: str) -> CardStore:
+    store = _card_stores.get(api_key)
+    if store is None:
+        store = _card_stores[api_key] = CardStore(api_key)
+    return store
+
+
+async def _fetch_cards_chunk_async(api_key: str, nm_ids: List[int]) -> List[Dict[str, Any]]:
+    """Одна порция карточек по nmID с повторами при ошибке; после всех попыток — пустой список."""
+    payload = {
+        "settings": {
+            "filter": {"nmIDs": nm_ids},
+            "allowedCategoriesOnly": False # Получаем все категории
+        }
+    }
+    for attempt in range(1, WB_CARDS_ATTEMPTS + 1):
+        try:
+            data = await _post_cards_list_async(api_key, payload)
+            print(f"   - Получено {len(data.get('cards', []))} карточек из {len(nm_ids)}.")
+            return data.get("cards", [])
+        except (httpx.HTTPError, _WBErrorPayload) as e:
+            if attempt == WB_CARDS_ATTEMPTS:
+                print(f"   [ERROR] Порция из {len(nm_ids)} карточек не получена после {attempt} попыток: {e}.")
+                return []
+            print(f"   [WARN] Ошибка при запросе порции карточек (попытка {attempt}): {e}. Повтор...")
+            await asyncio.sleep(2 ** (attempt - 1))
+
+
+async def _post_cards_list_async(api_key: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    url = "/content/v2/get/cards/list"
+    response = await wb_request("content", "cards", "POST", url, headers=_auth_headers(api_key), json=payload, timeout=45)
+    response.raise_for_status()
+    data = response.json()
+    if data.get("error"):
+        raise _WBErrorPayload(data.get("errorText", "Неизвестная ошибка API контента"))
+    return data
+
+
+async def _sync_changed_cards_async(api_key: str, store: CardStore) -> None:
+    """
+    Докачивает карточки продавца, измененные после курсора хранилища
+    (список отсортирован по updatedAt по возрастанию), и сдвигает курсор.
+    """
+    cursor = store.cursor()
+    if cursor is None:
+        # Первая синхронизация: карточки, которые сейчас будут запрошены по nmID, не старше
+        # этого момента; запас покрывает расхождение часов с WB
+        start = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=WB_CARDS_CLOCK_MARGIN_SECONDS)
+        store.set_cursor(start.strftime("%Y-%m-%dT%H:%M:%SZ"), 0)
+        return
+
+    updated_at, nm_id = cursor
+    changed = 0
+    while True:
         payload = {
             "settings": {
-                # ИЗМЕНЕНО: Фильтруем по nmID, а не по vendorCodes
-                "filter": {"nmIDs": chunk},
-                "allowedCategoriesOnly": False # Получаем все категории
+                "sort": {"ascending": True},
+                "cursor": {"limit": WB_CARDS_CHUNK_SIZE, "updatedAt": updated_at, "nmID": nm_id},
+                "filter": {"withPhoto": -1},
             }
         }
-        print(f"   - Отправка порции {i//chunk_size + 1} (nmID с {i} по {i + len(chunk) - 1})...")
         try:
-            response = requests.post(url, headers=headers, json=payload, timeout=45)
-            response.raise_for_status()
-            data = response.json()
-            if "error" in data and data["error"]:
-                error_text = data.get("errorText", "Неизвестная ошибка API контента")
-                print(f"   [WARN] Ошибка от API контента в порции: {error_text}.")
-                continue
-                
-            chunk_cards = data.get("cards", [])
-            all_cards.extend(chunk_cards)
-            print(f"   - Успешно получено {len(chunk_cards)} карточек.")
-            time.sleep(1)
-        except requests.RequestException as e:
-            print(f"   [ERROR] Критическая ошибка при запросе порции: {e}.")
-            continue
-            
-    print(f"-> API (Content v2): Итоговая информация по {len(all_cards)} карточкам успешно собрана.")
-    return all_cards
+            data = await _post_cards_list_async(api_key, payload)
+        except (httpx.HTTPError, _WBErrorPayload) as e:
+            # Курсор остается на последней сохраненной странице, продолжим при следующем анализе
+            print(f"   [WARN] Синхронизация измененных карточек прервана: {e}.")
+            return
 
-def get_wb_orders_report(api_key: str, period_days: int) -> Dict[str, Any]:
-    url = WB_API_V1_URL + "/supplier/orders"
+        page = data.get("cards", [])
+        store.put_many(page)
+        changed += len(page)
+        next_cursor = data.get("cursor") or {}
+        next_position = (next_cursor.get("updatedAt"), next_cursor.get("nmID", 0))
+        if not page or not next_position[0] or next_position == (updated_at, nm_id):
+            # Курсор не сдвинулся: следующий запрос вернул бы ту же страницу
+            if len(page) >= WB_CARDS_CHUNK_SIZE:
+                print("   [WARN] Синхронизация измененных карточек прервана: API не вернуло следующий курсор.")
+            break
+        updated_at, nm_id = next_position
+        store.set_cursor(updated_at, nm_id)
+        if len(page) < WB_CARDS_CHUNK_SIZE:
+            break
+    print(f"-> API (Content v2): Синхронизировано измененных карточек: {changed}.")
+
+async def get_wb_orders_report_async(api_key: str, period_days: int) -> Dict[str, Any]:
+    url = WB_API_V1_PATH + "/supplier/orders"
     date_from = (datetime.datetime.now() - datetime.timedelta(days=period_days)).strftime('%Y-%m-%dT00:00:00')
-    headers = {'Authorization': f'Bearer {api_key}'}
     params = {'dateFrom': date_from, 'flag': 1}
     print(f"-> API: Запрос отчета о ЗАКАЗАХ с {date_from}...")
     try:
-        response = requests.get(url, headers=headers, params=params, timeout=30)
+        response = await wb_request("statistics", "orders", "GET", url, headers=_auth_headers(api_key), params=params, timeout=30)
         response.raise_for_status()
         return {"data": response.json()}
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         return {"data": {"error": f"Ошибка при получении заказов: {e}"}}
 
-def get_wb_analytics_by_sku(api_key: str, nm_ids: list[int], date_from: str, date_to: str) -> dict:
-    url = WB_API_V5_URL + "/supplier/reportDetailByPeriod"
-    headers = {'Authorization': f'Bearer {api_key}'}
-    
+async def load_wb_funnel_async(
+    api_key: str,
+    nm_ids: List[int],
+    periods: List[Tuple[str, str]],
+    whole_catalog: bool = False,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Итоги воронки по nm_ids для каждого периода (в порядке periods), в формате
+    FunnelStore.totals(); nmID без полных данных за период пропускаются.
+    Лимит аналитики — 3 запроса в минуту, поэтому источник выбирается по числу запросов:
+    дневная история (load_wb_funnel_history_async) выгодна для небольших списков SKU
+    и уже загруженных дней, постраничный отчет за период (nm-report/detail) — для
+    больших списков и всего каталога (whole_catalog: без фильтра по nmID).
+    """
+    store = _funnel_store(api_key)
+    nm_ids = sorted(set(nm_ids))
+    spans = [(parse_day(date_from), parse_day(date_to)) for date_from, date_to in periods]
+    unique_spans = list(dict.fromkeys(spans))
+
+    history_requests = _funnel_history_requests(store, nm_ids, periods)
+    pages = -(-len(nm_ids) // WB_ANALYTICS_DETAIL_PAGE_SIZE)
+    detail_requests = sum(pages for day_from, day_to in unique_spans if not store.period_fresh(nm_ids, day_from, day_to))
+    if len(history_requests) <= detail_requests:
+        await _run_funnel_history_async(api_key, store, nm_ids, periods, history_requests)
+
+        async def load(day_from: datetime.date, day_to: datetime.date) -> List[Dict[str, Any]]:
+            cards = store.totals(nm_ids, day_from, day_to)
+            missing = sorted(set(nm_ids) - {card["nmID"] for card in cards})
+            if missing:
+                # Часть дней этих nmID из истории не загрузилась — их итоги берем из отчета за период
+                print(f"   [WARN] Аналитика: {len(missing)} nmID без полной истории за {day_from} - {day_to}, запрашиваю итоги периода.")
+                cards += await _funnel_period_totals_async(api_key, store, missing, day_from, day_to, False)
+            return cards
+    else:
+        if detail_requests:
+            print(f"-> API (Аналитика): {len(nm_ids)} nmID, итоги {len(unique_spans)} периодов постранично "
+                  f"(~{detail_requests} запросов вместо {len(history_requests)} к истории).")
+
+        async def load(day_from: datetime.date, day_to: datetime.date) -> List[Dict[str, Any]]:
+            return await _funnel_period_totals_async(api_key, store, nm_ids, day_from, day_to, whole_catalog)
+
+    totals = dict(zip(unique_spans, await asyncio.gather(*(load(*span) for span in unique_spans))))
+    return [totals[span] for span in spans]
+
+
+async def _funnel_period_totals_async(
+    api_key: str,
+    store: FunnelStore,
+    nm_ids: List[int],
+    day_from: datetime.date,
+    day_to: datetime.date,
+    whole_catalog: bool,
+) -> List[Dict[str, Any]]:
+    """Итоги периода из nm-report/detail: окончательные сохраненные или только что загруженные, иначе []."""
+    if not store.period_fresh(nm_ids, day_from, day_to):
+        key = single_flight.make_key("funnel_detail", api_key, nm_ids, day_from.isoformat(), day_to.isoformat(), whole_catalog)
+        loaded = await single_flight.run(key, lambda: _load_funnel_period_async(api_key, store, nm_ids, day_from, day_to, whole_catalog))
+        if not loaded:
+            # Сохраненные итоги могли остаться от загрузки, пока период еще менялся:
+            # выдавать их за итоги периода нельзя
+            print(f"   [WARN] Аналитика: итоги за {day_from} - {day_to} не загружены.")
+            return []
+    return store.period_totals(nm_ids, day_from, day_to)
+
+
+async def load_wb_funnel_history_async(api_key: str, nm_ids: List[int], periods: List[Tuple[str, str]]) -> FunnelStore:
+    """
+    Докачивает в локальное хранилище дневную статистику воронки для nm_ids за
+    дни всех периодов (без промежутков между ними) и возвращает хранилище;
+    итоги за период — store.totals(). Запрашиваются только отсутствующие или
+    еще изменяемые дни: порциями по WB_ANALYTICS_CHUNK_SIZE nmID и окнами
+    не длиннее WB_ANALYTICS_MAX_DAYS, все запросы — параллельно.
+    """
+    store = _funnel_store(api_key)
+    nm_ids = sorted(set(nm_ids))
+    await _run_funnel_history_async(api_key, store, nm_ids, periods, _funnel_history_requests(store, nm_ids, periods))
+    return store
+
+
+def _period_days(periods: List[Tuple[str, str]]) -> set:
+    days = set()
+    for date_from, date_to in periods:
+        day, last = parse_day(date_from), parse_day(date_to)
+        while day <= last:
+            days.add(day)
+            day += datetime.timedelta(days=1)
+    return days
+
+
+def _funnel_history_requests(store: FunnelStore, nm_ids: List[int], periods: List[Tuple[str, str]]) -> List[Tuple[List[int], datetime.date, datetime.date]]:
+    """Запросы к истории воронки (nmID, первый день, последний день) за недостающие дни периодов."""
+    missing = store.missing_days(nm_ids, _period_days(periods))
+    requests = []
+    for window in _day_windows(sorted(missing), WB_ANALYTICS_MAX_DAYS):
+        window_nm_ids = sorted(set().union(*(missing[day] for day in window)))
+        for i in range(0, len(window_nm_ids), WB_ANALYTICS_CHUNK_SIZE):
+            requests.append((window_nm_ids[i:i + WB_ANALYTICS_CHUNK_SIZE], window[0], window[-1]))
+    return requests
+
+
+async def _run_funnel_history_async(
+    api_key: str,
+    store: FunnelStore,
+    nm_ids: List[int],
+    periods: List[Tuple[str, str]],
+    requests: List[Tuple[List[int], datetime.date, datetime.date]],
+) -> None:
+    print(f"-> API (Аналитика): {len(nm_ids)} nmID за {len(_period_days(periods))} дн., запросов к истории воронки: {len(requests)}.")
+
+    async def load(chunk: List[int], day_from: datetime.date, day_to: datetime.date) -> bool:
+        key = single_flight.make_key("funnel_history", api_key, chunk, day_from.isoformat(), day_to.isoformat())
+        return await single_flight.run(key, lambda: _load_funnel_history_async(api_key, store, chunk, day_from, day_to))
+
+    results = await asyncio.gather(*(load(*request) for request in requests))
+    if not all(results):
+        print(f"   [WARN] Аналитика: не загружено запросов {results.count(False)} из {len(requests)}; эти дни будут запрошены снова.")
+
+
+def _day_windows(days: List[datetime.date], max_days: int) -> List[List[datetime.date]]:
+    """Отсортированные дни -> окна подряд идущих дней длиной не больше max_days."""
+    windows = []
+    for day in days:
+        if windows and day - windows[-1][-1] == datetime.timedelta(days=1) and len(windows[-1]) < max_days:
+            windows[-1].append(day)
+        else:
+            windows.append([day])
+    return windows
+
+
+def _funnel_store(api_key: str) -> FunnelStore:
+    store = _funnel_stores.get(api_key)
+    if store is None:
+        store = _funnel_stores[api_key] = FunnelStore(api_key)
+    return store
+
+
+async def _load_funnel_history_async(api_key: str, store: FunnelStore, nm_ids: List[int], day_from: datetime.date, day_to: datetime.date) -> bool:
+    """Одна порция истории воронки (nmID x дни) в хранилище. True — сохранено."""
     payload = {
         "nmIDs": nm_ids,
-        "period": { "begin": date_from, "end": date_to }, # Используем переданные даты
-        "page": 1
+        "period": {"begin": day_from.isoformat(), "end": day_to.isoformat()},
+        "timezone": "Europe/Moscow",
+        "aggregationLevel": "day",
     }
-    print(f"-> API (v5): Запрос аналитики для {len(nm_ids)} SKU...")
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=45)
+        response = await wb_request("analytics", "nm_report", "POST", WB_ANALYTICS_HISTORY_PATH, headers=_auth_headers(api_key), json=payload, timeout=45)
         response.raise_for_status()
         data = response.json()
-        if data.get("error"):
-             return {"error": data.get("errorText", "Неизвестная ошибка от WB API v5")}
-        return data.get("data", {}).get("cards", [])
-    except requests.RequestException as e:
-        return {"error": f"Ошибка API v5 при получении аналитики: {e}"}
-
-def get_wb_ads_list(api_key: str) -> List[Dict[str, Any]]:
-    url = WB_ADS_API_URL + "/adv/v1/promotion/adverts"
-    headers = {'Authorization': f'Bearer {api_key}'}
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"   [WARN] Ошибка API аналитики ({day_from} - {day_to}, {len(nm_ids)} nmID): {e}")
+        return False
+    if data.get("error"):
+        print(f"   [WARN] Ошибка API аналитики: {data.get('errorText', 'Неизвестная ошибка')}")
+        return False
+    cards = data.get("data")
+    store.add_history(nm_ids, day_from, day_to, cards if isinstance(cards, list) else [])
+    return True
+
+
+async def _load_funnel_period_async(
+    api_key: str,
+    store: FunnelStore,
+    nm_ids: List[int],
+    day_from: datetime.date,
+    day_to: datetime.date,
+    whole_catalog: bool,
+) -> bool:
+    """
+    Итоги периода из постраничного отчета nm-report/detail в хранилище. Сохраняется
+    только полностью загруженный отчет: True — все страницы получены и сохранены.
+    """
+    # Весь каталог — без фильтра; иначе фильтр по nmID порциями не больше страницы
+    chunks = [None] if whole_catalog else [nm_ids[i:i + WB_ANALYTICS_DETAIL_PAGE_SIZE] for i in range(0, len(nm_ids), WB_ANALYTICS_DETAIL_PAGE_SIZE)]
+    cards = []
+    for chunk in chunks:
+        page = 1
+        while True:
+            payload = {
+                "period": {"begin": f"{day_from.isoformat()} 00:00:00", "end": f"{day_to.isoformat()} 23:59:59"},
+                "timezone": "Europe/Moscow",
+                "page": page,
+            }
+            if chunk:
+                payload["nmIDs"] = chunk
+            print(f"   - Аналитика {day_from} - {day_to}: страница {page}...")
+            try:
+                response = await wb_request("analytics", "nm_report", "POST", WB_ANALYTICS_DETAIL_PATH, headers=_auth_headers(api_key), json=payload, timeout=45)
+                response.raise_for_status()
+                data = response.json()
+            except (httpx.HTTPError, ValueError) as e:
+                print(f"   [WARN] Ошибка API аналитики ({day_from} - {day_to}, страница {page}): {e}")
+                return False
+            if data.get("error"):
+                print(f"   [WARN] Ошибка API аналитики: {data.get('errorText', 'Неизвестная ошибка')}")
+                return False
+            body = data.get("data") or {}
+            for card in body.get("cards") or []:
+                selected = (card.get("statistics") or {}).get("selectedPeriod") or {}
+                cards.append({"nmID": card.get("nmID"), **{field: selected.get(field) for field, _ in HISTORY_FIELDS}})
+            if not body.get("isNextPage"):
+                break
+            page += 1
+    store.add_period(nm_ids, day_from, day_to, cards)
+    return True
+
+
+async def get_wb_analytics_by_sku_async(api_key: str, nm_ids: list[int], date_from: str, date_to: str) -> list:
+    """Итоги воронки за период по nmID (см. load_wb_funnel_async)."""
+    return (await load_wb_funnel_async(api_key, nm_ids, [(date_from, date_to)]))[0]
+
+async def get_wb_ads_list_async(api_key: str) -> Optional[List[Dict[str, Any]]]:
+    """Список рекламных кампаний или None при ошибке (пустой список — значит, кампаний нет)."""
+    key = single_flight.make_key("adverts", api_key)
+    return await single_flight.run(key, lambda: _fetch_wb_ads_list_async(api_key))
+
+
+async def _fetch_wb_ads_list_async(api_key: str) -> Optional[List[Dict[str, Any]]]:
+    url = "/adv/v1/promotion/adverts"
     print("-> API: Запрос списка рекламных кампаний...")
     try:
-        response = requests.get(url, headers=headers, timeout=30)
+        response = await wb_request("advert", "adverts", "GET", url, headers=_auth_headers(api_key), timeout=30)
         response.raise_for_status()
-        return response.json()
-    except requests.RequestException:
-        return []
+        campaigns = response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"   [ERROR] Ошибка при запросе списка рекламных кампаний: {e}")
+        return None
+    if not isinstance(campaigns, list):
+        print(f"   [WARN] Неожиданный ответ API рекламы: {str(campaigns)[:200]}")
+        return None
+    return campaigns
 
-def get_wb_reviews(api_key: str, nm_id: int) -> List[Dict[str, Any]]:
+async def _get_wb_feedbacks_async(api_key: str, path: str, params: Dict[str, Any], label: str) -> Optional[List[Dict[str, Any]]]:
     """
-    ФИНАЛЬНАЯ ВЕРСИЯ V6: Возвращаемся к v1 API, но запрашиваем и активные, и архивные отзывы.
+    Все отзывы одного списка (активные или архивные) постранично через skip.
+    Возвращает None при ошибке: неполный список нельзя сохранять, иначе
+    watermark перескочит через недокачанные отзывы.
     """
-    all_reviews = []
-    headers = {'Authorization': f'Bearer {api_key}'}
-    
-    # --- Шаг 1: Запрашиваем АКТИВНЫЕ отзывы ---
-    try:
-        url_active = "https://feedbacks-api.wildberries.ru/api/v1/feedbacks"
-        # Убираем isAnswered, чтобы получить ВСЕ активные
-        params_active = {'nmId': nm_id, 'take': 5000, 'skip': 0, 'order': 'dateDesc'}
-        print(f"-> API (v1, Активные): Запрос активных отзывов для nmId {nm_id}...")
-        
-        response_active = requests.get(url_active, headers=headers, params=params_active, timeout=30)
-        response_active.raise_for_status()
-        active_data = response_active.json()
-        
-        if active_data.get("error"):
-            print(f"   [WARN] API v1 (активные) вернуло ошибку: {active_data.get('errorText')}")
-        else:
-            active_reviews = active_data.get("data", {}).get("feedbacks", [])
-            all_reviews.extend(active_reviews)
-            print(f"   - Найдено {len(active_reviews)} активных отзывов.")
-            
-    except requests.RequestException as e:
-        print(f"   [ERROR] Ошибка при запросе активных отзывов v1: {e}")
+    reviews = []
+    skip = 0
+    print(f"-> API (v1, {label}): Запрос отзывов для nmId {params['nmId']}...")
+    while True:
+        page_params = {**params, 'take': WB_FEEDBACKS_PAGE_SIZE, 'skip': skip}
+        try:
+            response = await wb_request("feedbacks", "feedbacks", "GET", WB_FEEDBACKS_API_PATH + path, headers=_auth_headers(api_key), params=page_params, timeout=30)
+            response.raise_for_status()
+            data = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"   [ERROR] Ошибка при запросе отзывов v1 ({label}): {e}")
+            return None
 
-    # --- Шаг 2: Запрашиваем АРХИВНЫЕ отзывы ---
-    time.sleep(1.2) # Пауза между запросами
-    try:
-        url_archive = "https://feedbacks-api.wildberries.ru/api/v1/feedbacks/archive"
-        params_archive = {'nmId': nm_id, 'take': 5000, 'skip': 0}
-        print(f"-> API (v1, Архив): Запрос архивных отзывов для nmId {nm_id}...")
-        
-        response_archive = requests.get(url_archive, headers=headers, params=params_archive, timeout=30)
-        response_archive.raise_for_status()
-        archive_data = response_archive.json()
-        
-        if archive_data.get("error"):
-             print(f"   [WARN] API v1 (архив) вернуло ошибку: {archive_data.get('errorText')}")
-        else:
-            archive_reviews = archive_data.get("data", {}).get("feedbacks", [])
-            all_reviews.extend(archive_reviews)
-            print(f"   - Найдено {len(archive_reviews)} архивных отзывов.")
+        if data.get("error"):
+            print(f"   [WARN] API v1 ({label}) вернуло ошибку: {data.get('errorText')}")
+            return None
+        page = (data.get("data") or {}).get("feedbacks") or []
+        reviews.extend(page)
 
-    except requests.RequestException as e:
-        print(f"   [ERROR] Ошибка при запросе архивных отзывов v1: {e}")
+        skip += len(page)
+        if len(page) < WB_FEEDBACKS_PAGE_SIZE:
+            break
+        if skip + WB_FEEDBACKS_PAGE_SIZE > WB_FEEDBACKS_MAX_OFFSET:
+            print(f"   [WARN] ({label}): Достигнут предел пагинации API ({skip} отзывов), остальные не получены.")
+            break
+
+    print(f"   - Найдено {len(reviews)} отзывов ({label}).")
+    return reviews
+
+async def get_wb_reviews_async(api_key: str, nm_id: int, date_from: int = None) -> Union[List[Dict[str, Any]], Dict[str, str]]:
+    """
+    Активные и архивные отзывы nmId (оба списка параллельно, с полной пагинацией).
+    date_from (unix-время) ограничивает выборку отзывами не старше этой даты —
+    для инкрементальной докачки в utils/review_store.
+    Если хотя бы один список не получен, возвращает {"error": ...}.
+    """
+    params_active = {'nmId': nm_id, 'order': 'dateDesc'}
+    params_archive = {'nmId': nm_id, 'order': 'dateDesc'}
+    if date_from:
+        params_active['dateFrom'] = params_archive['dateFrom'] = date_from
+    active_reviews, archive_reviews = await asyncio.gather(
+        _get_wb_feedbacks_async(api_key, "/feedbacks", params_active, "Активные"),
+        _get_wb_feedbacks_async(api_key, "/feedbacks/archive", params_archive, "Архив"),
+    )
+    if active_reviews is None or archive_reviews is None:
+        return {"error": f"Не удалось получить отзывы для nmId {nm_id}"}
+    all_reviews = active_reviews + archive_reviews
 
     print(f"-> API (v1): Итоговый сбор для nmId {nm_id} завершен. Суммарно найдено {len(all_reviews)} отзывов.")
-    return all_reviews
\ No newline at end of file
+    return all_reviews
+
+
+# ---------------------------------------------------------------------------
+# Синхронные обертки: тонкий слой над асинхронными функциями
+# ---------------------------------------------------------------------------
+
+def get_wb_realization_report(api_key: str, date_from: str, date_to: str) -> List[Dict[str, Any]]:
+    return run_sync(get_wb_realization_report_async(api_key, date_from, date_to))
+
+def get_all_wb_products(api_key: str, date_from: str = None) -> Dict[str, Any]:
+    return run_sync(get_all_wb_products_async(api_key, date_from))
+
+def get_wb_product_cards_details(api_key: str, nm_ids: List[int]) -> List[Dict[str, Any]]:
+    return run_sync(get_wb_product_cards_details_async(api_key, nm_ids))
+
+def get_wb_orders_report(api_key: str, period_days: int) -> Dict[str, Any]:
+    return run_sync(get_wb_orders_report_async(api_key, period_days))
+
+def get_wb_analytics_by_sku(api_key: str, nm_ids: list[int], date_from: str, date_to: str) -> list:
+    return run_sync(get_wb_analytics_by_sku_async(api_key, nm_ids, date_from, date_to))
+
+def get_wb_ads_list(api_key: str) -> Optional[List[Dict[str, Any]]]:
+    return run_sync(get_wb_ads_list_async(api_key))
+
+def get_wb_reviews(api_key: str, nm_id: int, date_from: int = None) -> Union[List[Dict[str, Any]], Dict[str, str]]:
+    return run_sync(get_wb_reviews_async(api_key, nm_id, date_from))
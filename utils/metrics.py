@@ -0,0 +1,65 @@
+# Файл: utils/metrics.py
+import time
+from typing import Callable, Optional
+
+from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+# Запросы к WB и GigaChat бывают долгими (отчет о реализации, генерация),
+# поэтому верхние корзины гистограмм — минуты, а не секунды.
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+FAST_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+WB_REQUEST_SECONDS = Histogram(
+    "marketmind_wb_request_seconds", "Длительность запроса к WB API (включая чтение тела)",
+    ["host", "family", "status"], buckets=SLOW_BUCKETS,
+)
+WB_RETRIES = Counter("marketmind_wb_retries_total", "Повторы запросов к WB API после 429", ["host", "family"])
+WB_BYTES_DOWNLOADED = Counter("marketmind_wb_bytes_downloaded_total", "Получено байт от WB API", ["host", "family"])
+
+RATE_LIMIT_WAITS = Counter("marketmind_rate_limit_waits_total", "Ожидания квоты перед запросом к WB API", ["host", "family"])
+RATE_LIMIT_WAIT_SECONDS = Counter("marketmind_rate_limit_wait_seconds_total", "Суммарное время ожидания квоты WB API", ["host", "family"])
+
+STAGE_SECONDS = Histogram("marketmind_analysis_stage_seconds", "Длительность этапа анализа", ["stage"], buckets=SLOW_BUCKETS)
+AGENT_SECONDS = Histogram("marketmind_agent_analyze_seconds", "Длительность analyze() агента на один SKU", ["agent"], buckets=FAST_BUCKETS + SLOW_BUCKETS[6:])
+LLM_CALL_SECONDS = Histogram("marketmind_llm_call_seconds", "Длительность вызова GigaChat (без попаданий в кэш)", ["mode", "status"], buckets=SLOW_BUCKETS)
+
+CACHE_REQUESTS = Counter("marketmind_cache_requests_total", "Обращения к кэшам", ["cache", "result"])
+SINGLE_FLIGHT_CALLS = Counter(
+    "marketmind_single_flight_calls_total",
+    "Вызовы загрузок WB через single-flight: leader — загрузил сам, joined — дождался загрузки в процессе, remote — в другом процессе",
+    ["family", "role"],
+)
+ROWS_INGESTED = Counter("marketmind_rows_ingested_total", "Строк данных WB сохранено локально", ["source"])
+
+
+def cache_result(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+class StageTimer:
+    """
+    Обертка над колбэком on_stage: замеряет, сколько длился каждый этап,
+    и передает вызов дальше. Повторные вызовы с тем же этапом (прогресс) не сбрасывают замер.
+    """
+
+    def __init__(self, on_stage: Optional[Callable[..., None]] = None):
+        self.on_stage = on_stage
+        self.stage = None
+        self.started = 0.0
+
+    def __call__(self, stage: str, done: int = None, total: int = None) -> None:
+        if stage != self.stage:
+            self.finish()
+            self.stage, self.started = stage, time.perf_counter()
+        if self.on_stage:
+            self.on_stage(stage, done=done, total=total)
+
+    def finish(self) -> None:
+        if self.stage:
+            STAGE_SECONDS.labels(self.stage).observe(time.perf_counter() - self.started)
+            self.stage = None
+
+
+def render() -> tuple:
+    """Текущие значения всех метрик в текстовом формате Prometheus: (тело, content-type)."""
+    return generate_latest(), CONTENT_TYPE_LATEST
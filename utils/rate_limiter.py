@@ -0,0 +1,139 @@
+# Файл: utils/rate_limiter.py
+import asyncio
+import threading
+import time
+from typing import Dict, Tuple, Mapping
+
+from config import WB_RATE_LIMIT_SCALE
+from utils import metrics
+
+# Лимиты WB API по (хост, семейство эндпоинтов): (запросов в секунду, размер всплеска).
+# Значения взяты из документации WB; реальный темп дополнительно подстраивается
+# по ответам 429 и заголовкам X-Ratelimit-*.
+DEFAULT_LIMITS: Dict[Tuple[str, str], Tuple[float, int]] = {
+    ("statistics", "realization"): (1 / 60, 1),
+    ("statistics", "stocks"): (1 / 60, 1),
+    ("statistics", "orders"): (1 / 60, 1),
+    # Все методы воронки продаж (nm-report) делят один лимит
+    ("analytics", "nm_report"): (3 / 60, 3),
+    ("content", "cards"): (100 / 60, 5),
+    ("advert", "adverts"): (5, 5),
+    ("feedbacks", "feedbacks"): (3, 6),
+    ("suppliers", "charcs"): (100 / 60, 5),
+}
+FALLBACK_LIMIT: Tuple[float, int] = (1, 1)
+
+# Пауза после 429, если сервер не сообщил, сколько ждать
+DEFAULT_BACKOFF_SECONDS = 5.0
+
+
+class TokenBucket:
+    """
+    Потокобезопасный token bucket с резервированием.
+    Каждый вызов reserve() забирает токен (баланс может уйти в минус) и
+    возвращает, сколько нужно подождать, — так конкурентные запросы
+    выстраиваются в очередь и делят один бюджет.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        # Счетчик блокировок: резерв, сделанный до блокировки, недействителен
+        self.blocks = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        # Во время блокировки updated указывает в будущее: токены не копятся
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            # Отсчет идет от конца блокировки: ожидающие выходят по одному с шагом 1/rate
+            start = max(now, self.updated)
+            return start - now + (-self.tokens / self.rate if self.tokens < 0 else 0.0)
+
+    def block_for(self, seconds: float) -> None:
+        """
+        Запрещает запросы на заданное время: до его конца токены не пополняются,
+        а сразу после разрешен один запрос, следующие — в темпе rate. Резервы,
+        сделанные до блокировки, сбрасываются: их владельцы резервируют заново
+        (см. acquire), поэтому не выходят все разом после ее окончания.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.updated = max(self.updated, self.blocked_until)
+            self.tokens = 1.0
+            self.blocks += 1
+
+
+_buckets: Dict[Tuple[str, str], TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(host_key: str, family: str) -> TokenBucket:
+    key = (host_key, family)
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            rate, burst = DEFAULT_LIMITS.get(key, FALLBACK_LIMIT)
+            bucket = _buckets[key] = TokenBucket(rate * WB_RATE_LIMIT_SCALE, burst)
+        return bucket
+
+
+async def acquire(host_key: str, family: str) -> None:
+    """Ждет ровно столько, сколько требует квота для (хост, семейство)."""
+    bucket = get_bucket(host_key, family)
+    blocks, delay = bucket.blocks, bucket.reserve()
+    while delay > 0:
+        metrics.RATE_LIMIT_WAITS.labels(host_key, family).inc()
+        metrics.RATE_LIMIT_WAIT_SECONDS.labels(host_key, family).inc(delay)
+        print(f"   [RateLimit] {host_key}/{family}: ожидание {delay:.1f} с.")
+        await asyncio.sleep(delay)
+        # Пока ждали, пришел 429: резерв сброшен, встаем в очередь за блокировкой
+        if bucket.blocks == blocks:
+            break
+        blocks, delay = bucket.blocks, bucket.reserve()
+
+
+def _header_seconds(headers: Mapping[str, str], name: str) -> float | None:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        return None
+
+
+def observe(host_key: str, family: str, status_code: int, headers: Mapping[str, str]) -> float:
+    """
+    Учитывает ответ сервера. Возвращает паузу перед повтором (для 429) или 0.
+    Поддерживаются Retry-After и заголовки WB X-Ratelimit-Retry/-Remaining/-Reset.
+    """
+    bucket = get_bucket(host_key, family)
+
+    if status_code == 429:
+        retry_after = _header_seconds(headers, "X-Ratelimit-Retry")
+        if retry_after is None:
+            retry_after = _header_seconds(headers, "Retry-After")
+        if retry_after is None:
+            retry_after = max(DEFAULT_BACKOFF_SECONDS, 1 / bucket.rate)
+        bucket.block_for(retry_after)
+        return retry_after
+
+    remaining = _header_seconds(headers, "X-Ratelimit-Remaining")
+    reset = _header_seconds(headers, "X-Ratelimit-Reset")
+    if remaining == 0 and reset:
+        # Квота исчерпана: следующий запрос имеет смысл только после сброса
+        bucket.block_for(reset)
+    return 0.0
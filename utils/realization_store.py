@@ -0,0 +1,257 @@
+# Файл: utils/realization_store.py
+import datetime
+import hashlib
+import json
+import os
+import struct
+import tempfile
+from typing import Dict, Any, IO, List, Iterator, Optional, Tuple
+
+import numpy as np
+
+from config import DATA_DIR
+from utils import metrics
+
+# Колонки отчета, которые нужны агентам (плюс rrd_id для пагинации; rr_dt
+# задает день и отдельно не хранится). Остальные поля не храним.
+REALIZATION_FIELDS = (
+    "rrd_id",
+    "rr_dt",
+    "sa_name",
+    "doc_type_name",
+    "quantity",
+    "retail_price_withdisc_rub",
+    "ppvz_for_pay",
+)
+
+# Строка дня в колоночном виде. Строковые поля хранятся кодами в словаре дня.
+REALIZATION_DTYPE = np.dtype([
+    ("rrd_id", "<i8"),
+    ("sa_name", "<i4"),
+    ("doc_type_name", "<i2"),
+    ("quantity", "<i4"),
+    ("retail_price_withdisc_rub", "<f8"),
+    ("ppvz_for_pay", "<f8"),
+])
+STRING_COLUMNS = ("sa_name", "doc_type_name")
+
+# Сколько строк дня держать в памяти до сброса во временный файл
+FLUSH_ROWS = 10000
+
+# WB дорабатывает строки отчета о реализации еще несколько дней после даты.
+# День считается окончательным, если он был загружен не раньше, чем через
+# MUTABLE_DAYS дней после себя; иначе при следующем запросе он перезагружается.
+MUTABLE_DAYS = 7
+
+# Хвост файла дня: длина JSON-словаря строк, записанного сразу после массива
+_VOCABULARY_LENGTH = struct.Struct("<Q")
+
+
+def parse_day(value: str) -> datetime.date:
+    """Принимает 'YYYY-MM-DD' или ISO datetime и возвращает дату."""
+    return datetime.date.fromisoformat(value[:10])
+
+
+class RealizationDay:
+    """Строки одного дня: колонки (memory-mapped массив) и словари строковых полей."""
+
+    def __init__(self, day: datetime.date, rows: np.ndarray, vocabulary: Dict[str, List[str]]):
+        self.day = day
+        self.rows = rows
+        self.vocabulary = vocabulary
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def to_records(self) -> Iterator[Dict[str, Any]]:
+        """Строки в виде словарей — только для совместимости, агенты работают с колонками."""
+        rr_dt = self.day.isoformat()
+        for row in self.rows.tolist():
+            record = dict(zip(REALIZATION_DTYPE.names, row))
+            for column in STRING_COLUMNS:
+                record[column] = self.vocabulary[column][record[column]] or None
+            record["rr_dt"] = rr_dt
+            yield record
+
+
+class RealizationStore:
+    """
+    Локальное хранилище отчета о реализации, разбитое по дням (поле rr_dt).
+    Каждый день — один файл .day: NumPy-массив в формате .npy (читается через mmap),
+    за ним словарь строковых значений в JSON и его длина. Массив и словарь
+    публикуются одним os.replace, поэтому читатель не увидит их из разных загрузок.
+    Время загрузки дня берется из mtime файла, отдельные метаданные не нужны.
+    """
+
+    def __init__(self, api_key: str, root: str = None):
+        seller = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+        self.path = os.path.join(root or os.path.join(DATA_DIR, "realization"), seller)
+        os.makedirs(self.path, exist_ok=True)
+
+    def _day_path(self, day: datetime.date) -> str:
+        return os.path.join(self.path, f"{day.isoformat()}.day")
+
+    def _is_fresh(self, day: datetime.date) -> bool:
+        try:
+            fetched_at = datetime.datetime.fromtimestamp(os.path.getmtime(self._day_path(day)))
+        except OSError:
+            return False
+        return fetched_at.date() >= day + datetime.timedelta(days=MUTABLE_DAYS)
+
+    def missing_ranges(self, date_from: datetime.date, date_to: datetime.date) -> List[Tuple[datetime.date, datetime.date]]:
+        """Непрерывные диапазоны дней, которых нет в хранилище или которые еще могут измениться."""
+        ranges = []
+        start = None
+        day = date_from
+        while day <= date_to:
+            if not self._is_fresh(day):
+                start = start or day
+            elif start:
+                ranges.append((start, day - datetime.timedelta(days=1)))
+                start = None
+            day += datetime.timedelta(days=1)
+        if start:
+            ranges.append((start, date_to))
+        return ranges
+
+    def range_writer(self, date_from: datetime.date, date_to: datetime.date) -> "RangeWriter":
+        """Потоковая запись диапазона дней. Дни становятся видны только после commit()."""
+        return RangeWriter(self, date_from, date_to)
+
+    def load_day(self, day: datetime.date) -> Optional[RealizationDay]:
+        path = self._day_path(day)
+        try:
+            # Хвост за массивом np.load не читает: memmap ограничен его размером
+            rows = np.load(path, mmap_mode="r")
+            with open(path, "rb") as f:
+                f.seek(-_VOCABULARY_LENGTH.size, os.SEEK_END)
+                (length,) = _VOCABULARY_LENGTH.unpack(f.read(_VOCABULARY_LENGTH.size))
+                f.seek(-_VOCABULARY_LENGTH.size - length, os.SEEK_END)
+                vocabulary = json.loads(f.read(length))
+        except FileNotFoundError:
+            return None
+        return RealizationDay(day, rows, vocabulary)
+
+    def iter_days(self, date_from: datetime.date, date_to: datetime.date) -> Iterator[RealizationDay]:
+        day = date_from
+        while day <= date_to:
+            loaded = self.load_day(day)
+            if loaded is not None:
+                yield loaded
+            day += datetime.timedelta(days=1)
+
+    def iter_rows(self, date_from: datetime.date, date_to: datetime.date) -> Iterator[Dict[str, Any]]:
+        for loaded in self.iter_days(date_from, date_to):
+            yield from loaded.to_records()
+
+
+class _DayBuffer:
+    """Строки одного дня в процессе загрузки: временный бинарный файл и словари строк."""
+
+    def __init__(self, directory: str):
+        fd, self.tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        self.file: IO[bytes] = os.fdopen(fd, "wb")
+        self.pending: List[Tuple] = []
+        self.codes: Dict[str, Dict[str, int]] = {column: {} for column in STRING_COLUMNS}
+
+    def code(self, column: str, value: Optional[str]) -> int:
+        codes = self.codes[column]
+        value = value or ""
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+        return code
+
+    def flush(self) -> None:
+        if self.pending:
+            np.array(self.pending, dtype=REALIZATION_DTYPE).tofile(self.file)
+            self.pending.clear()
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
+
+
+class RangeWriter:
+    """
+    Раскладывает строки отчета по дням по мере поступления: в памяти держится
+    не больше FLUSH_ROWS строк на день, остальное уже лежит во временных файлах.
+    commit() публикует все дни диапазона (включая дни без строк); без commit()
+    временные файлы удаляются.
+    """
+
+    def __init__(self, store: RealizationStore, date_from: datetime.date, date_to: datetime.date):
+        self.store = store
+        self.date_from = date_from
+        self.date_to = date_to
+        self.rows_written = 0
+        self.rows_skipped = 0
+        self._days: Dict[datetime.date, _DayBuffer] = {}
+        self._committed = False
+
+    def __enter__(self) -> "RangeWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if not self._committed:
+            self.discard()
+
+    def _buffer_for(self, day: datetime.date) -> _DayBuffer:
+        buffer = self._days.get(day)
+        if buffer is None:
+            buffer = self._days[day] = _DayBuffer(self.store.path)
+        return buffer
+
+    def add(self, record: Dict[str, Any]) -> None:
+        rr_dt = record.get("rr_dt")
+        row_day = parse_day(rr_dt) if rr_dt else self.date_from
+        if not self.date_from <= row_day <= self.date_to:
+            # Строка чужого дня: ее день загружается (или загрузится) своим диапазоном,
+            # а перенос на границу исказил бы день и задвоил строку
+            self.rows_skipped += 1
+            return
+        buffer = self._buffer_for(row_day)
+        buffer.pending.append((
+            record.get("rrd_id") or 0,
+            buffer.code("sa_name", record.get("sa_name")),
+            buffer.code("doc_type_name", record.get("doc_type_name")),
+            record.get("quantity") or 0,
+            record.get("retail_price_withdisc_rub") or 0,
+            record.get("ppvz_for_pay") or 0,
+        ))
+        if len(buffer.pending) >= FLUSH_ROWS:
+            buffer.flush()
+        self.rows_written += 1
+
+    def commit(self) -> None:
+        day = self.date_from
+        while day <= self.date_to:
+            self._buffer_for(day)  # пустой массив для дней без продаж
+            day += datetime.timedelta(days=1)
+        for day, buffer in self._days.items():
+            buffer.close()
+            rows = np.fromfile(buffer.tmp_path, dtype=REALIZATION_DTYPE)
+            os.remove(buffer.tmp_path)
+            vocabulary = json.dumps({column: list(codes) for column, codes in buffer.codes.items()}, ensure_ascii=False).encode("utf-8")
+            self._publish(self.store._day_path(day), lambda f: self._write_day(f, rows, vocabulary))
+        self._days.clear()
+        self._committed = True
+        metrics.ROWS_INGESTED.labels("realization").inc(self.rows_written)
+
+    @staticmethod
+    def _write_day(f: IO[bytes], rows: np.ndarray, vocabulary: bytes) -> None:
+        np.save(f, rows)
+        f.write(vocabulary)
+        f.write(_VOCABULARY_LENGTH.pack(len(vocabulary)))
+
+    def _publish(self, path: str, write) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.store.path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    def discard(self) -> None:
+        for buffer in self._days.values():
+            buffer.file.close()
+            os.remove(buffer.tmp_path)
+        self._days.clear()
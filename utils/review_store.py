@@ -0,0 +1,125 @@
+# Файл: utils/review_store.py
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Any, Iterable, Optional
+
+from config import DATA_DIR
+from utils import metrics
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS feedbacks (
+    id TEXT PRIMARY KEY,
+    nm_id INTEGER NOT NULL,
+    created_date TEXT,
+    valuation INTEGER NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS feedbacks_nm_date ON feedbacks (nm_id, created_date);
+CREATE TABLE IF NOT EXISTS feedback_stats (
+    nm_id INTEGER PRIMARY KEY,
+    total INTEGER NOT NULL DEFAULT 0,
+    rating_sum INTEGER NOT NULL DEFAULT 0,
+    five_star INTEGER NOT NULL DEFAULT 0,
+    watermark TEXT
+);
+"""
+
+# Сколько последних негативных отзывов (оценка <= 3) отдавать в сводке
+RECENT_NEGATIVE_LIMIT = 3
+
+
+def watermark_timestamp(watermark: Optional[str]) -> Optional[int]:
+    """createdDate отзыва (ISO, обычно с 'Z') -> unix-время для параметра dateFrom."""
+    if not watermark:
+        return None
+    return int(datetime.datetime.fromisoformat(watermark.replace("Z", "+00:00")).timestamp())
+
+
+class ReviewStore:
+    """
+    Локальное хранилище отзывов WB (SQLite), одно на продавца.
+    Для каждого nmId хранится watermark — самая поздняя createdDate среди
+    сохраненных отзывов, — и счетчики (всего, сумма оценок, пятерки),
+    которые обновляются только на новых отзывах, без пересчета по всей истории.
+    """
+
+    def __init__(self, api_key: str, root: str = None):
+        seller = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+        root = root or os.path.join(DATA_DIR, "reviews")
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.join(root, f"{seller}.sqlite")
+        # Хранилище используют и event loop сервера, и поток синхронных оберток
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def watermark(self, nm_id: int) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT watermark FROM feedback_stats WHERE nm_id = ?", (nm_id,)).fetchone()
+        return row[0] if row else None
+
+    def add_reviews(self, nm_id: int, reviews: Iterable[Dict[str, Any]]) -> int:
+        """
+        Сохраняет отзывы одной транзакцией и возвращает число новых.
+        Уже известные отзывы (по id) пропускаются и счетчики не меняют.
+        """
+        added = rating_sum = five_star = 0
+        watermark = None
+        with self._lock, self._conn:
+            for review in reviews:
+                if not review.get("id"):
+                    continue
+                valuation = review.get("productValuation") or 0
+                created = review.get("createdDate")
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO feedbacks (id, nm_id, created_date, valuation, payload) VALUES (?, ?, ?, ?, ?)",
+                    (review.get("id"), nm_id, created, valuation, json.dumps(review, ensure_ascii=False)),
+                )
+                if cursor.rowcount:
+                    added += 1
+                    rating_sum += valuation
+                    five_star += valuation == 5
+                if created and (watermark is None or created > watermark):
+                    watermark = created
+
+            self._conn.execute(
+                """
+                INSERT INTO feedback_stats (nm_id, total, rating_sum, five_star, watermark) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(nm_id) DO UPDATE SET
+                    total = total + excluded.total,
+                    rating_sum = rating_sum + excluded.rating_sum,
+                    five_star = five_star + excluded.five_star,
+                    watermark = MAX(COALESCE(watermark, ''), COALESCE(excluded.watermark, ''))
+                """,
+                (nm_id, added, rating_sum, five_star, watermark),
+            )
+        metrics.ROWS_INGESTED.labels("reviews").inc(added)
+        return added
+
+    def summary(self, nm_id: int) -> Dict[str, Any]:
+        """Сводка по отзывам nmId из счетчиков и последние негативные отзывы."""
+        with self._lock:
+            stats = self._conn.execute(
+                "SELECT total, rating_sum, five_star FROM feedback_stats WHERE nm_id = ?", (nm_id,)
+            ).fetchone()
+            negative = self._conn.execute(
+                "SELECT payload FROM feedbacks WHERE nm_id = ? AND valuation <= 3 ORDER BY created_date DESC LIMIT ?",
+                (nm_id, RECENT_NEGATIVE_LIMIT),
+            ).fetchall()
+
+        total, rating_sum, five_star = stats or (0, 0, 0)
+        return {
+            "reviews_total": total,
+            "average_rating": round(rating_sum / total, 2) if total else 0,
+            "five_star_count": five_star,
+            "recent_negative": [json.loads(payload) for (payload,) in negative],
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
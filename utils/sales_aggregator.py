@@ -0,0 +1,97 @@
+# Файл: utils/sales_aggregator.py
+from typing import Dict, Any, Iterable
+
+import numpy as np
+
+from utils.realization_store import RealizationDay
+
+# Тип документа в отчете о реализации, по которому считаются продажи
+SALE_DOC_TYPE = "Продажа"
+
+
+def normalize_sku(sku: str) -> str:
+    """Приводит артикул к виду, в котором он сравнивается с `sa_name` из отчета."""
+    return sku.replace(" ", "").lower()
+
+
+def aggregate_realization_report(records: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Агрегирует отчет о реализации за ОДИН проход.
+
+    Возвращает индекс {нормализованный sa_name -> {doc_type_name -> итоги}},
+    где итоги содержат gross/net выручку и количество единиц. Строки с нулевым
+    количеством пропускаются, как и в исходной логике SalesAgent.
+    """
+    index: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    normalized_cache: Dict[str, str] = {}
+
+    for item in records:
+        report_sku = item.get('sa_name')
+        if not report_sku:
+            continue
+
+        quantity = item.get('quantity') or 0
+        if quantity == 0:
+            continue
+
+        # Нормализуем каждый уникальный sa_name только один раз
+        normalized = normalized_cache.get(report_sku)
+        if normalized is None:
+            normalized = normalized_cache[report_sku] = normalize_sku(report_sku)
+
+        by_doc_type = index.get(normalized)
+        if by_doc_type is None:
+            by_doc_type = index[normalized] = {}
+
+        doc_type = item.get("doc_type_name") or ""
+        totals = by_doc_type.get(doc_type)
+        if totals is None:
+            totals = by_doc_type[doc_type] = {"gross_revenue_rub": 0.0, "net_revenue_rub": 0.0, "units": 0}
+
+        totals["gross_revenue_rub"] += item.get('retail_price_withdisc_rub') or 0
+        totals["net_revenue_rub"] += item.get('ppvz_for_pay') or 0
+        totals["units"] += quantity
+
+    return index
+
+
+def aggregate_realization_days(days: Iterable[RealizationDay]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    То же, что aggregate_realization_report, но по колонкам хранилища: строки
+    каждого дня сворачиваются векторно (группировка по кодам SKU и типа документа),
+    словари создаются только для итогов, а не для строк отчета.
+    """
+    index: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    normalized_cache: Dict[str, str] = {}
+
+    for day in days:
+        rows = day.rows[day.rows["quantity"] != 0]
+        if not len(rows):
+            continue
+
+        sku_names = day.vocabulary["sa_name"]
+        doc_types = day.vocabulary["doc_type_name"]
+        keys = rows["sa_name"].astype(np.int64) * len(doc_types) + rows["doc_type_name"]
+        groups, inverse = np.unique(keys, return_inverse=True)
+        gross = np.bincount(inverse, weights=rows["retail_price_withdisc_rub"])
+        net = np.bincount(inverse, weights=rows["ppvz_for_pay"])
+        units = np.bincount(inverse, weights=rows["quantity"])
+
+        for key, gross_sum, net_sum, units_sum in zip(groups.tolist(), gross.tolist(), net.tolist(), units.tolist()):
+            sku_code, doc_code = divmod(key, len(doc_types))
+            report_sku = sku_names[sku_code]
+            if not report_sku:
+                continue
+
+            normalized = normalized_cache.get(report_sku)
+            if normalized is None:
+                normalized = normalized_cache[report_sku] = normalize_sku(report_sku)
+
+            totals = index.setdefault(normalized, {}).setdefault(
+                doc_types[doc_code], {"gross_revenue_rub": 0.0, "net_revenue_rub": 0.0, "units": 0}
+            )
+            totals["gross_revenue_rub"] += gross_sum
+            totals["net_revenue_rub"] += net_sum
+            totals["units"] += int(units_sum)
+
+    return index
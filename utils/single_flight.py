@@ -0,0 +1,137 @@
+# Файл: utils/single_flight.py
+"""
+Single-flight для запросов к WB API: одновременные вызовы с одинаковым
+ключом (эндпоинт + параметры) ждут одну выполняющуюся загрузку.
+
+- Внутри процесса первый вызов запускает загрузку задачей, остальные ждут ее результат.
+- Между процессами (воркеры uvicorn) ведущий берет Redis-блокировку на ключ,
+  а ведомые ждут ее снятия и забирают результат, который ведущий кладет
+  в Redis на RESULT_TTL_SECONDS. Результат не кэшируется дольше: вызов,
+  пришедший после завершения загрузки, запускает новую.
+- Результат должен сериализоваться в JSON. Загрузки, которые пишут данные на
+  диск (отчет о реализации), возвращают только признак успеха — данные ведомые
+  процессы читают из общего DATA_DIR.
+
+Без Redis работает только внутрипроцессная часть.
+"""
+import asyncio
+import hashlib
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict
+
+import orjson
+from redis.exceptions import LockError, RedisError
+
+from config import SINGLE_FLIGHT_LOCK_SECONDS, SINGLE_FLIGHT_WAIT_SECONDS
+from utils import cache, metrics
+
+KEY_PREFIX = "flight:"
+RESULT_TTL_SECONDS = 30
+POLL_INTERVAL_SECONDS = 0.2
+
+# Загрузки текущего процесса: {loop -> {ключ -> задача}}
+_flights: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Task]]" = weakref.WeakKeyDictionary()
+
+
+def make_key(family: str, api_key: str, *params: Any) -> str:
+    """Ключ загрузки: семейство эндпоинтов, продавец (хэш API-ключа) и параметры запроса."""
+    digest = hashlib.sha256(api_key.encode())
+    digest.update(orjson.dumps(params, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS))
+    return f"{family}:{digest.hexdigest()[:32]}"
+
+
+def _family(key: str) -> str:
+    return key.split(":", 1)[0]
+
+
+async def run(key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+    """Результат fetch(), общий для всех одновременных вызовов с этим ключом."""
+    flights = _flights.setdefault(asyncio.get_running_loop(), {})
+    family = _family(key)
+    task = flights.get(key)
+    if task is None:
+        metrics.SINGLE_FLIGHT_CALLS.labels(family, "leader").inc()
+        task = flights[key] = asyncio.create_task(_run_shared(key, fetch))
+        task.add_done_callback(lambda _: flights.pop(key, None))
+    else:
+        metrics.SINGLE_FLIGHT_CALLS.labels(family, "joined").inc()
+    # Отмена одного из ожидающих не должна прерывать загрузку для остальных
+    return await asyncio.shield(task)
+
+
+async def _run_shared(key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+    client = cache.get_redis()
+    if client is None:
+        return await fetch()
+
+    lock = client.lock(KEY_PREFIX + "lock:" + key, timeout=SINGLE_FLIGHT_LOCK_SECONDS)
+    try:
+        acquired = await lock.acquire(blocking=False)
+    except (RedisError, OSError) as e:
+        cache.redis_failed(e)
+        return await fetch()
+
+    if not acquired:
+        # Загрузку уже ведет другой процесс
+        metrics.SINGLE_FLIGHT_CALLS.labels(_family(key), "remote").inc()
+        found, result = await _wait_remote(client, key, lock.name)
+        if found:
+            return result
+        return await fetch()
+
+    result_key = KEY_PREFIX + "result:" + key
+    keepalive = asyncio.create_task(_extend_lock(lock))
+    try:
+        # Результат предыдущей загрузки с этим ключом ведомым уже не нужен
+        await _ignore_redis_errors(client.delete(result_key))
+        result = await fetch()
+        await _ignore_redis_errors(client.set(result_key, cache.encode(result), ex=RESULT_TTL_SECONDS))
+        return result
+    finally:
+        keepalive.cancel()
+        try:
+            await lock.release()
+        except (LockError, RedisError, OSError):
+            pass
+
+
+async def _ignore_redis_errors(command: Awaitable) -> None:
+    try:
+        await command
+    except (RedisError, OSError) as e:
+        cache.redis_failed(e)
+
+
+async def _extend_lock(lock) -> None:
+    """Продлевает блокировку, пока идет долгая загрузка (отчет о реализации за год и т.п.)."""
+    while True:
+        await asyncio.sleep(SINGLE_FLIGHT_LOCK_SECONDS / 3)
+        try:
+            await lock.extend(SINGLE_FLIGHT_LOCK_SECONDS, replace_ttl=True)
+        except (LockError, RedisError, OSError):
+            return
+
+
+async def _wait_remote(client, key: str, lock_name: str) -> tuple:
+    """
+    Ждет завершения чужой загрузки: (True, результат), если его удалось получить,
+    иначе (False, None) — тогда вызывающий загружает сам.
+    """
+    result_key = KEY_PREFIX + "result:" + key
+    deadline = time.monotonic() + SINGLE_FLIGHT_WAIT_SECONDS
+    try:
+        while time.monotonic() < deadline:
+            await asyncio.sleep(POLL_INTERVAL_SECONDS)
+            data = await client.get(result_key)
+            if data is not None:
+                return True, cache.decode(data)
+            if not await client.exists(lock_name):
+                break
+        # Блокировка могла быть снята сразу после последней проверки результата
+        data = await client.get(result_key)
+        if data is not None:
+            return True, cache.decode(data)
+    except (RedisError, OSError) as e:
+        cache.redis_failed(e)
+    return False, None
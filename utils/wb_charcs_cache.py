@@ -1,21 +1,103 @@
 # utils/wb_charcs_cache.py
-import requests
+import asyncio
+from typing import Iterable, Optional
+
+import httpx
+
 from config import MARKETPLACE_API_KEY
+from utils import cache, metrics
+from utils.http_client import wb_request, run_sync
 
-_charcs_cache = {}
+# Обязательные характеристики предмета меняются редко — храним сутки.
+CHARCS_TTL_SECONDS = 24 * 3600
+# Неудачи тоже кэшируем, чтобы не запрашивать плохой subject_id для каждого SKU:
+# ошибки запроса (4xx) — надолго, временные сбои (сеть, 5xx, 429) — ненадолго.
+NEGATIVE_TTL_SECONDS = 3600
+TRANSIENT_TTL_SECONDS = 60
+PREFETCH_CONCURRENCY = 5
 
-def get_required_charcs(subject_id: int) -> set:
-    if subject_id in _charcs_cache:
-        return _charcs_cache[subject_id]
-    url = f"https://suppliers-api.wildberries.ru/public/api/v1/object/charcs/{subject_id}"
+KEY_PREFIX = "charcs:"
+
+
+def _key(subject_id: int) -> str:
+    return KEY_PREFIX + str(subject_id)
+
+
+async def _remember(subject_id: int, required: frozenset, ttl: float) -> frozenset:
+    await cache.set(_key(subject_id), sorted(required), ex=int(ttl))
+    return required
+
+
+def _lookup(subject_id: int) -> Optional[frozenset]:
+    """Ищет характеристики в памяти процесса (без Redis). None — нет в кэше."""
+    required = cache.peek(_key(subject_id))
+    metrics.cache_result("charcs", required is not None)
+    return frozenset(required) if required is not None else None
+
+
+async def _lookup_async(subject_id: int) -> frozenset:
+    """Характеристики из кэша (память процесса, затем Redis), при промахе — из API."""
+    required = await cache.get(_key(subject_id))
+    metrics.cache_result("charcs", required is not None)
+    if required is not None:
+        return frozenset(required)
+    return await _fetch_required_charcs_async(subject_id)
+
+
+async def _fetch_required_charcs_async(subject_id: int) -> frozenset:
+    url = f"/public/api/v1/object/charcs/{subject_id}"
     headers = {"Authorization": f"Bearer {MARKETPLACE_API_KEY}"}
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        response = await wb_request("suppliers", "charcs", "GET", url, headers=headers, timeout=10)
         response.raise_for_status()
         data = response.json()
-        required = {char['name'] for char in data if char.get('required')}
-        _charcs_cache[subject_id] = required
-        return required
+        required = frozenset(char['name'] for char in data if char.get('required'))
+        return await _remember(subject_id, required, CHARCS_TTL_SECONDS)
+    except httpx.HTTPStatusError as e:
+        print(f"[Charcs]: Ошибка при запросе: {e}")
+        status = e.response.status_code
+        ttl = NEGATIVE_TTL_SECONDS if 400 <= status < 500 and status != 429 else TRANSIENT_TTL_SECONDS
+        return await _remember(subject_id, frozenset(), ttl)
     except Exception as e:
         print(f"[Charcs]: Ошибка при запросе: {e}")
-        return set()
+        return await _remember(subject_id, frozenset(), TRANSIENT_TTL_SECONDS)
+
+
+async def prefetch_required_charcs_async(subject_ids: Iterable[int], max_concurrency: int = PREFETCH_CONCURRENCY) -> None:
+    """Заранее загружает характеристики всех предметов, которых еще нет в кэше."""
+    subject_ids = [subject_id for subject_id in set(subject_ids) if subject_id]
+    # Кэш проверяется одним пакетом: промахи памяти дочитываются из Redis одним MGET
+    cached = await cache.get_many(_key(subject_id) for subject_id in subject_ids)
+    missing = [subject_id for subject_id in subject_ids if _key(subject_id) not in cached]
+    metrics.CACHE_REQUESTS.labels("charcs", "hit").inc(len(subject_ids) - len(missing))
+    metrics.CACHE_REQUESTS.labels("charcs", "miss").inc(len(missing))
+    if not missing:
+        return
+    print(f"[Charcs]: Предзагрузка обязательных характеристик для {len(missing)} предметов...")
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch_one(subject_id: int) -> None:
+        async with semaphore:
+            await _fetch_required_charcs_async(subject_id)
+
+    await asyncio.gather(*(fetch_one(subject_id) for subject_id in missing))
+
+
+async def get_required_charcs_async(subject_id: int) -> set:
+    """Для асинхронного анализа: после предзагрузки почти всегда попадает в память процесса."""
+    return set(await _lookup_async(subject_id))
+
+
+def get_required_charcs(subject_id: int) -> set:
+    required = _lookup(subject_id)
+    if required is None:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Запасной путь для синхронного кода: ищем в Redis или запрашиваем из API
+            required = run_sync(_lookup_async(subject_id))
+        else:
+            # Внутри event loop синхронный запрос заблокировал бы цикл: характеристики неизвестны
+            print(f"[Charcs]: Характеристики предмета {subject_id} не предзагружены, проверка пропущена.")
+            required = frozenset()
+    return set(required)